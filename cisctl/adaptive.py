@@ -0,0 +1,288 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""AIMD concurrency limits of listings and copies per registry host, shared by multiprocessing.Pool workers.
+
+Listings and copies in flight to one registry host are capped by its limit. A healthy
+response adds 1 / limit, about one more slot per round of requests, a response slower
+than `latency_tolerance` times the recent response time of its request kind (manifests,
+blobs, uploads, tags) holds it, and 429, 5xx, connection errors and skopeo rate limit
+errors halve it, at most once per `cooldown` seconds.
+
+ref https://en.wikipedia.org/wiki/Additive_increase/multiplicative_decrease
+"""
+
+import asyncio
+import contextlib
+import multiprocessing
+import re
+import time
+from typing import Dict
+from typing import List
+from urllib.parse import urlparse
+
+from cisctl import config
+from cisctl import metrics
+from cisctl import ratelimit
+from cisctl.logger import logger
+
+# limit kinds
+LIST = 'list'
+COPY = 'copy'
+
+# request kinds with a response time baseline of their own, a blob upload is not slow next to a HEAD
+REQUEST_KINDS = ('manifests', 'blobs', 'uploads', 'tags', 'other')
+_request_kind_re = re.compile(r'/(manifests|blobs/uploads|blobs|tags)(/|$)')
+
+# {(kind, host): AdaptiveLimit}
+_limits = dict()
+_settings = {
+    'enabled': False,
+    'initial': config.ADAPTIVE_INITIAL,
+    'minimum': config.ADAPTIVE_MIN,
+    'maximum': config.ADAPTIVE_MAX,
+}
+
+
+class AdaptiveLimit(object):
+    """ AIMD limit kept in shared memory, so all forked workers count the same in-flight requests """
+
+    # seconds between two decreases, 429 of requests already in flight are one congestion signal
+    cooldown = 1.0
+    decrease_factor = 0.5
+    latency_tolerance = 2.0
+    # weight of a new response time in the moving average baseline of its request kind
+    latency_smoothing = 0.2
+    # seconds between two polls of a waiting acquire()
+    poll_interval = 0.05
+
+    def __init__(self, name: str, initial: float, minimum: float, maximum: float):
+        """
+        :param name: e.g. copy docker.io
+        :param initial: limit to start with
+        :param minimum: limit never goes below it
+        :param maximum: limit never goes above it
+        """
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self._lock = multiprocessing.Lock()
+        self._limit = multiprocessing.Value('d', min(max(initial, minimum), maximum), lock=False)
+        self._in_flight = multiprocessing.Value('i', 0, lock=False)
+        # moving average seconds of responses of each of REQUEST_KINDS, 0 is none yet
+        self._baselines = multiprocessing.Array('d', len(REQUEST_KINDS), lock=False)
+        self._decreased = multiprocessing.Value('d', 0, lock=False)
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit.value)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight.value
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self._in_flight.value < int(self._limit.value):
+                self._in_flight.value += 1
+                return True
+            return False
+
+    def acquire(self) -> float:
+        """ take a slot, block until one is free
+
+        :return: seconds waited
+        """
+        started = time.monotonic()
+        while not self.try_acquire():
+            time.sleep(self.poll_interval)
+        return time.monotonic() - started
+
+    async def async_acquire(self) -> float:
+        """ coroutine of acquire() """
+        started = time.monotonic()
+        while not self.try_acquire():
+            await asyncio.sleep(self.poll_interval)
+        return time.monotonic() - started
+
+    def release(self):
+        with self._lock:
+            self._in_flight.value = max(self._in_flight.value - 1, 0)
+
+    def success(self, seconds: float = None, kind: str = 'other'):
+        """ healthy response, raise limit unless it is slow
+
+        :param seconds: response time, None is not compared, e.g. copies of different sizes
+        :param kind: one of REQUEST_KINDS, seconds is compared with responses of the same kind
+        """
+        with self._lock:
+            if seconds is not None:
+                i = REQUEST_KINDS.index(kind)
+                baseline = self._baselines[i]
+                self._baselines[i] = seconds if baseline <= 0 else \
+                    baseline + self.latency_smoothing * (seconds - baseline)
+                if baseline > 0 and seconds > baseline * self.latency_tolerance:
+                    return
+            self._limit.value = min(self._limit.value + 1 / max(self._limit.value, 1), self.maximum)
+
+    def congested(self) -> bool:
+        """ 429, 5xx or error response, cut limit
+
+        :return: True if limit is cut, False in cooldown of last cut
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now - self._decreased.value < self.cooldown:
+                return False
+            self._decreased.value = now
+            before = self._limit.value
+            self._limit.value = max(before * self.decrease_factor, self.minimum)
+        logger.warning(f'adaptive concurrency [{self.name}] congested, limit {before:.1f} -> {self._limit.value:.1f}')
+        return True
+
+
+def host_of(url: str) -> str:
+    """ api host of url or registry host of image, Docker Hub api and registry hosts are docker.io
+
+    :param url: one of
+        - https://registry-1.docker.io/v2/gcmirrors/pause/manifests/3.9
+        - https://registry.hub.docker.com/v2/repositories/gcmirrors/pause/tags
+        - k8s.gcr.io/pause
+    """
+    if '://' not in url:
+        # registry imports auth, which feeds this module
+        from cisctl import registry
+        url = registry.endpoint(url.split('/')[0])
+    host = urlparse(url).netloc
+    if host in ratelimit.DOCKER_HUB_API_HOSTS or host in ratelimit.DOCKER_HUB_REGISTRY_HOSTS:
+        return 'docker.io'
+    return host
+
+
+def request_kind(url: str) -> str:
+    """ one of REQUEST_KINDS, e.g. https://registry-1.docker.io/v2/gcmirrors/pause/blobs/uploads/<id> -> uploads """
+    match = _request_kind_re.search(urlparse(url).path)
+    if match is None:
+        return 'other'
+    return 'uploads' if match.group(1) == 'blobs/uploads' else match.group(1)
+
+
+def setup(hosts: List[str], enabled: bool = config.ADAPTIVE_CONCURRENCY, initial: int = config.ADAPTIVE_INITIAL,
+          minimum: int = config.ADAPTIVE_MIN, maximum: int = config.ADAPTIVE_MAX):
+    """ register limits of hosts before the pool is forked, hosts seen later get limits of their own process
+
+    :param hosts: registry hosts, e.g. [k8s.gcr.io, docker.io]
+    :param enabled: False is no limit, only the static pool size and semaphores
+    :param initial: limit to start with
+    :param minimum: min limit
+    :param maximum: max limit
+    """
+    _limits.clear()
+    _settings.update({'enabled': enabled, 'initial': initial, 'minimum': minimum, 'maximum': maximum})
+    if enabled:
+        for host in hosts:
+            get(LIST, host)
+            get(COPY, host)
+
+
+def install(limits: Dict, settings: Dict):
+    """ multiprocessing.Pool initializer, share parent limits with worker """
+    _limits.clear()
+    _limits.update(limits)
+    _settings.update(settings)
+
+
+def state() -> (Dict, Dict):
+    """ return initargs for install() """
+    return dict(_limits), dict(_settings)
+
+
+def get(kind: str, host: str) -> AdaptiveLimit:
+    """ limit of kind and host, None if adaptive concurrency is disabled """
+    if not _settings['enabled']:
+        return None
+    key = (kind, host_of(host))
+    if key not in _limits:
+        _limits[key] = AdaptiveLimit(
+            f'{kind} {key[1]}', _settings['initial'], _settings['minimum'], _settings['maximum'])
+    return _limits[key]
+
+
+@contextlib.contextmanager
+def slot(kind: str, *hosts: str):
+    """ hold a slot of kind on each of hosts, no-op if adaptive concurrency is disabled """
+    limits = [get(kind, host) for host in sorted({host_of(host) for host in hosts})]
+    limits = [limit for limit in limits if limit is not None]
+    # taken in host order, so two callers never hold a slot each other waits for
+    for limit in limits:
+        waited = limit.acquire()
+        if waited > 0:
+            metrics.observe('adaptive_wait_seconds', waited, kind=kind, host=limit.name.split(' ', 1)[1])
+    try:
+        yield
+    finally:
+        for limit in limits:
+            limit.release()
+
+
+async def async_acquire(kind: str, host: str) -> AdaptiveLimit:
+    """ coroutine taking a slot, return the limit to release() it, None if disabled """
+    limit = get(kind, host)
+    if limit is not None:
+        waited = await limit.async_acquire()
+        if waited > 0:
+            metrics.observe('adaptive_wait_seconds', waited, kind=kind, host=host_of(host))
+    return limit
+
+
+def release(limit: AdaptiveLimit):
+    if limit is not None:
+        limit.release()
+
+
+def congested(host: str):
+    """ cut list and copy limits of host """
+    for kind in (LIST, COPY):
+        limit = get(kind, host)
+        if limit is not None and limit.congested():
+            metrics.inc('adaptive_decrease_total', kind=kind, host=host_of(host))
+
+
+def success(host: str, seconds: float = None, request: str = 'other'):
+    """ raise list and copy limits of host
+
+    :param request: one of REQUEST_KINDS
+    """
+    for kind in (LIST, COPY):
+        limit = get(kind, host)
+        if limit is not None:
+            limit.success(seconds, request)
+
+
+def observe(url: str, status_code, seconds: float = None):
+    """ feed a http response to limits of its host
+
+    :param status_code: http status code, or `error` if connection failed
+    :param seconds: response time
+    """
+    if not _settings['enabled']:
+        return
+    if status_code == 'error' or status_code == 429 or (isinstance(status_code, int) and status_code >= 500):
+        congested(url)
+    elif isinstance(status_code, int) and status_code < 400 or status_code == 404:
+        success(url, seconds, request_kind(url))
+
+
+def summary() -> str:
+    """ current limits, e.g. `list docker.io=12, copy docker.io=3` """
+    return ', '.join(f'{limit.name}={limit.limit}' for limit in _limits.values())
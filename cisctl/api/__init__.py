@@ -17,9 +17,17 @@ from typing import Tuple
 
 
 class RegisterBaseAPIV2(object):
+    # sort_tags() timestamps are push or upload time
+    has_timestamps = True
 
-    def __init__(self):
-        pass
+    def __init__(self, cache=None):
+        """
+        :param cache: cisctl.cache.TagCache, None is no cache
+        """
+        self.base_url = None
+        self.cache = cache
+        # {name: {tag: bytes}} of last listing, filled by registries whose listing has sizes
+        self._sizes = dict()
 
     def list_tags(self, name, **kwargs) -> Any:
         raise NotImplemented
@@ -33,3 +41,42 @@ class RegisterBaseAPIV2(object):
         e.g. (True, [(tag1, last_update_timestamp), ...], {tag1: sha2561, ...})
         """
         raise NotImplemented
+
+    def cache_key(self, name) -> str:
+        """ registry + repo key of image in tags cache """
+        return f'{self.base_url}/{name}'
+
+    def cached_sort_tags(self, name, since=None) -> (bool, List[Tuple[str, int]], Dict):
+        """ sort_tags() through tags cache, only success result is cached
+
+        :param name: image name
+        :param since: passed to sort_tags() if not None, cached result listed with a later since is a miss
+        """
+        kwargs = {} if since is None else {'since': since}
+        if self.cache is not None:
+            value = self.cache.get(self.cache_key(name))
+            if value is not None and value.get('since', 0) <= (since or 0):
+                self._sizes[name] = value.get('sizes', {})
+                return True, [tuple(t) for t in value['tags']], value['digests']
+
+        result, sort_tags, tag_digest_dict = self.sort_tags(name, **kwargs)
+        if result and self.cache is not None:
+            self.cache.set(self.cache_key(name), {
+                'since': since or 0,
+                'tags': sort_tags,
+                'digests': tag_digest_dict,
+                'sizes': self._sizes.get(name, {}),
+            })
+        return result, sort_tags, tag_digest_dict
+
+    def pop_tag_sizes(self, name) -> Dict[str, int]:
+        """ bytes of each tag listed by last sort_tags() of name, and forget them
+
+        empty if registry listing has no size, e.g. OCI tags/list
+        """
+        return self._sizes.pop(name, {})
+
+    def invalidate(self, name):
+        """ drop image from tags cache, e.g. after pushed new tags """
+        if self.cache is not None:
+            self.cache.delete(self.cache_key(name))
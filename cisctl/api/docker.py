@@ -12,7 +12,9 @@
 #   under the License.
 
 """ Docker Register API v2 """
+from typing import Any
 from typing import Dict
+from typing import Iterator
 from typing import List
 from typing import Tuple
 
@@ -23,15 +25,13 @@ from cisctl.api import RegisterBaseAPIV2
 
 class DockerV2(RegisterBaseAPIV2):
 
-    def __init__(self, registry_url='https://registry.hub.docker.com', cache_timeout=120):
+    def __init__(self, registry_url='https://registry.hub.docker.com', cache=None):
         """
         :param registry_url: docker registry url
-        :param cache_timeout: cached docker images response, default is 120 second
+        :param cache: cisctl.cache.TagCache, shared sorted tags cache
         """
-        super().__init__()
+        super().__init__(cache=cache)
         self.base_url = f'{registry_url}/v2/repositories'
-        self.caches = dict()  # {"name": {"request_timestamp": 1, "result": True/False, "response": Any}}
-        self.cache_timeout = cache_timeout
 
     def delete_image(self, name, digest) -> bool:
         """ delete image by tag
@@ -45,7 +45,31 @@ class DockerV2(RegisterBaseAPIV2):
         url = f'{self.base_url}/{name}/manifests/{digest}'
         return client.http_delete(url)
 
-    def list_tags(self, name, n=10, next='') -> {}:  # noqa
+    def iter_tags(self, name, page_size=100, since=None) -> Iterator[Tuple[bool, Any]]:
+        """ iterate image tags page by page, newest pushed first, following `next`
+        e.g.
+          curl 'https://registry.hub.docker.com/v2/repositories/gcmirrors/kube-apiserver/tags?page_size=100&ordering=last_updated'
+
+        :param name: gcmirrors/kube-apiserver
+        :param page_size: page size, max is 100
+        :param since: millisecond timestamp, stop after the page which reaches tags updated before it
+        :return: iterator of (result, response) per page, stop at first failed page
+        """
+        url = f'{self.base_url}/{name}/tags?page_size={page_size}&ordering=last_updated'
+        while url:
+            result, response = client.http_get(url)
+            yield result, response
+            if not result:
+                return
+
+            url = response.get('next')
+            results = response.get('results', [])
+            if since and results:
+                oldest = results[-1].get('last_updated') or results[-1].get('tag_last_pushed')
+                if oldest and utils.date2timestamp(oldest) < since:
+                    return
+
+    def list_tags(self, name, page_size=100, since=None) -> {}:  # noqa
         """ list special image tags
         e.g.
           curl https://registry.hub.docker.com/v2/repositories/gcmirrors/kube-apiserver/tags
@@ -53,13 +77,11 @@ class DockerV2(RegisterBaseAPIV2):
           - https://docs.docker.com/registry/spec/api/#listing-image-tags
 
         :param name: gcmirrors/kube-apiserver
-        :param n: page size
-        :param next: next tag
+        :param page_size: page size
+        :param since: millisecond timestamp, tags updated before it may be skipped, None is list all tags
         return:
         {
             "count":564,
-            "next":"https://registry.hub.docker.com/v2/repositories/gcmirrors/kube-apiserver/tags?page=2",
-            "previous":null,
             "results":[
                 {
                     "creator":111330,
@@ -95,29 +117,21 @@ class DockerV2(RegisterBaseAPIV2):
             ]
         }
         """
-        # check cache
         if 'docker.io' in name:
             name = name.replace('docker.io/', '')
-        c = self.caches.get(name)
-        if c is not None:
-            if c['request_timestamp'] + self.cache_timeout > utils.timestamp():
-                return c['result'], c['response']
-            else:
-                self.caches.pop(name)
-
-        # new request
-        url = f'{self.base_url}/{name}/tags?n={n}'
-        if next:
-            url += f'&url={url}'
-
-        result, response = client.http_get(url)
-        self.caches[name] = {
-            "request_timestamp": utils.timestamp(),
-            "result": result,
-            "response": response,
-        }
+
+        result, response = True, {'count': 0, 'results': []}
+        for page_result, page_response in self.iter_tags(name, page_size=page_size, since=since):
+            if not page_result:
+                result, response = False, page_response
+                break
+            response['count'] = page_response.get('count', 0)
+            response['results'].extend(page_response.get('results', []))
         return result, response
 
+    def cache_key(self, name) -> str:
+        return f'{self.base_url}/{name.replace("docker.io/", "")}'
+
     def last_tag(self, name, sort_tags: List[Tuple[str, int]] = None) -> (str, int):
         """ get docker image last tag pushed millisecond timestamp
 
@@ -133,13 +147,19 @@ class DockerV2(RegisterBaseAPIV2):
         else:
             return None, None
 
-    def sort_tags(self, name) -> (bool, List[Tuple[str, int]], Dict):
-        result, resp = self.list_tags(name)
+    def sort_tags(self, name, since=None) -> (bool, List[Tuple[str, int]], Dict):
+        """ sort image tags by pushed timestamp desc
+
+        :param name: gcmirrors/kube-apiserver
+        :param since: millisecond timestamp, tags pushed before it may be missing
+        """
+        result, resp = self.list_tags(name, since=since)
         if result:
             _tag_timestamp_dict = dict()
             _tag_digest_dict = dict()
             for item in resp.get('results', []):
-                _tag_timestamp_dict[item['name']] = utils.date2timestamp(item['tag_last_pushed'])
+                _tag_timestamp_dict[item['name']] = utils.date2timestamp(
+                    item.get('tag_last_pushed') or item['last_updated'])
                 if item.get('digest') is not None:
                     _tag_digest_dict[item['name']] = item.get('digest')
                 elif len(item.get('images', [])) > 0 and item.get('images')[0].get('digest') is not None:
@@ -25,8 +25,8 @@ from cisctl.api import RegisterBaseAPIV2
 
 class GoogleContainerRegisterV2(RegisterBaseAPIV2):
 
-    def __init__(self, registry_url='https://gcr.io', project=None):
-        super().__init__()
+    def __init__(self, registry_url='https://gcr.io', project=None, cache=None):
+        super().__init__(cache=cache)
         if project:
             self.base_url = f'{registry_url}/v2/{project}'
         else:
@@ -64,7 +64,11 @@ class GoogleContainerRegisterV2(RegisterBaseAPIV2):
               ]
             }
         """
-        url = f'{self.base_url}/{name}/tags/list'
+        return self._get_tags_list(f'{self.base_url}/{name}/tags/list')
+
+    @staticmethod
+    def _get_tags_list(url) -> (bool, Dict):
+        """ GET tags/list with the manifest map extension, ref list_tags() """
         user_agent = \
             f'google-cloud-sdk //containerregistry/client:gcloud.py gcloud/313.0.1 ' \
             f'command/gcloud.container.images.list-tags invocation-id/{uuid.uuid4().hex} ' \
@@ -85,20 +89,34 @@ class GoogleContainerRegisterV2(RegisterBaseAPIV2):
         """
         result, resp = self.list_tags(name)
         if result:
-            _tag_timestamp_dict = {}
-            _tag_digest_dict = {}
-            for digest, v in resp.get('manifest', {}).items():
-                # digest like 'sha256:00c4c4b8cb7f747faff553ce447fbd86c7f062d04353c665c4087ef443aab8b5'
-                for tag_name in v['tag']:
-                    # tag like sha256-7939f3c6366155e73cb5025fc1fde5bd70c350cc9cd6b505340f7db8af655832.sbom is un-valid
-                    if tag_name.startswith('sha256-') and \
-                            (tag_name.endswith('.sbom') or tag_name.endswith('.sig') or tag_name.endswith('.att')):
-                        continue
-                    _tag_timestamp_dict[tag_name] = v['timeUploadedMs']
-                    _tag_digest_dict[tag_name] = digest
-
-            tag_list = utils.sort_dict(_tag_timestamp_dict)
-            if len(tag_list):
-                return True, tag_list, _tag_digest_dict
+            return self.parse_manifest(name, resp)
+
+        return False, [], {}
+
+    def parse_manifest(self, name, resp: Dict) -> (bool, List[Tuple[str, int]], Dict):
+        """ sort tags/list manifest map to Z-A, ref sort_tags()
+
+        :param name: image name, sizes of its tags are kept for pop_tag_sizes()
+        :param resp: list_tags() response, manifest is null if image not exist
+        """
+        _tag_timestamp_dict = {}
+        _tag_digest_dict = {}
+        _tag_size_dict = {}
+        for digest, v in (resp.get('manifest') or {}).items():
+            # digest like 'sha256:00c4c4b8cb7f747faff553ce447fbd86c7f062d04353c665c4087ef443aab8b5'
+            for tag_name in v['tag']:
+                # tag like sha256-7939f3c6366155e73cb5025fc1fde5bd70c350cc9cd6b505340f7db8af655832.sbom is un-valid
+                if utils.is_signature_tag(tag_name):
+                    continue
+                _tag_timestamp_dict[tag_name] = v['timeUploadedMs']
+                _tag_digest_dict[tag_name] = digest
+                # manifest list is 0
+                if int(v.get('imageSizeBytes') or 0):
+                    _tag_size_dict[tag_name] = int(v['imageSizeBytes'])
+
+        self._sizes[name] = _tag_size_dict
+        tag_list = utils.sort_dict(_tag_timestamp_dict)
+        if len(tag_list):
+            return True, tag_list, _tag_digest_dict
 
         return False, [], {}
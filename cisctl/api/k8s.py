@@ -11,30 +11,98 @@
 #   License for the specific language governing permissions and limitations
 #   under the License.
 
-""" kubernetes registry.k8s.io """
+""" kubernetes registry.k8s.io
+
+registry.k8s.io redirects every /v2/ request to its backing Artifact Registry, e.g.
+https://us-west1-docker.pkg.dev/v2/k8s-artifacts-prod/images, which answers tags/list with
+the same manifest map extension as gcr.io. The redirect is resolved once per process and
+tags are listed from the backing registry on the pooled session, `gcrane ls` is the fallback.
+"""
 
-import json
 from typing import Dict
-from typing import List
-from typing import Tuple
+from urllib.parse import urljoin
+from urllib.parse import urlparse
+
+import requests
 
+from cisctl import client
+from cisctl import config
+from cisctl import metrics
+from cisctl.api.gcr import GoogleContainerRegisterV2
 from cisctl.bash import Bash
-from cisctl import utils
-from cisctl.api import RegisterBaseAPIV2
+from cisctl.logger import logger
+
+K8S_LIST_ENGINE_NATIVE = 'native'
+K8S_LIST_ENGINE_GCRANE = 'gcrane'
 
 
-class K8sRegister(RegisterBaseAPIV2):
+class K8sRegister(GoogleContainerRegisterV2):
 
-    def __init__(self, registry_url: str='https://registry.k8s.io', project: str=None):
-        super().__init__()
-        self.base_url = registry_url.replace('https://', '').replace('/', '')
+    # {registry_url: base url of backing registry}, resolved once per process
+    _backends = dict()
+
+    def __init__(self, registry_url: str = 'https://registry.k8s.io', project: str = None, cache=None,
+                 list_engine: str = config.K8S_LIST_ENGINE):
+        """
+        :param registry_url: https://registry.k8s.io
+        :param project: sub path of image, e.g. addon-manager of registry.k8s.io/addon-manager/kube-addon-manager
+        :param cache: cisctl.cache.TagCache, shared sorted tags cache
+        :param list_engine: `native` lists tags over http and falls back to gcrane, `gcrane` only runs gcrane
+        """
+        super().__init__(registry_url=registry_url, project=project, cache=cache)
+        self.registry_url = registry_url.rstrip('/')
+        self.base_url = urlparse(registry_url).netloc
+        self.project = project
+        self.list_engine = list_engine
         self.bash = Bash()
 
-    def list_tags(self, name, n=10, next='') -> {}:  # noqa
+    def _path(self, name) -> str:
+        return f'{self.project}/{name}' if self.project else name
+
+    def repository(self, name) -> str:
+        """ e.g. registry.k8s.io/addon-manager/kube-addon-manager """
+        return f'{self.base_url}/{self._path(name)}'
+
+    def cache_key(self, name) -> str:
+        return self.repository(name)
+
+    def backend_url(self, name) -> str:
+        """ base url tags/list of registry.k8s.io is redirected to, registry_url/v2 if it is not redirected
+
+        :param name: any image, the first one listed resolves the redirect
+        """
+        backend = self._backends.get(self.registry_url)
+        if backend is not None:
+            return backend
+
+        path = self._path(name)
+        url = f'{self.registry_url}/v2/{path}/tags/list'
+        backend = f'{self.registry_url}/v2'
+        try:
+            resp = client.get_session().get(url, allow_redirects=False, timeout=client.timeout)
+        except requests.exceptions.RequestException:
+            logger.exception(f'resolve {url} redirect error')
+            return backend
+        metrics.http('GET', url, resp.status_code)
+
+        suffix = f'/{path}/tags/list'
+        location = urljoin(url, resp.headers.get('Location', '')).split('?')[0] if resp.is_redirect else ''
+        if location.endswith(suffix):
+            backend = location[:-len(suffix)]
+        elif resp.status_code != 200:
+            # image not exist or unknown redirect, requests follows it until an image resolves
+            return backend
+        logger.info(f'{self.registry_url} tags are listed from {backend}')
+        self._backends[self.registry_url] = backend
+        return backend
+
+    def list_tags(self, name, n=10, next='') -> (bool, Dict):  # noqa
         """ list special image tags
         e.g.
+          curl -L https://registry.k8s.io/v2/addon-builder/tags/list
           gcrane ls --json registry.k8s.io/addon-builder | jq .
         ref:
+          - https://github.com/kubernetes/registry.k8s.io/blob/main/cmd/archeio/docs/request-handling.md
           - https://github.com/google/go-containerregistry/blob/main/cmd/gcrane/README.md
 
         :param name: addon-builder
@@ -51,41 +119,17 @@ class K8sRegister(RegisterBaseAPIV2):
               "manifest": { ... }
             }
         """
-        cmd = f'gcrane ls --json {self.base_url}/{name}'
-        code, stdout, _ = self.bash.run(cmd, result=True)
-        if code == 0:
-            return True, json.loads(stdout)
-        return False, {}
-
-    def sort_tags(self, name) -> (bool, List[Tuple[str, int]], Dict):
-        """ sort image tags dict to Z-A
+        if self.list_engine == K8S_LIST_ENGINE_NATIVE:
+            result, resp = self._get_tags_list(f'{self.backend_url(name)}/{self._path(name)}/tags/list')
+            if result and isinstance(resp, dict):
+                return True, resp
+            logger.warning(f'list {self.repository(name)} tags over http failed, fall back to gcrane')
+        return self.gcrane_list_tags(name)
 
-        :param name: addon-builder or addon-manager/kube-addon-manager
-        return:
-        """
-        result, resp = self.list_tags(name)
-        if result:
-            # error case:
-            #   Run bash: gcrane ls --json registry.k8s.io/etcd-backup
-            #   ret is 0
-            #   stdout is {"child":null,"manifest":null,"name":"","tags":null}
-            if resp.get('manifest') is None:
-              return False, [], {}
-
-            _tag_timestamp_dict = {}
-            _tag_digest_dict = {}
-            for digest, v in resp.get('manifest', {}).items():
-                # digest like 'sha256:00c4c4b8cb7f747faff553ce447fbd86c7f062d04353c665c4087ef443aab8b5'
-                for tag_name in v['tag']:
-                    # tag like sha256-7939f3c6366155e73cb5025fc1fde5bd70c350cc9cd6b505340f7db8af655832.sbom is un-valid
-                    if tag_name.startswith('sha256-') and \
-                            (tag_name.endswith('.sbom') or tag_name.endswith('.sig') or tag_name.endswith('.att')):
-                        continue
-                    _tag_timestamp_dict[tag_name] = v['timeUploadedMs']
-                    _tag_digest_dict[tag_name] = digest
-
-            tag_list = utils.sort_dict(_tag_timestamp_dict)
-            if len(tag_list):
-                return True, tag_list, _tag_digest_dict
-
-        return False, [], {}
+    def gcrane_list_tags(self, name) -> (bool, Dict):
+        """ list_tags() with `gcrane ls --json` """
+        cmd = ['gcrane', 'ls', '--json', self.repository(name)]
+        code, resp, _ = self.bash.run_json(cmd, timeout=config.LIST_COMMAND_TIMEOUT)
+        if code == 0 and isinstance(resp, dict):
+            return True, resp
+        return False, {}
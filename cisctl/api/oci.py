@@ -0,0 +1,180 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+""" OCI distribution Register API v2, for registries without a vendor tags api
+
+tags/list has only tag names. As a source, digests of tags are read with concurrent
+manifest HEADs, and timestamps only if asked for, from the `created` field of config
+blobs of each distinct digest.
+"""
+import calendar
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+import requests
+
+from cisctl import config
+from cisctl import exception
+from cisctl import registry
+from cisctl import utils
+from cisctl.api import RegisterBaseAPIV2
+from cisctl.logger import logger
+
+# 2023-06-14T21:39:02.123456789Z or 2023-06-14T21:39:02+08:00
+_created_re = re.compile(
+    r'^(?P<date>\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(\.\d+)?(?:Z|(?P<sign>[+-])(?P<hours>\d\d):(?P<minutes>\d\d))?$')
+
+
+def created2timestamp(created: str) -> int:
+    """ config blob `created` to millisecond timestamp, 0 if not parsed """
+    match = _created_re.match(created or '')
+    if match is None:
+        return 0
+    seconds = calendar.timegm(tuple(int(i) for i in re.split(r'[-T:]', match.group('date'))) + (0, 0, 0))
+    if match.group('sign'):
+        offset = int(match.group('hours')) * 3600 + int(match.group('minutes')) * 60
+        seconds -= offset if match.group('sign') == '+' else -offset
+    return max(seconds, 0) * 1000
+
+
+class OCIRegisterV2(RegisterBaseAPIV2):
+    # tags/list has no push time, every tag is listed with timestamp 0
+    has_timestamps = False
+
+    def __init__(self, host: str, cache=None, project: str = None, digests: bool = False,
+                 timestamps: bool = False, head_concurrency: int = config.OCI_HEAD_CONCURRENCY,
+                 platform: str = config.COPY_PLATFORM):
+        """
+        :param host: registry host, e.g. registry.cn-hangzhou.aliyuncs.com, ghcr.io
+        :param cache: cisctl.cache.TagCache, shared sorted tags cache
+        :param project: path between host and image name, e.g. fluxcd of ghcr.io/fluxcd/source-controller
+        :param digests: HEAD manifest of every tag for its digest
+        :param timestamps: read image created time of every digest from its config blob, implies digests
+        :param head_concurrency: manifest HEADs in flight of one listing
+        :param platform: os/architecture whose config is read from a manifest list
+        """
+        super().__init__(cache=cache)
+        self.host = host
+        self.project = project
+        self.digests = digests or timestamps
+        self.has_timestamps = timestamps
+        self.head_concurrency = head_concurrency
+        self.os, _, self.architecture = platform.partition('/')
+        self.registry = registry.Registry(host)
+        self.base_url = f'{self.registry.url}/v2'
+        # {manifest digest: created millisecond timestamp}, a digest never changes
+        self._created = dict()
+
+    def _repository(self, name) -> str:
+        """ registry.cn-hangzhou.aliyuncs.com/gcmirrors/pause -> gcmirrors/pause, docker.io/nginx -> library/nginx """
+        if name.startswith(f'{self.host}/'):
+            name = name[len(self.host) + 1:]
+        if self.project:
+            name = f'{self.project}/{name}'
+        return registry.parse_image(f'{self.host}/{name}')[1]
+
+    def list_tags(self, name, page_size=1000) -> (bool, List[str]):  # noqa
+        """ list image tags, page by page
+        e.g.
+          curl 'https://ghcr.io/v2/gcmirrors/pause/tags/list?n=1000'
+        ref:
+          - https://github.com/opencontainers/distribution-spec/blob/main/spec.md#listing-tags
+
+        :param name: gcmirrors/pause or registry.cn-hangzhou.aliyuncs.com/gcmirrors/pause
+        :param page_size: page size
+        :return: (bool, tags), tags is empty if image not exist
+        """
+        try:
+            return True, self.registry.list_tags(self._repository(name), page_size=page_size)
+        except (exception.RegistryException, requests.exceptions.RequestException, ValueError):
+            logger.exception(f'list {self.host}/{self._repository(name)} tags error')
+            return False, []
+
+    def head_digests(self, name, tags: List[str]) -> Dict[str, str]:
+        """ manifest digest of each tag, tags failed to HEAD are left out
+
+        the first HEAD runs alone, so the others reuse the token it fetched
+        """
+        repository = self._repository(name)
+
+        def _head(tag):
+            try:
+                return tag, self.registry.head_manifest(repository, tag)[0]
+            except (exception.RegistryException, requests.exceptions.RequestException):
+                logger.warning(f'HEAD {self.host}/{repository}:{tag} manifest error')
+                return tag, None
+
+        results = [_head(tag) for tag in tags[:1]]
+        if len(tags) > 1:
+            with ThreadPoolExecutor(max_workers=max(min(self.head_concurrency, len(tags) - 1), 1)) as executor:
+                results += list(executor.map(_head, tags[1:]))
+        return {tag: digest for tag, digest in results if digest}
+
+    def created(self, name, digest: str) -> int:
+        """ millisecond timestamp image of manifest digest is created, 0 if unknown
+
+        a manifest list is read through its manifest of `platform`
+        """
+        if digest not in self._created:
+            repository = self._repository(name)
+            try:
+                media_type, body, _ = self.registry.get_manifest(repository, digest)
+                manifest = json.loads(body)
+                if media_type in registry.MANIFEST_LIST_MEDIA_TYPES:
+                    descriptor = registry.select_platform(manifest['manifests'], self.os, self.architecture)
+                    _, body, _ = self.registry.get_manifest(repository, descriptor['digest'])
+                    manifest = json.loads(body)
+                resp = self.registry.get_blob(repository, manifest['config']['digest'])
+                try:
+                    self._created[digest] = created2timestamp(json.loads(resp.content).get('created'))
+                finally:
+                    resp.close()
+            except (exception.RegistryException, requests.exceptions.RequestException, ValueError, KeyError,
+                    IndexError):
+                logger.warning(f'read {self.host}/{repository}@{digest} created time error')
+                return 0
+        return self._created[digest]
+
+    def cache_key(self, name) -> str:
+        return f'{self.base_url}/{self._repository(name)}'
+
+    def last_tag(self, name, sort_tags: List[Tuple[str, int]] = None) -> (str, int):
+        """ ref DockerV2.last_tag(), timestamp is always 0 """
+        if sort_tags is None:
+            _, sort_tags, _ = self.sort_tags(name)
+        if len(sort_tags):
+            return sort_tags[0]
+        return None, None
+
+    def sort_tags(self, name, since=None) -> (bool, List[Tuple[str, int]], Dict):
+        """ image tags Z-A with timestamp 0, or newest created first if timestamps
+
+        :param name: ref list_tags()
+        :param since: ignored, tags/list has no push time to stop at
+        :return: (bool, [(tag, timestamp), ...], {tag: digest}), digest is empty unless digests
+        """
+        result, tags = self.list_tags(name)
+        tags = [tag for tag in tags if not utils.is_signature_tag(tag)]
+        if not result or not self.digests:
+            return result, [(tag, 0) for tag in sorted(tags, reverse=True)], {}
+
+        digests = self.head_digests(name, tags)
+        if not self.has_timestamps:
+            return result, [(tag, 0) for tag in sorted(tags, reverse=True)], digests
+
+        timestamps = {tag: self.created(name, digests[tag]) if tag in digests else 0 for tag in tags}
+        return result, utils.sort_dict(timestamps), digests
@@ -12,60 +12,122 @@
 #   under the License.
 
 """ quay Register API v2 """
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+from typing import Any
 from typing import Dict
+from typing import Iterator
 from typing import List
 from typing import Tuple
 
+from cisctl import client
 from cisctl import utils
 from cisctl.api import RegisterBaseAPIV2
-from cisctl.skopeo import Skopeo
 
 
 class QuayRegisterV2(RegisterBaseAPIV2):
 
-    def __init__(self, registry_url='https://quay.io', repo=None):
-        super().__init__()
-        self.base_url = f'{registry_url}/v2'
-        self.skopeo = Skopeo()
+    def __init__(self, registry_url='https://quay.io', repo=None, cache=None):
+        """
+        :param registry_url: quay registry url
+        :param repo: quay namespace, e.g. metallb of quay.io/metallb/speaker
+        :param cache: cisctl.cache.TagCache, shared sorted tags cache
+        """
+        super().__init__(cache=cache)
+        self.base_url = f'{registry_url}/api/v1/repository'
         self.repo = repo
 
-    def list_tags(self, name, n=10, next='') -> {}:  # noqa
-        """ list special image tags
-        Action: quay api is too hard to call, use Skopeo instead
+    def _repository(self, name) -> str:
+        return f'{self.repo}/{name}' if self.repo else name
 
-        skopeo list-tags docker://quay.io/metallb/speaker
+    def iter_tags(self, name, page_size=100) -> Iterator[Tuple[bool, Any]]:
+        """ iterate active image tags page by page, newest first, while `has_additional`
+        e.g.
+          curl 'https://quay.io/api/v1/repository/metallb/speaker/tag/?limit=100&page=1&onlyActiveTags=true'
+        ref:
+          - https://docs.quay.io/api/swagger/#!/tag/listRepoTags
+
+        :param name: speaker of quay.io/metallb/speaker
+        :param page_size: page size, max is 100
+        :return: iterator of (result, response) per page, stop at first failed page
+        """
+        url = f'{self.base_url}/{self._repository(name)}/tag/'
+        page = 1
+        while True:
+            result, response = client.http_get(url, {'limit': page_size, 'page': page, 'onlyActiveTags': 'true'})
+            yield result, response
+            if not result or not response.get('has_additional'):
+                return
+            page += 1
 
-        GET https://quay.io/v2/metallb/speaker/tags/list
-        GET https://quay.io/v2/metallb/speaker/tags/list?n=50&next_page=gAAAAABiKuXErTweWhOFkSPZXbeVDTAuP1_SyO2M7IDSuDnTVJlAGce0Gvv1gZFlaG1yKq4v_092ENhUu6LzEow-P2gAuNrjTn9lke0udu-Cd7nV8eBKYbA%3D
+    def list_tags(self, name, page_size=100) -> (bool, Dict):  # noqa
+        """ list special image tags
 
         :param name: speaker of quay.io/metallb/speaker
-        :param n: page size
-        :param next: next tag
+        :param page_size: page size
         return:
         {
-            "Repository": "quay.io/metallb/speaker",
-            "Tags": [
+            "tags": [
+                {
+                    "name": "v0.13.12",
+                    "reference": "v0.13.12",
+                    "is_manifest_list": true,
+                    "last_modified": "Thu, 14 Dec 2023 21:41:52 -0000",
+                    "manifest_digest": "sha256:...",
+                    "size": null,
+                    "start_ts": 1702590112
+                },
                 ...
-                "main"
             ]
         }
         """
-        return self.skopeo.list_tags(transport='docker', repo=f'quay.io/{self.repo}', name=name)
+        result, response = True, {'tags': []}
+        for page_result, page_response in self.iter_tags(name, page_size=page_size):
+            if not page_result:
+                return False, page_response
+            response['tags'].extend(page_response.get('tags', []))
+        return result, response
+
+    def cache_key(self, name) -> str:
+        return f'{self.base_url}/{self._repository(name)}'
+
+    @staticmethod
+    def _timestamp(item) -> int:
+        """ millisecond timestamp of tag pushed """
+        if item.get('start_ts'):
+            return int(item['start_ts']) * 1000
+        if item.get('last_modified'):
+            last_modified = parsedate_to_datetime(item['last_modified'])
+            # `-0000` is parsed to a naive datetime, it is utc, not local time
+            if last_modified.tzinfo is None:
+                last_modified = last_modified.replace(tzinfo=timezone.utc)
+            return int(last_modified.timestamp() * 1000)
+        return 0
 
     def sort_tags(self, name) -> (bool, List[Tuple[str, int]], Dict):
-        """ sort image tags dict to Z-A
+        """ sort image tags by pushed timestamp desc
 
         :param name: like controller
         :return: (True, [(tag1, last_update_timestamp), ...], {tag1: sha2561, ...})
         """
-        tags = self.list_tags(name).get('Tags', [])
-        _tag_timestamp_dict = {}
-        index = 0
-        for tag in tags:
-            _tag_timestamp_dict[tag] = index
-            index += 1
-        tag_list = utils.sort_dict(_tag_timestamp_dict)
-        if len(tag_list):
-            return True, tag_list, {}
+        result, resp = self.list_tags(name)
+        if result:
+            _tag_timestamp_dict = {}
+            _tag_digest_dict = {}
+            _tag_size_dict = {}
+            for item in resp.get('tags', []):
+                if utils.is_signature_tag(item['name']):
+                    continue
+                _tag_timestamp_dict[item['name']] = self._timestamp(item)
+                if item.get('manifest_digest'):
+                    _tag_digest_dict[item['name']] = item['manifest_digest']
+                # manifest list is null
+                if int(item.get('size') or 0):
+                    _tag_size_dict[item['name']] = int(item['size'])
+
+            self._sizes[name] = _tag_size_dict
+            tag_list = utils.sort_dict(_tag_timestamp_dict)
+            if len(tag_list):
+                return True, tag_list, _tag_digest_dict
 
         return False, [], {}
@@ -0,0 +1,278 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""registry token authentication.
+
+Bearer tokens are cached by (realm, service, scope, user) until shortly before
+their `expires_in`, in process and in a sqlite file shared by pool workers and
+runs (TOKEN_CACHE_PATH), so an anonymous pull token of gcr.io, quay.io or ghcr.io
+is fetched once per repository instead of once per process. A token is only
+reused by the user it was fetched with, or by anonymous requests if it was
+fetched without credentials. Auth challenges of registry hosts are cached too,
+so a request carries its token without a first 401.
+
+ref:
+  - https://docs.docker.com/registry/spec/auth/token/
+  - https://github.com/containers/image/blob/main/docs/containers-auth.json.5.md
+"""
+
+import base64
+import collections
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict
+from typing import Tuple
+from urllib.parse import urlparse
+
+import requests
+
+from cisctl import adaptive
+from cisctl import cache
+from cisctl import client
+from cisctl import config
+from cisctl import metrics
+from cisctl import ratelimit
+from cisctl.logger import logger
+
+# {"host": (user, password)}
+_credentials = dict()
+# {"host": ("bearer", realm, service) or ("basic", None, None)}
+_challenges = dict()
+# hosts looked up in token cache by this process, a host without challenge is read from disk once
+_challenges_read = set()
+# {(realm, service, scope, identity): (token, expires unix time)}
+_tokens = dict()
+# one fetch of each token at a time, threads asking for it wait and reuse it
+_token_locks = collections.defaultdict(threading.Lock)
+# tokens without expires_in live 60 seconds, ref https://distribution.github.io/distribution/spec/auth/token/
+DEFAULT_EXPIRES_IN = 60
+# a token is refreshed after this part of its lifetime, so it does not expire in flight
+EXPIRY_MARGIN = 0.1
+# token and challenge cache on disk, None is not opened yet, False is disabled
+_token_cache = None
+
+_challenge_param_re = re.compile(r'(\w+)="([^"]*)"')
+
+
+def set_credentials(host: str, user: str, password: str):
+    _credentials[host] = (user, password)
+
+
+def _auth_files():
+    xdg_runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if xdg_runtime_dir:
+        yield os.path.join(xdg_runtime_dir, 'containers', 'auth.json')
+    yield os.path.join(os.path.expanduser('~'), '.config', 'containers', 'auth.json')
+    yield os.path.join(os.path.expanduser('~'), '.docker', 'config.json')
+
+
+def get_credentials(host: str) -> Tuple[str, str]:
+    """ return (user, password) of registry host, from set_credentials() or `skopeo login` auth files """
+    if host in _credentials:
+        return _credentials[host]
+
+    keys = [host]
+    if host in ratelimit.DOCKER_HUB_REGISTRY_HOSTS:
+        keys += ['docker.io', 'https://index.docker.io/v1/']
+    for path in _auth_files():
+        try:
+            with open(path) as f:
+                auths = json.load(f).get('auths', {})
+        except (OSError, ValueError):
+            continue
+        for key in keys:
+            encoded = auths.get(key, {}).get('auth')
+            if encoded:
+                user, _, password = base64.b64decode(encoded).decode().partition(':')
+                _credentials[host] = (user, password)
+                return _credentials[host]
+
+    _credentials[host] = None
+    return None
+
+
+def parse_challenge(header: str) -> (str, Dict):
+    """ parse WWW-Authenticate header
+
+    :param header: Bearer realm="https://auth.docker.io/token",service="registry.docker.io",scope="repository:a/b:pull"
+    :return ('bearer', {'realm': 'https://auth.docker.io/token', 'service': 'registry.docker.io', 'scope': '...'})
+    """
+    scheme, _, params = header.strip().partition(' ')
+    return scheme.lower(), dict(_challenge_param_re.findall(params))
+
+
+def set_token_cache(token_cache):
+    """ cache tokens in token_cache, e.g. cisctl.cache.TagCache, None disables cache on disk """
+    global _token_cache
+    _token_cache = token_cache if token_cache is not None else False
+
+
+def _disk_cache():
+    """ token cache of TOKEN_CACHE_PATH, opened on first use, None if disabled """
+    global _token_cache
+    if _token_cache is None:
+        _token_cache = False
+        if config.TOKEN_CACHE_PATH:
+            _token_cache = cache.TagCache(
+                path=config.TOKEN_CACHE_PATH, ttl=config.TOKEN_CACHE_TTL, max_entries=config.TOKEN_CACHE_MAX_ENTRIES,
+                mode=0o600)
+    return _token_cache if _token_cache is not False else None
+
+
+def _challenge(host) -> Tuple:
+    """ ("bearer", realm, service) or ("basic", None, None) of host, None if unknown """
+    challenge = _challenges.get(host)
+    if challenge is None and host not in _challenges_read:
+        _challenges_read.add(host)
+        token_cache = _disk_cache()
+        value = token_cache.get(f'challenge:{host}') if token_cache is not None else None
+        if value is not None:
+            challenge = _challenges[host] = tuple(value)
+    return challenge
+
+
+def _set_challenge(host, challenge: Tuple):
+    _challenges[host] = challenge
+    token_cache = _disk_cache()
+    if token_cache is not None:
+        token_cache.set(f'challenge:{host}', list(challenge))
+
+
+def _cached_token(key) -> str:
+    """ unexpired token of key, from memory or disk """
+    now = time.time()
+    token, expires = _tokens.get(key, (None, 0))
+    if token and expires > now:
+        metrics.inc('registry_tokens_total', result='memory')
+        return token
+
+    token_cache = _disk_cache()
+    value = token_cache.get(f'token:{" ".join(key)}') if token_cache is not None else None
+    if value is not None and value['expires'] > now:
+        _tokens[key] = (value['token'], value['expires'])
+        metrics.inc('registry_tokens_total', result='disk')
+        return value['token']
+    return None
+
+
+def _identity(credentials) -> str:
+    """ token owner of cache key, hash of user, so tokens of other accounts or anonymous ones are never reused """
+    if credentials is None:
+        return 'anonymous'
+    return hashlib.sha256(credentials[0].encode()).hexdigest()[:16]
+
+
+def _fetch_token(host, realm, service, scopes) -> (str, float):
+    """ return (token, expires unix time) """
+    params = [('service', service)] if service else []
+    params += [('scope', scope) for scope in scopes]
+    credentials = get_credentials(host)
+    try:
+        resp = client.get_session().get(realm, params=params, auth=credentials, timeout=client.timeout)
+        metrics.http('GET', realm, resp.status_code)
+    except requests.exceptions.RequestException:
+        metrics.http('GET', realm, 'error')
+        logger.exception(f'fetch registry token error, realm: {realm}, scopes: {scopes}')
+        return None, 0
+    if resp.status_code != 200:
+        logger.error(f'fetch registry token error, realm: {realm}, scopes: {scopes}, '
+                     f'response_status_code: {resp.status_code}')
+        return None, 0
+    body = resp.json()
+    expires_in = int(body.get('expires_in') or DEFAULT_EXPIRES_IN)
+    metrics.inc('registry_tokens_total', result='fetch')
+    return body.get('token') or body.get('access_token'), time.time() + expires_in * (1 - EXPIRY_MARGIN)
+
+
+def _auth_header(host, scopes, refresh=False) -> str:
+    """ Authorization header of host and scopes, None if host needs no auth or it is unknown yet
+
+    :param refresh: fetch a new token, e.g. the cached one is answered with 401
+    """
+    challenge = _challenge(host)
+    if challenge is None:
+        return None
+
+    scheme, realm, service = challenge
+    if scheme == 'basic':
+        credentials = get_credentials(host)
+        if credentials is None:
+            return None
+        return 'Basic ' + base64.b64encode(':'.join(credentials).encode()).decode()
+
+    key = (realm, service or '', ' '.join(scopes), _identity(get_credentials(host)))
+    stale = _tokens.get(key, (None, 0))[0] if refresh else None
+    with _token_locks[key]:
+        token = _cached_token(key)
+        # another thread refreshed it while this one waited
+        if token is None or (refresh and token == stale):
+            token, expires = _fetch_token(host, realm, service, scopes)
+            if token:
+                _tokens[key] = (token, expires)
+                token_cache = _disk_cache()
+                if token_cache is not None:
+                    token_cache.set(f'token:{" ".join(key)}', {'token': token, 'expires': expires})
+    return f'Bearer {token}' if token else None
+
+
+def request(method: str, url: str, scopes=(), replayable: bool = True, **kwargs) -> requests.Response:
+    """ send a registry http request with the pooled session, answer 401 auth challenge once
+
+    :param method: GET, HEAD, POST, PUT, PATCH
+    :param url: registry url, e.g. https://registry-1.docker.io/v2/gcmirrors/pause/manifests/3.9
+    :param scopes: token scopes, e.g. ('repository:gcmirrors/pause:pull,push',)
+    :param replayable: False if the body can be read once, e.g. a streamed blob, the request is sent once
+        without retries, and a 401 refreshes the token for the caller to send it again with a new body
+    :return: requests.Response, raise requests.exceptions.RequestException on connection error
+    """
+    host = urlparse(url).netloc
+    headers = dict(kwargs.pop('headers', None) or {})
+    kwargs.setdefault('timeout', client.timeout)
+
+    authorization = _auth_header(host, scopes)
+    if authorization:
+        headers['Authorization'] = authorization
+    resp = _request(method, url, headers, retries=replayable, **kwargs)
+
+    if resp.status_code == 401 and resp.headers.get('WWW-Authenticate'):
+        scheme, params = parse_challenge(resp.headers['WWW-Authenticate'])
+        challenge = (scheme, params.get('realm'), params.get('service'))
+        if _challenges.get(host) != challenge:
+            _set_challenge(host, challenge)
+        if not scopes and params.get('scope'):
+            scopes = (params['scope'],)
+        # a token sent is rejected, e.g. revoked before it expires, others may be cached by another worker
+        authorization = _auth_header(host, scopes, refresh=bool(authorization))
+        if authorization and replayable:
+            headers['Authorization'] = authorization
+            resp = _request(method, url, headers, **kwargs)
+    return resp
+
+
+def _request(method, url, headers, retries: bool = True, **kwargs) -> requests.Response:
+    # e.g. docker hub registry requests wait for the pull quota after a 429
+    ratelimit.acquire_url(url)
+    try:
+        resp = client.get_session(retries).request(method, url, headers=headers, **kwargs)
+    except requests.exceptions.RequestException:
+        metrics.http(method, url, 'error')
+        adaptive.observe(url, 'error')
+        raise
+    metrics.http(method, url, resp.status_code)
+    ratelimit.observe(url, resp.status_code, resp.headers)
+    adaptive.observe(url, resp.status_code, resp.elapsed.total_seconds())
+    return resp
@@ -11,30 +11,192 @@
 #   License for the specific language governing permissions and limitations
 #   under the License.
 
-"""python bash utils."""
+"""python subprocess utils.
 
+Commands are argv lists run without a shell, each in a process group of its own, so
+a command running past its timeout is killed together with the processes it started.
+Only the first `COMMAND_LOG_MAX_BYTES` of stdout and stderr are logged.
+"""
+
+import asyncio
+import json
+import os
+import shlex
+import signal
 import subprocess
+import threading
+from typing import List
+from typing import Union
 
+from cisctl import config
+from cisctl import metrics
 from cisctl.logger import logger
 
 
+def _argv(command: Union[str, List[str]]) -> List[str]:
+    """ split str command like a shell would, without running one """
+    if isinstance(command, str):
+        return shlex.split(command)
+    return [str(arg) for arg in command]
+
+
+def _format(argv: List[str]) -> str:
+    return ' '.join(shlex.quote(arg) for arg in argv)
+
+
+def _cap(output, limit: int = None) -> str:
+    """ head of output for logging, e.g. `{"tags": [...] ... (1048576 bytes)` """
+    if limit is None:
+        limit = config.COMMAND_LOG_MAX_BYTES
+    if isinstance(output, bytes):
+        output = output.decode(errors='replace')
+    if limit <= 0 or len(output) <= limit:
+        return output
+    return f'{output[:limit]} ... ({len(output)} bytes)'
+
+
+def _kill(process):
+    """ kill process group of a command started with start_new_session """
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def _not_found(argv: List[str], result: bool):
+    """ exit code of a shell not finding the command """
+    stderr = f'{argv[0]}: command not found'
+    logger.error(f'Run: {_format(argv)}, {stderr}')
+    return (127, '', stderr) if result else 127
+
+
+def _timed_out(argv: List[str], timeout: float):
+    logger.warning(f'Run: {_format(argv)} timed out after {timeout}s, killed')
+    metrics.inc('command_timeouts_total', command=os.path.basename(argv[0]))
+
+
 class Bash(object):
 
     def __init__(self):
         self.logger = logger
 
     @staticmethod
-    def run(command, result=False):
-        args = ['bash', '-c', command]
+    def run(command, result=False, timeout: float = None):
+        """ run command, return its exit code, or (code, stdout, stderr) if result
+
+        :param command: argv list, e.g. ['skopeo', 'copy', ...], str is split with shlex
+        :param result: return stdout and stderr too
+        :param timeout: seconds, None is config.COMMAND_TIMEOUT, 0 is no timeout. code is -9 if killed
+        """
+        argv = _argv(command)
+        if timeout is None:
+            timeout = config.COMMAND_TIMEOUT
 
-        _sub_p = subprocess.Popen(
-            args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        _stdout, _stderr = _sub_p.communicate()
+        try:
+            _sub_p = subprocess.Popen(
+                argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+        except FileNotFoundError:
+            return _not_found(argv, result)
+        try:
+            _stdout, _stderr = _sub_p.communicate(timeout=timeout or None)
+        except subprocess.TimeoutExpired:
+            _kill(_sub_p)
+            _stdout, _stderr = _sub_p.communicate()
+            _timed_out(argv, timeout)
         stdout, stderr = _stdout.decode(), _stderr.decode()
         code = _sub_p.poll()
-        logger.info(f'Run bash: {command}, ret is {code}, stdout is {stdout}, stderr is: {stderr}')
+        logger.info(f'Run: {_format(argv)}, ret is {code}, stdout is {_cap(stdout)}, stderr is: {_cap(stderr)}')
 
         if result:
             return code, stdout, stderr
 
         return code
+
+    @staticmethod
+    async def async_run(command, result=False, timeout: float = None):
+        """ coroutine of run(), the event loop is not blocked while command running """
+        argv = _argv(command)
+        if timeout is None:
+            timeout = config.COMMAND_TIMEOUT
+
+        try:
+            _sub_p = await asyncio.create_subprocess_exec(
+                *argv, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, start_new_session=True)
+        except FileNotFoundError:
+            return _not_found(argv, result)
+        communicate = asyncio.ensure_future(_sub_p.communicate())
+        try:
+            _stdout, _stderr = await asyncio.wait_for(asyncio.shield(communicate), timeout or None)
+        except asyncio.TimeoutError:
+            _kill(_sub_p)
+            _stdout, _stderr = await communicate
+            _timed_out(argv, timeout)
+        stdout, stderr = _stdout.decode(), _stderr.decode()
+        code = _sub_p.returncode
+        logger.info(f'Run: {_format(argv)}, ret is {code}, stdout is {_cap(stdout)}, stderr is: {_cap(stderr)}')
+
+        if result:
+            return code, stdout, stderr
+
+        return code
+
+    @staticmethod
+    def run_json(command, timeout: float = None):
+        """ run command printing one json document, return it parsed
+
+        stdout is read whole and parsed, it is not returned as str or logged, only its json type is,
+        e.g. `gcrane ls --json` of a large repository.
+
+        :param command: ref run()
+        :param timeout: ref run()
+        :return: (code, json object, stderr), json object is None if command failed or stdout is not json
+        """
+        argv = _argv(command)
+        if timeout is None:
+            timeout = config.COMMAND_TIMEOUT
+
+        try:
+            _sub_p = subprocess.Popen(
+                argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+        except FileNotFoundError:
+            code, _, stderr = _not_found(argv, True)
+            return code, None, stderr
+        # stderr is drained aside, a command blocked on a full stderr pipe never closes stdout
+        _stderr = []
+        reader = threading.Thread(target=lambda: _stderr.append(_sub_p.stderr.read()), daemon=True)
+        reader.start()
+        killed = threading.Event()
+
+        def _on_timeout():
+            killed.set()
+            _kill(_sub_p)
+
+        timer = threading.Timer(timeout, _on_timeout) if timeout else None
+        if timer:
+            timer.daemon = True
+            timer.start()
+        try:
+            try:
+                obj = json.load(_sub_p.stdout)
+            except ValueError as e:
+                obj, error = None, e
+            else:
+                error = None
+            code = _sub_p.wait()
+            reader.join()
+        finally:
+            if timer:
+                timer.cancel()
+            _sub_p.stdout.close()
+            _sub_p.stderr.close()
+        if killed.is_set():
+            _timed_out(argv, timeout)
+        stderr = b''.join(_stderr).decode()
+
+        if code != 0:
+            obj = None
+        elif error is not None:
+            logger.warning(f'Run: {_format(argv)}, stdout is not json: {error}')
+        logger.info(f'Run: {_format(argv)}, ret is {code}, stdout is json {type(obj).__name__}, '
+                    f'stderr is: {_cap(stderr)}')
+        return code, obj, stderr
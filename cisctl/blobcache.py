@@ -0,0 +1,181 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""content addressed local blob store, the intermediate stage of native copy.
+
+Blobs are kept in an OCI image layout directory, `<path>/blobs/sha256/<hex>`, so
+a runner with a persistent cache volume downloads each layer from upstream once,
+and a push retried after a failure reads it from disk.
+
+ref https://github.com/opencontainers/image-spec/blob/main/image-layout.md
+"""
+
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+from typing import Iterable
+from typing import Optional
+
+from cisctl import config
+from cisctl import metrics
+from cisctl.logger import logger
+
+_hex_re = re.compile(r'^[a-f0-9]{64}$')
+
+OCI_LAYOUT = {'imageLayoutVersion': '1.0.0'}
+OCI_INDEX = {'schemaVersion': 2, 'manifests': []}
+
+
+class BlobCache(object):
+    """ OCI layout blob directory with a byte budget, least recently read blobs are evicted
+
+    mtime of a blob file is its last read time. blobs are written to a temporary file and
+    renamed, so pool workers share the directory without locking and only see complete blobs.
+    """
+
+    # blobs read in the last `keep_seconds` are not evicted, another worker may be about to open them
+    keep_seconds = 60
+
+    def __init__(self, path: str = config.BLOB_CACHE_PATH, max_bytes: int = config.BLOB_CACHE_MAX_BYTES):
+        """
+        :param path: OCI layout directory
+        :param max_bytes: byte budget of blobs, 0 is unlimited
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        # bytes of blobs, counted on first put() and kept up to date by this process
+        self._size = None
+
+    def _init(self):
+        os.makedirs(os.path.join(self.path, 'blobs', 'sha256'), exist_ok=True)
+        for name, content in (('oci-layout', OCI_LAYOUT), ('index.json', OCI_INDEX)):
+            path = os.path.join(self.path, name)
+            if not os.path.exists(path):
+                with open(path, 'w') as f:
+                    json.dump(content, f)
+
+    def blob_path(self, digest: str) -> str:
+        """ sha256:<hex> -> <path>/blobs/sha256/<hex> """
+        algorithm, _, hex_digest = digest.partition(':')
+        if algorithm != 'sha256' or not _hex_re.match(hex_digest):
+            raise ValueError(f'unsupported blob digest {digest}')
+        return os.path.join(self.path, 'blobs', 'sha256', hex_digest)
+
+    def get(self, digest: str) -> Optional[str]:
+        """ return path of blob, None if not cached or its content does not match digest
+
+        :param digest: sha256:xxx
+        """
+        path = self.blob_path(digest)
+        sha256 = hashlib.sha256()
+        try:
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    sha256.update(chunk)
+            os.utime(path)
+        except FileNotFoundError:
+            metrics.inc('blob_cache_requests_total', result='miss')
+            return None
+
+        if f'sha256:{sha256.hexdigest()}' != digest:
+            logger.warning(f'blob cache {path} does not match {digest}, drop it')
+            self._remove(path)
+            metrics.inc('blob_cache_requests_total', result='corrupt')
+            return None
+        metrics.inc('blob_cache_requests_total', result='hit')
+        return path
+
+    def put(self, digest: str, chunks: Iterable[bytes]) -> str:
+        """ write blob, return its path, raise ValueError if content does not match digest
+
+        :param digest: sha256:xxx
+        :param chunks: blob content, e.g. requests.Response.iter_content()
+        """
+        path = self.blob_path(digest)
+        self._init()
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        sha256, size = hashlib.sha256(), 0
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in chunks:
+                    sha256.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+            if f'sha256:{sha256.hexdigest()}' != digest:
+                raise ValueError(f'blob content does not match {digest}')
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        if self._size is None:
+            self._remove_stale_tmp()
+            self._size = self._usage()
+        else:
+            self._size += size
+        if self.max_bytes and self._size > self.max_bytes:
+            self.evict()
+        return path
+
+    def _entries(self, tmp: bool = False):
+        """ yield (path, size, mtime) of cached blobs, or of temporary files if tmp """
+        directory = os.path.join(self.path, 'blobs', 'sha256')
+        try:
+            entries = list(os.scandir(directory))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            if entry.name.endswith('.tmp') != tmp:
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            yield entry.path, stat.st_size, stat.st_mtime
+
+    def _blobs(self):
+        return self._entries()
+
+    def _remove_stale_tmp(self):
+        """ drop temporary files of puts killed before their rename, a put in progress writes to its file """
+        recent = time.time() - self.keep_seconds
+        for path, _, mtime in self._entries(tmp=True):
+            if mtime <= recent:
+                logger.debug(f'blob cache drop stale temporary file {path}')
+                self._remove(path)
+
+    def _usage(self) -> int:
+        return sum(size for _, size, _ in self._blobs())
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        """ drop stale temporary files, and least recently read blobs until bytes of blobs fit max_bytes """
+        self._remove_stale_tmp()
+        blobs = sorted(self._blobs(), key=lambda blob: blob[2])
+        self._size = sum(size for _, size, _ in blobs)
+        recent = time.time() - self.keep_seconds
+        for path, size, mtime in blobs:
+            if self._size <= self.max_bytes or mtime > recent:
+                break
+            self._remove(path)
+            self._size -= size
+            metrics.inc('blob_cache_evicted_bytes_total', size)
+        logger.debug(f'blob cache {self.path} is {self._size} bytes after eviction')
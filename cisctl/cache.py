@@ -0,0 +1,138 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""on-disk registry tags cache, shared by pool workers and scheduled runs."""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any
+
+from cisctl import config
+from cisctl import metrics
+from cisctl.logger import logger
+
+
+def _kind(key: str) -> str:
+    """ blob:{host}/{digest} is blob locations of copier, token: and challenge: are registry auth, others are tags """
+    kind, _, _ = key.partition(':')
+    return kind if kind in ('blob', 'token', 'challenge') else 'tags'
+
+
+class TagCache(object):
+    """ sqlite (WAL mode) key value cache with TTL and LRU size eviction
+
+    key is registry + repo, e.g. https://gcr.io/v2/ml-pipeline/api-server
+    value is any json serializable object
+    """
+
+    # run size eviction every `evict_interval` set() in each process
+    evict_interval = 100
+
+    def __init__(self, path: str = config.CACHE_PATH, ttl: int = config.CACHE_TTL,
+                 max_entries: int = config.CACHE_MAX_ENTRIES, mode: int = None):
+        """
+        :param path: sqlite db file path
+        :param ttl: entry time to live, in second
+        :param max_entries: max entries, least recently used entries are evicted
+        :param mode: permission of db file created, e.g. 0o600 for secrets, None is umask default
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.mode = mode
+        self._local = None
+        self._pid = None
+        self._sets = 0
+
+    def __getstate__(self):
+        # sqlite connection can not be pickled or shared after fork, every process and thread opens its own
+        state = self.__dict__.copy()
+        state['_local'] = None
+        state['_pid'] = None
+        return state
+
+    def _connect(self) -> sqlite3.Connection:
+        pid = os.getpid()
+        if self._local is None or self._pid != pid:
+            self._local, self._pid = threading.local(), pid
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            dirname = os.path.dirname(self.path)
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+            if self.mode is not None and not os.path.exists(self.path):
+                # sqlite creates -wal and -shm files with the permission of db file
+                os.close(os.open(self.path, os.O_CREAT | os.O_WRONLY, self.mode))
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS tags ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, updated REAL NOT NULL, accessed REAL NOT NULL)')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Any:
+        """ return cached value, None if missing or expired """
+        try:
+            conn = self._connect()
+            row = conn.execute('SELECT value, updated FROM tags WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                metrics.inc('cache_requests_total', kind=_kind(key), result='miss')
+                return None
+
+            now = time.time()
+            value, updated = row
+            if updated + self.ttl < now:
+                conn.execute('DELETE FROM tags WHERE key = ?', (key,))
+                metrics.inc('cache_requests_total', kind=_kind(key), result='miss')
+                return None
+            conn.execute('UPDATE tags SET accessed = ? WHERE key = ?', (now, key))
+            metrics.inc('cache_requests_total', kind=_kind(key), result='hit')
+            return json.loads(value)
+        except (sqlite3.Error, ValueError):
+            logger.exception(f'read tags cache {self.path} error, key: {key}')
+            return None
+
+    def set(self, key: str, value: Any):
+        try:
+            conn = self._connect()
+            now = time.time()
+            conn.execute(
+                'INSERT OR REPLACE INTO tags (key, value, updated, accessed) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(value, separators=(',', ':')), now, now))
+            self._sets += 1
+            if self._sets % self.evict_interval == 1:
+                self.evict()
+        except sqlite3.Error:
+            logger.exception(f'write tags cache {self.path} error, key: {key}')
+
+    def delete(self, key: str):
+        try:
+            self._connect().execute('DELETE FROM tags WHERE key = ?', (key,))
+        except sqlite3.Error:
+            logger.exception(f'delete tags cache {self.path} error, key: {key}')
+
+    def evict(self):
+        """ drop expired entries, then least recently used entries over max_entries """
+        conn = self._connect()
+        conn.execute('DELETE FROM tags WHERE updated < ?', (time.time() - self.ttl,))
+        conn.execute(
+            'DELETE FROM tags WHERE key IN ('
+            'SELECT key FROM tags ORDER BY accessed DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM tags').fetchone()[0]
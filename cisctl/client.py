@@ -13,11 +13,26 @@
 
 """python http utils."""
 
+import os
+import threading
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from cisctl import adaptive
+from cisctl import config
+from cisctl import metrics
+from cisctl import ratelimit
 from cisctl.logger import logger
 
-timeout = 200
+# (connect timeout, read timeout)
+timeout = (config.HTTP_CONNECT_TIMEOUT, config.HTTP_READ_TIMEOUT)
+
+# pooled sessions of current process, {retries: session}, multiprocessing.Pool workers rebuild them after fork
+_sessions = dict()
+_session_pid = None
+_session_lock = threading.Lock()
 
 
 def _gen_header(header):
@@ -29,42 +44,95 @@ def _gen_header(header):
         return header
 
 
+def _new_session(retries: bool = True):
+    """ pooled session, without retries a request body is sent once, e.g. a streamed blob that cannot be replayed """
+    retry = Retry(
+        total=config.HTTP_RETRIES,
+        connect=config.HTTP_RETRIES,
+        read=config.HTTP_RETRIES,
+        status=config.HTTP_RETRIES,
+        backoff_factor=config.HTTP_BACKOFF_FACTOR,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['HEAD', 'GET', 'PUT', 'DELETE', 'OPTIONS']),
+        respect_retry_after_header=True,
+        raise_on_status=False)
+    adapter = HTTPAdapter(
+        pool_connections=config.HTTP_POOL_CONNECTIONS,
+        pool_maxsize=config.HTTP_POOL_MAXSIZE,
+        pool_block=True,
+        max_retries=retry if retries else 0)
+
+    session = requests.Session()
+    session.verify = False
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session(retries: bool = True) -> requests.Session:
+    """ return the pooled keep-alive session of current process
+
+    :param retries: retry connection errors, 429 and 5xx responses, False sends each request once
+    """
+    global _session_pid
+
+    pid = os.getpid()
+    if retries not in _sessions or _session_pid != pid:
+        with _session_lock:
+            if _session_pid != pid:
+                _sessions.clear()
+                _session_pid = pid
+            if retries not in _sessions:
+                _sessions[retries] = _new_session(retries)
+    return _sessions[retries]
+
+
+def _parse_body(resp, headers):
+    if headers.get('Content-Type', None) == 'application/json':
+        try:
+            return resp.json()
+        except ValueError:
+            return resp.text
+    return resp.text
+
+
 def _http_request(method, url, headers=None, data=None):
+    session = get_session()
+    ratelimit.acquire_url(url)
     try:
         if method == 'GET':
-            resp = requests.get(url=url, headers=headers, params=data, verify=False)
+            resp = session.get(url=url, headers=headers, params=data, timeout=timeout)
         elif method == 'HEAD':
-            resp = requests.head(url=url, headers=headers, verify=False)
+            resp = session.head(url=url, headers=headers, timeout=timeout)
         elif method == 'POST':
-            resp = requests.post(url=url, headers=headers, json=data, verify=False)
+            resp = session.post(url=url, headers=headers, json=data, timeout=timeout)
         elif method == 'DELETE':
-            resp = requests.delete(url=url, headers=headers, json=data, verify=False)
+            resp = session.delete(url=url, headers=headers, json=data, timeout=timeout)
         elif method == 'PUT':
-            resp = requests.put(url=url, headers=headers, json=data, verify=False)
+            resp = session.put(url=url, headers=headers, json=data, timeout=timeout)
         else:
             return False, None
     except requests.exceptions.RequestException:
+        metrics.http(method, url, 'error')
+        adaptive.observe(url, 'error')
         logger.exception(f'http request error! type: {method}, url: {url}, data: {str(data)}')
         return False, None
     else:
+        metrics.http(method, url, resp.status_code)
+        ratelimit.observe(url, resp.status_code, resp.headers)
+        adaptive.observe(url, resp.status_code, resp.elapsed.total_seconds())
         if resp.status_code != 200:
             content = resp.content[:100] if resp.content else ''
             logger.error(
                 f'http request error! type: {method}, url: {url}, data: {str(data)}, '
                 f'response_status_code: {resp.status_code}, response_content: {content}')
-            if headers.get('Content-Type', None) == 'application/json':
-                return False, resp.json()
-            else:
-                return False, resp.text
+            return False, _parse_body(resp, headers)
 
         logger.debug(
             f'http request success! type: {method}, url: {url}, data: {str(data)}, '
             f'response_status_code: {resp.status_code}, response_content: {resp.text}')
 
-        if headers.get('Content-Type', None) == 'application/json':
-            return True, resp.json()
-        else:
-            return True, resp.text
+        return True, _parse_body(resp, headers)
 
 
 def http_get(url, data=None, headers=None):
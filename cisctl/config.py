@@ -20,3 +20,84 @@ CURRENT_PATH = os.getcwd()
 AFTER_TIMEUPLOADEDMS = int(os.environ.get('AFTER_TIMEUPLOADEDMS', 0))
 
 LOG_LEVEL = os.environ.get('LOG_LEVEL', 'DEBUG')
+
+# http client, timeouts in seconds
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 10))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 60))
+HTTP_RETRIES = int(os.environ.get('HTTP_RETRIES', 3))
+HTTP_BACKOFF_FACTOR = float(os.environ.get('HTTP_BACKOFF_FACTOR', 0.5))
+# max keep-alive connections per host, and max hosts pooled per process
+HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 10))
+HTTP_POOL_CONNECTIONS = int(os.environ.get('HTTP_POOL_CONNECTIONS', 20))
+
+# docker hub rate limit, ref https://docs.docker.com/docker-hub/api/latest/#tag/rate-limiting
+# api calls per minute, refilled from X-RateLimit-* response headers
+DOCKER_HUB_API_RATE_LIMIT = int(os.environ.get('DOCKER_HUB_API_RATE_LIMIT', 180))
+# image pushes per hour, 0 is unlimited
+DOCKER_HUB_PUSH_RATE_LIMIT = int(os.environ.get('DOCKER_HUB_PUSH_RATE_LIMIT', 0))
+
+# on-disk registry tags cache, empty CACHE_PATH disables it
+CACHE_PATH = os.environ.get('CACHE_PATH', os.path.join(os.path.expanduser('~'), '.cache', 'cisctl', 'tags.db'))
+# cache entry time to live, in second
+CACHE_TTL = int(os.environ.get('CACHE_TTL', 3600))
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 50000))
+
+# registry bearer tokens and auth challenges shared by pool workers and runs, kept until shortly before
+# `expires_in` and at most TOKEN_CACHE_TTL seconds, empty is only cached in each process
+TOKEN_CACHE_PATH = os.environ.get(
+    'TOKEN_CACHE_PATH', os.path.join(os.path.expanduser('~'), '.cache', 'cisctl', 'tokens.db'))
+TOKEN_CACHE_TTL = int(os.environ.get('TOKEN_CACHE_TTL', 3600))
+TOKEN_CACHE_MAX_ENTRIES = int(os.environ.get('TOKEN_CACHE_MAX_ENTRIES', 10000))
+
+# journal of planned and copied tags, `sync --resume` continues an interrupted run from it, empty is no journal
+JOURNAL_PATH = os.environ.get(
+    'JOURNAL_PATH', os.path.join(os.path.expanduser('~'), '.cache', 'cisctl', 'journal.ndjson'))
+
+# run metrics written when sync is done, empty is not write
+METRICS_TEXTFILE = os.environ.get('METRICS_TEXTFILE', '')
+METRICS_JSON = os.environ.get('METRICS_JSON', '')
+
+# cProfile main process and pool workers, merged pstats written to PROFILE_PATH, empty is no profiling
+PROFILE_PATH = os.environ.get('PROFILE_PATH', '')
+# functions listed in the profile summary
+PROFILE_TOP = int(os.environ.get('PROFILE_TOP', 30))
+
+# source image lists downloaded only when ETag / Last-Modified changed, empty is no cache
+IMAGE_LIST_CACHE_DIR = os.environ.get(
+    'IMAGE_LIST_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'cisctl', 'lists'))
+
+# asyncio sync engine, max images listing and skopeo copy in flight
+CONCURRENCY = int(os.environ.get('CONCURRENCY', 64))
+COPY_CONCURRENCY = int(os.environ.get('COPY_CONCURRENCY', 8))
+
+# AIMD limits of listings and copies in flight per registry host, raised while responses are healthy,
+# halved on 429 / 5xx / errors. process engine pool and asyncio copy concurrency grow to ADAPTIVE_MAX
+ADAPTIVE_CONCURRENCY = os.environ.get('ADAPTIVE_CONCURRENCY', 'false').lower() == 'true'
+ADAPTIVE_INITIAL = int(os.environ.get('ADAPTIVE_INITIAL', 4))
+ADAPTIVE_MIN = int(os.environ.get('ADAPTIVE_MIN', 1))
+ADAPTIVE_MAX = int(os.environ.get('ADAPTIVE_MAX', 32))
+
+# copy engine, `skopeo` runs skopeo copy, `native` copies with the registry api in process
+COPY_ENGINE = os.environ.get('COPY_ENGINE', 'skopeo')
+# platform copied from manifest list, like skopeo copy without --all
+COPY_PLATFORM = os.environ.get('COPY_PLATFORM', 'linux/amd64')
+COPY_ALL_PLATFORMS = os.environ.get('COPY_ALL_PLATFORMS', 'false').lower() == 'true'
+# seconds before skopeo / gcrane commands are killed with the processes they started, 0 is no timeout,
+# a batched skopeo sync gets COMMAND_TIMEOUT per tag
+COMMAND_TIMEOUT = float(os.environ.get('COMMAND_TIMEOUT', 1800))
+LIST_COMMAND_TIMEOUT = float(os.environ.get('LIST_COMMAND_TIMEOUT', 300))
+# bytes of command stdout and stderr written to log, 0 is all
+COMMAND_LOG_MAX_BYTES = int(os.environ.get('COMMAND_LOG_MAX_BYTES', 4096))
+# registry.k8s.io tags, `native` lists them over http from the registry it redirects to and falls back to
+# `gcrane ls`, `gcrane` only runs gcrane
+K8S_LIST_ENGINE = os.environ.get('K8S_LIST_ENGINE', 'native')
+# manifest HEADs in flight while listing digests of a source registry without a vendor tags api, e.g. ghcr.io
+OCI_HEAD_CONCURRENCY = int(os.environ.get('OCI_HEAD_CONCURRENCY', 8))
+# skopeo copy engine copies all new tags of one image with one `skopeo sync --src yaml`
+SKOPEO_SYNC_BATCH = os.environ.get('SKOPEO_SYNC_BATCH', 'true').lower() == 'true'
+# native copy engine downloads blobs to this OCI layout directory and pushes them from it, empty is no cache
+BLOB_CACHE_PATH = os.environ.get('BLOB_CACHE_PATH', '')
+# byte budget of the blob cache, least recently read blobs are evicted, 0 is unlimited
+BLOB_CACHE_MAX_BYTES = int(os.environ.get('BLOB_CACHE_MAX_BYTES', 10 * 1024 ** 3))
+# HEAD source and dest manifest of tags already synced, skip copy when the digests match
+VERIFY_DIGEST = os.environ.get('VERIFY_DIGEST', 'true').lower() == 'true'
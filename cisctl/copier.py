@@ -0,0 +1,249 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""copy images between registries with the OCI distribution api, without skopeo.
+
+Blobs the dest repository already has are skipped with a HEAD request, blobs
+another repository of the same dest namespace has are mounted with
+`POST /v2/<name>/blobs/uploads/?mount=<digest>&from=<repository>`, only the
+missing layers are streamed from source to dest.
+
+copy_fanout() pushes one source tag to several dest registries, source manifests
+and blobs are read once for all of them. With a blob cache, blobs are downloaded
+to it once and pushed from it, across tags, images and runs.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Dict
+from typing import List
+
+import requests
+
+from cisctl import config
+from cisctl import exception
+from cisctl import registry
+from cisctl.logger import logger
+
+FOREIGN_LAYER_MEDIA_TYPES = (
+    'application/vnd.docker.image.rootfs.foreign.diff.tar.gzip',
+    'application/vnd.oci.image.layer.nondistributable.v1.tar+gzip',
+)
+
+
+def _digest(body: bytes) -> str:
+    return f'sha256:{hashlib.sha256(body).hexdigest()}'
+
+
+def _namespace(repository: str) -> str:
+    return repository.rsplit('/', 1)[0] if '/' in repository else ''
+
+
+class Copier(object):
+
+    def __init__(self, all_platforms: bool = config.COPY_ALL_PLATFORMS, platform: str = config.COPY_PLATFORM,
+                 cache=None, blob_cache=None):
+        """
+        :param all_platforms: copy every platform of manifest list, like `skopeo copy --all`,
+            default copies only `platform`, like `skopeo copy`
+        :param platform: os/architecture, e.g. linux/amd64
+        :param cache: cisctl.cache.TagCache, remember which dest repositories have a blob across pool workers
+        :param blob_cache: cisctl.blobcache.BlobCache, local stage of blobs, None streams them from source
+        """
+        self.all_platforms = all_platforms
+        self.os, _, self.architecture = platform.partition('/')
+        self.cache = cache
+        self.blob_cache = blob_cache
+        self._registries = dict()
+        # {(dest host, digest): {repository, ...}}
+        self._blob_locations = dict()
+
+    def registry(self, host: str) -> registry.Registry:
+        if host not in self._registries:
+            self._registries[host] = registry.Registry(host)
+        return self._registries[host]
+
+    def copy(self, src_image: str, dest_image: str, tag: str) -> bool:
+        """ copy src_image:tag to dest_image:tag
+
+        :param src_image: k8s.gcr.io/pause
+        :param dest_image: docker.io/gcmirrors/pause
+        :param tag: 3.9
+        :return: True if success
+        """
+        return self.copy_fanout(src_image, [dest_image], tag)[dest_image]
+
+    def copy_fanout(self, src_image: str, dest_images: List[str], tag: str) -> Dict[str, bool]:
+        """ copy src_image:tag to each of dest_images, manifests and blobs are read from source once
+
+        :param src_image: k8s.gcr.io/pause
+        :param dest_images: [docker.io/gcmirrors/pause, registry.cn-hangzhou.aliyuncs.com/gcmirrors/pause]
+        :param tag: 3.9
+        :return: {dest_image: True if success}
+        """
+        src_host, src_repository = registry.parse_image(src_image)
+        with _Source(self.registry(src_host), src_repository, spool=len(dest_images) > 1,
+                     blob_cache=self.blob_cache) as source:
+            results = dict()
+            for dest_image in dest_images:
+                dest_host, dest_repository = registry.parse_image(dest_image)
+                try:
+                    self._copy(source, self.registry(dest_host), dest_repository, tag)
+                except (exception.RegistryException, requests.exceptions.RequestException, KeyError, ValueError):
+                    logger.exception(f'copy {src_image}:{tag} to {dest_image}:{tag} error')
+                    results[dest_image] = False
+                    continue
+                logger.info(f'copy {src_image}:{tag} to {dest_image}:{tag} success')
+                results[dest_image] = True
+            return results
+
+    def _copy(self, source: '_Source', dest, dest_repository, tag):
+        media_type, body, digest = source.get_manifest(tag)
+        if media_type in registry.MANIFEST_LIST_MEDIA_TYPES and not self.all_platforms:
+            descriptor = self._select_platform(json.loads(body)['manifests'])
+            media_type, body, digest = source.get_manifest(descriptor['digest'])
+        digest = digest or _digest(body)
+
+        dest_digest, _ = dest.head_manifest(dest_repository, tag)
+        if dest_digest == digest:
+            logger.debug(f'{dest.host}/{dest_repository}:{tag} is already {digest}, skip copy')
+            return
+
+        if media_type in registry.MANIFEST_LIST_MEDIA_TYPES:
+            for descriptor in json.loads(body)['manifests']:
+                child_media_type, child_body, _ = source.get_manifest(descriptor['digest'])
+                self._copy_blobs(source, dest, dest_repository, json.loads(child_body))
+                dest.put_manifest(dest_repository, descriptor['digest'], child_media_type, child_body)
+        else:
+            self._copy_blobs(source, dest, dest_repository, json.loads(body))
+        dest.put_manifest(dest_repository, tag, media_type, body)
+
+    def _select_platform(self, manifests) -> Dict:
+        return registry.select_platform(manifests, self.os, self.architecture)
+
+    def _copy_blobs(self, source: '_Source', dest, dest_repository, manifest: Dict):
+        descriptors = [manifest['config']] + manifest.get('layers', [])
+        for descriptor in descriptors:
+            if descriptor.get('mediaType') in FOREIGN_LAYER_MEDIA_TYPES:
+                continue
+            self._copy_blob(source, dest, dest_repository, descriptor)
+
+    def _locations(self, host, digest) -> set:
+        key = (host, digest)
+        if key not in self._blob_locations:
+            self._blob_locations[key] = set()
+            if self.cache is not None:
+                self._blob_locations[key].update(self.cache.get(f'blob:{host}/{digest}') or [])
+        return self._blob_locations[key]
+
+    def _remember(self, host, digest, repository):
+        locations = self._locations(host, digest)
+        if repository not in locations:
+            locations.add(repository)
+            if self.cache is not None:
+                self.cache.set(f'blob:{host}/{digest}', sorted(locations))
+
+    def _copy_blob(self, source: '_Source', dest, dest_repository, descriptor: Dict):
+        digest = descriptor['digest']
+        locations = self._locations(dest.host, digest)
+        if dest_repository in locations or dest.has_blob(dest_repository, digest):
+            self._remember(dest.host, digest, dest_repository)
+            return
+
+        # mount from other repository in the same namespace, e.g. gcmirrors/kube-proxy -> gcmirrors/kube-apiserver
+        candidates = [r for r in locations if _namespace(r) == _namespace(dest_repository)]
+        if source.registry.host == dest.host:
+            candidates.append(source.repository)
+        for from_repository in candidates:
+            if dest.mount_blob(dest_repository, digest, from_repository):
+                self._remember(dest.host, digest, dest_repository)
+                return
+
+        dest.upload_blob(dest_repository, digest, lambda: source.open_blob(digest), descriptor['size'])
+        logger.debug(f'upload blob {digest} ({descriptor["size"]} bytes) to {dest.host}/{dest_repository}')
+        self._remember(dest.host, digest, dest_repository)
+
+
+class _Source(object):
+    """ source repository of one copy_fanout(), manifests are fetched once and kept in memory,
+    blobs are downloaded once to blob cache, or with spool to a temporary directory,
+    and uploaded to each dest from it
+    """
+
+    def __init__(self, src: registry.Registry, repository: str, spool: bool = False, blob_cache=None):
+        self.registry = src
+        self.repository = repository
+        self._blob_cache = blob_cache
+        self._spool_dir = tempfile.mkdtemp(prefix='cisctl-blobs-') if spool and blob_cache is None else None
+        # {reference: (media type, raw manifest, digest)}
+        self._manifests = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        if self._spool_dir is not None:
+            shutil.rmtree(self._spool_dir, ignore_errors=True)
+
+    def get_manifest(self, reference: str) -> (str, bytes, str):
+        if reference not in self._manifests:
+            self._manifests[reference] = self.registry.get_manifest(self.repository, reference)
+        return self._manifests[reference]
+
+    @contextlib.contextmanager
+    def open_blob(self, digest: str):
+        """ yield iterable chunks of blob """
+        if self._blob_cache is not None:
+            path = self._blob_cache.get(digest)
+            if path is None:
+                resp = self.registry.get_blob(self.repository, digest)
+                try:
+                    path = self._blob_cache.put(digest, resp.iter_content(registry.CHUNK_SIZE))
+                finally:
+                    resp.close()
+            with open(path, 'rb') as f:
+                yield iter(lambda: f.read(registry.CHUNK_SIZE), b'')
+            return
+
+        if self._spool_dir is None:
+            resp = self.registry.get_blob(self.repository, digest)
+            try:
+                yield resp.iter_content(registry.CHUNK_SIZE)
+            finally:
+                resp.close()
+            return
+
+        path = os.path.join(self._spool_dir, digest.replace(':', '-'))
+        if not os.path.exists(path):
+            self._download(digest, path)
+        with open(path, 'rb') as f:
+            yield iter(lambda: f.read(registry.CHUNK_SIZE), b'')
+
+    def _download(self, digest: str, path: str):
+        resp = self.registry.get_blob(self.repository, digest)
+        sha256 = hashlib.sha256()
+        try:
+            with open(f'{path}.part', 'wb') as f:
+                for chunk in resp.iter_content(registry.CHUNK_SIZE):
+                    sha256.update(chunk)
+                    f.write(chunk)
+        finally:
+            resp.close()
+        if f'sha256:{sha256.hexdigest()}' != digest:
+            os.remove(f'{path}.part')
+            raise ValueError(f'blob {self.registry.host}/{self.repository}@{digest} digest mismatch')
+        os.rename(f'{path}.part', path)
@@ -43,5 +43,9 @@ class CISException(Exception):
         super(CISException, self).__init__(message)
 
 
+class RegistryException(CISException):
+    msg_fmt = "registry request %(method)s %(url)s failed, status code: %(code)s, content: %(content)s"
+
+
 class CommandError(Exception):
     pass
@@ -0,0 +1,145 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""source image list, fetched conditionally and cached on disk.
+
+An image list is a text file of one image per line, `#` starts a comment line.
+A list url is downloaded only when its `ETag` / `Last-Modified` changed since
+the cached copy, ref https://developer.mozilla.org/en-US/docs/Web/HTTP/Conditional_requests
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+from typing import Iterator
+from typing import List
+
+import requests
+
+from cisctl import client
+from cisctl import config
+from cisctl.logger import logger
+
+_separator_re = re.compile(r'[,\s]+')
+
+
+def parse_sources(sources: str) -> List[str]:
+    """ split comma or whitespace separated list urls and local files """
+    return [source for source in _separator_re.split(sources or '') if source]
+
+
+def _is_url(source: str) -> bool:
+    return source.startswith('http://') or source.startswith('https://')
+
+
+def fetch(url: str, cache_dir: str = config.IMAGE_LIST_CACHE_DIR) -> str:
+    """ download url to cache_dir if it is modified, return the local file path
+
+    :param url: e.g. https://raw.githubusercontent.com/x-mirrors/gcr.io/main/registry.k8s.io/all-repos.txt
+    :param cache_dir: directory of cached lists, empty is no cache, url is downloaded to a temporary file
+        the caller removes
+    :return: path of the list file, None if download failed and no cached copy
+    """
+    if not cache_dir:
+        return _download(url)
+    os.makedirs(cache_dir, exist_ok=True)
+    key = hashlib.sha256(url.encode()).hexdigest()
+    path = os.path.join(cache_dir, f'{key}.txt')
+    meta_path = os.path.join(cache_dir, f'{key}.json')
+
+    meta = dict()
+    if os.path.exists(path):
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = dict()
+    headers = dict()
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+
+    try:
+        with client.get_session().get(url, headers=headers, stream=True, timeout=client.timeout) as resp:
+            if resp.status_code == 304:
+                logger.info(f'image list {url} not modified, use cache {path}')
+                return path
+            if resp.status_code != 200:
+                logger.error(f'fetch image list {url} error, response_status_code: {resp.status_code}')
+                return path if os.path.exists(path) else None
+
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                for chunk in resp.iter_content(64 * 1024):
+                    f.write(chunk)
+            os.replace(tmp_path, path)
+            meta = {'url': url, 'etag': resp.headers.get('ETag'), 'last_modified': resp.headers.get('Last-Modified')}
+    except requests.exceptions.RequestException:
+        logger.exception(f'fetch image list {url} error')
+        return path if os.path.exists(path) else None
+
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+    return path
+
+
+def _download(url: str) -> str:
+    """ download url to a temporary file, return its path, None if download failed """
+    with tempfile.NamedTemporaryFile(prefix='cisctl-images-', suffix='.txt', delete=False) as f:
+        try:
+            with client.get_session().get(url, stream=True, timeout=client.timeout) as resp:
+                ok = resp.status_code == 200
+                if ok:
+                    for chunk in resp.iter_content(64 * 1024):
+                        f.write(chunk)
+                else:
+                    logger.error(f'fetch image list {url} error, response_status_code: {resp.status_code}')
+        except requests.exceptions.RequestException:
+            logger.exception(f'fetch image list {url} error')
+            ok = False
+    if not ok:
+        os.remove(f.name)
+        return None
+    return f.name
+
+
+def iter_images(sources: List[str], cache_dir: str = config.IMAGE_LIST_CACHE_DIR) -> Iterator[str]:
+    """ yield images of all lists in order, skip empty lines, comments and duplicates
+
+    :param sources: list urls or local files
+    :param cache_dir: ref fetch()
+    """
+    seen = set()
+    for source in sources:
+        path = fetch(source, cache_dir) if _is_url(source) else source
+        if path is None:
+            continue
+        try:
+            f = open(path)
+        except OSError:
+            logger.exception(f'read image list {source} error')
+            continue
+        try:
+            with f:
+                for line in f:
+                    image = line.strip()
+                    if image == '' or image.startswith('#') or image in seen:
+                        continue
+                    seen.add(image)
+                    yield image
+        finally:
+            if _is_url(source) and not cache_dir:
+                os.remove(path)
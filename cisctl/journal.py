@@ -0,0 +1,137 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""append-only sync journal, so an interrupted run resumes where it stopped.
+
+One json record per line, appended by every pool worker with a single
+O_APPEND write, e.g.
+
+  {"event": "plan", "image": "k8s.gcr.io/pause", "dest": "docker.io/gcmirrors/pause", "copy_tags": [...], ...}
+  {"event": "copy", "image": "k8s.gcr.io/pause", "dest": "docker.io/gcmirrors/pause", "tag": "3.9",
+   "digest": "sha256:...", "ok": true}
+  {"event": "done", "image": "k8s.gcr.io/pause", "dest": "docker.io/gcmirrors/pause", "result": {...}}
+
+A line cut by a killed process is skipped on replay, and cut off the file, so
+records appended by the resumed run start on a line of their own.
+"""
+
+import json
+import os
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+from cisctl.logger import logger
+
+EVENT_PLAN = 'plan'
+EVENT_COPY = 'copy'
+EVENT_DONE = 'done'
+
+
+class ImageState(object):
+    """ journaled progress of one image to one dest """
+
+    __slots__ = ('plan', 'copied', 'result')
+
+    def __init__(self):
+        # last plan record
+        self.plan = None
+        # tags copied successfully after last plan
+        self.copied = set()
+        # sync_image() result once the image is done
+        self.result = None
+
+    def outstanding(self) -> List[str]:
+        """ planned tags not copied yet """
+        return [tag for tag in self.plan['copy_tags'] if tag not in self.copied] if self.plan else []
+
+
+class Journal(object):
+
+    def __init__(self, path: str):
+        """
+        :param path: journal file, e.g. ~/.cache/cisctl/journal.ndjson
+        """
+        self.path = path
+        self._fd = None
+        self._pid = None
+
+    def __getstate__(self):
+        # file descriptor is opened again in each pool worker
+        state = self.__dict__.copy()
+        state['_fd'] = None
+        state['_pid'] = None
+        return state
+
+    def _write(self, record: Dict):
+        pid = os.getpid()
+        if self._fd is None or self._pid != pid:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            self._pid = pid
+        os.write(self._fd, (json.dumps(record, separators=(',', ':')) + '\n').encode())
+
+    def truncate(self):
+        """ start a new journal """
+        with open(self.path, 'w'):
+            pass
+
+    def plan(self, image: str, dest: str, src_sort_tags: List[Tuple[str, int]], copy_tags: List[str],
+             digests: Dict[str, str], size: int = None):
+        self._write({'event': EVENT_PLAN, 'image': image, 'dest': dest, 'src_sort_tags': src_sort_tags,
+                     'copy_tags': copy_tags, 'digests': {tag: digests.get(tag) for tag in copy_tags}, 'size': size})
+
+    def copy(self, image: str, dest: str, tag: str, digest: str, ok: bool):
+        self._write({'event': EVENT_COPY, 'image': image, 'dest': dest, 'tag': tag, 'digest': digest, 'ok': ok})
+
+    def done(self, image: str, dest: str, result: Dict):
+        self._write({'event': EVENT_DONE, 'image': image, 'dest': dest, 'result': result})
+
+    def replay(self) -> Dict[Tuple[str, str], ImageState]:
+        """ read journal
+
+        :return: {(image, dest): ImageState}
+        """
+        states = dict()
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return states
+        # bytes before a last line without newline, None if the journal ends with a newline
+        cut = None
+        with f:
+            offset = 0
+            for line in f:
+                try:
+                    # every record is written with its newline at once
+                    if not line.endswith(b'\n'):
+                        cut = offset
+                        raise ValueError('no newline')
+                    offset += len(line)
+                    record = json.loads(line)
+                    key, event = (record['image'], record['dest']), record['event']
+                except (ValueError, KeyError, TypeError):
+                    logger.warning(f'skip broken journal line: {line[:200].decode(errors="replace")}')
+                    continue
+                state = states.setdefault(key, ImageState())
+                if event == EVENT_PLAN:
+                    state.plan, state.copied, state.result = record, set(), None
+                elif event == EVENT_COPY and record.get('ok'):
+                    state.copied.add(record['tag'])
+                elif event == EVENT_DONE:
+                    state.result = record['result']
+        if cut is not None:
+            # replayed before pool workers append to it, nothing else writes the journal yet
+            logger.warning(f'cut last line of journal {self.path} written by a killed process')
+            os.truncate(self.path, cut)
+        return states
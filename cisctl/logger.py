@@ -54,3 +54,11 @@ def gen_logger():
 
 
 logger = gen_logger()
+
+
+def log_to_stderr():
+    """ move console logs from stdout to stderr, so stdout carries only command output, e.g. `cisctl plan` """
+    for handler in logger.handlers:
+        # FileHandler is a StreamHandler too
+        if type(handler) is logging.StreamHandler and handler.stream is sys.stdout:
+            handler.setStream(sys.stderr)
@@ -0,0 +1,216 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""run metrics, aggregated across pool workers and exported when sync is done.
+
+Each process records into its own registry. A pool worker returns a snapshot of
+what its task recorded with drain(), the main process merge()s them, and writes
+a Prometheus textfile and a json file at the end of the run,
+ref https://github.com/prometheus/node_exporter#textfile-collector
+
+counters:
+  - cisctl_http_requests_total{host, method, code}, code is `error` on connection error
+  - cisctl_cache_requests_total{kind, result}, result is `hit` or `miss`
+  - cisctl_skopeo_runs_total{command, code}
+  - cisctl_tags_total{result}, result is `skipped`, `unchanged`, `copied` or `failed`
+summaries (count, sum, max seconds):
+  - cisctl_stage_seconds{stage, registry}, stage is `list_source`, `list_dest`, `verify` or `copy`
+  - cisctl_ratelimit_wait_seconds{bucket}
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict
+from urllib.parse import urlparse
+
+PREFIX = 'cisctl_'
+
+_lock = threading.Lock()
+_pid = None
+# {(name, ((label, value), ...)): value}
+_counters = dict()
+# {(name, ((label, value), ...)): [count, sum, max]}
+_summaries = dict()
+# {image: {field: value}}
+_images = dict()
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _check_pid():
+    # forked pool worker starts with empty metrics, parent's are not reported twice
+    global _pid
+    pid = os.getpid()
+    if _pid != pid:
+        _pid = pid
+        _counters.clear()
+        _summaries.clear()
+        _images.clear()
+
+
+def inc(name: str, value: float = 1, **labels):
+    """ add value to counter """
+    key = _key(name, labels)
+    with _lock:
+        _check_pid()
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name: str, seconds: float, **labels):
+    """ record one duration of summary """
+    key = _key(name, labels)
+    with _lock:
+        _check_pid()
+        summary = _summaries.setdefault(key, [0, 0.0, 0.0])
+        summary[0] += 1
+        summary[1] += seconds
+        summary[2] = max(summary[2], seconds)
+
+
+def image(image_name: str, **fields):
+    """ add numeric fields to per image record, e.g. image('k8s.gcr.io/pause', copy=1.2, copied=2) """
+    with _lock:
+        _check_pid()
+        record = _images.setdefault(image_name, dict())
+        for k, v in fields.items():
+            record[k] = record.get(k, 0) + v
+
+
+@contextmanager
+def timer(stage: str, registry: str, image_name: str = None):
+    """ observe stage seconds of registry, also added to image record if image_name is set """
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        seconds = time.monotonic() - start
+        observe('stage_seconds', seconds, stage=stage, registry=registry)
+        if image_name is not None:
+            image(image_name, **{stage: seconds})
+
+
+def http(method: str, url: str, code):
+    """ count one http request """
+    inc('http_requests_total', host=urlparse(url).netloc, method=method, code=code)
+
+
+def _snapshot() -> Dict:
+    return {
+        'counters': [[name, dict(labels), value] for (name, labels), value in _counters.items()],
+        'summaries': [[name, dict(labels)] + list(summary) for (name, labels), summary in _summaries.items()],
+        'images': {k: dict(v) for k, v in _images.items()},
+    }
+
+
+def snapshot() -> Dict:
+    """ return picklable and json serializable copy of current metrics """
+    with _lock:
+        _check_pid()
+        return _snapshot()
+
+
+def reset():
+    with _lock:
+        _check_pid()
+        _counters.clear()
+        _summaries.clear()
+        _images.clear()
+
+
+def drain() -> Dict:
+    """ snapshot() and reset(), for pool worker to return metrics of one task """
+    with _lock:
+        _check_pid()
+        result = _snapshot()
+        _counters.clear()
+        _summaries.clear()
+        _images.clear()
+        return result
+
+
+def merge(other: Dict):
+    """ add snapshot of other process into current metrics """
+    if not other:
+        return
+    with _lock:
+        _check_pid()
+        for name, labels, value in other['counters']:
+            key = _key(name, labels)
+            _counters[key] = _counters.get(key, 0) + value
+        for name, labels, count, total, maximum in other['summaries']:
+            summary = _summaries.setdefault(_key(name, labels), [0, 0.0, 0.0])
+            summary[0] += count
+            summary[1] += total
+            summary[2] = max(summary[2], maximum)
+        for image_name, fields in other['images'].items():
+            record = _images.setdefault(image_name, dict())
+            for k, v in fields.items():
+                record[k] = record.get(k, 0) + v
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels: Dict, **extra) -> str:
+    labels = dict(labels, **extra)
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(str(v))}"' for k, v in sorted(labels.items())) + '}'
+
+
+def prometheus(data: Dict) -> str:
+    """ render snapshot in prometheus text exposition format """
+    lines = []
+    counters, summaries = dict(), dict()
+    for name, labels, value in data['counters']:
+        counters.setdefault(name, []).append((labels, value))
+    for name, labels, count, total, maximum in data['summaries']:
+        summaries.setdefault(name, []).append((labels, count, total, maximum))
+
+    for name in sorted(counters):
+        lines.append(f'# TYPE {PREFIX}{name} counter')
+        for labels, value in sorted(counters[name], key=lambda x: _labels(x[0])):
+            lines.append(f'{PREFIX}{name}{_labels(labels)} {value}')
+    for name in sorted(summaries):
+        lines.append(f'# TYPE {PREFIX}{name} summary')
+        for labels, count, total, _ in sorted(summaries[name], key=lambda x: _labels(x[0])):
+            lines.append(f'{PREFIX}{name}_count{_labels(labels)} {count}')
+            lines.append(f'{PREFIX}{name}_sum{_labels(labels)} {total:.6f}')
+        lines.append(f'# TYPE {PREFIX}{name}_max gauge')
+        for labels, _, _, maximum in sorted(summaries[name], key=lambda x: _labels(x[0])):
+            lines.append(f'{PREFIX}{name}_max{_labels(labels)} {maximum:.6f}')
+    return '\n'.join(lines) + '\n'
+
+
+def _write(path: str, content: str):
+    # textfile collector may read at any time, replace the file atomically
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def export(textfile: str = None, json_path: str = None):
+    """ write current metrics as prometheus textfile and json, skip empty path """
+    data = snapshot()
+    if textfile:
+        _write(textfile, prometheus(data))
+    if json_path:
+        _write(json_path, json.dumps(data, indent=2, sort_keys=True))
@@ -0,0 +1,135 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""cProfile the main process and every multiprocessing.Pool worker of a sync run.
+
+start() profiles the main process, initializer() wraps the pool initializer so each
+forked worker profiles itself and dumps its stats into a shared directory when it
+exits, with multiprocessing.util.Finalize. profile_thread() is the thread pool
+initializer of the asyncio engine. stop() merges all stats into one pstats file,
+readable with `python -m pstats <path>` or snakeviz, and writes the top functions
+next to it as `<path>.txt`.
+"""
+
+import cProfile
+import glob
+import io
+import os
+import pstats
+import shutil
+import tempfile
+import threading
+from multiprocessing import util
+
+from cisctl.logger import logger
+
+PROFILE_TOP = 30
+
+_lock = threading.Lock()
+# stats directory shared by main process and workers, None is not profiling
+_directory = None
+_path = None
+_top = PROFILE_TOP
+# profiles of this process, one per profiled thread
+_profiles = []
+
+
+def _enable():
+    profile = cProfile.Profile()
+    with _lock:
+        _profiles.append(profile)
+    profile.enable()
+
+
+def _dump(directory):
+    with _lock:
+        for i, profile in enumerate(_profiles):
+            # threads of the asyncio engine are shut down already, their stats are complete
+            profile.disable()
+            profile.dump_stats(os.path.join(directory, f'{os.getpid()}-{i}.prof'))
+        _profiles.clear()
+
+
+def start(path: str, top: int = PROFILE_TOP):
+    """ start profiling main process
+
+    :param path: merged pstats file written by stop()
+    :param top: functions listed in summary
+    """
+    global _directory, _path, _top
+    _directory = tempfile.mkdtemp(prefix='cisctl-profile-')
+    _path, _top = path, top
+    _enable()
+    logger.info(f'profiling to {path}, stats directory is {_directory}')
+
+
+def _init_worker(directory, initializer, initargs):
+    if initializer is not None:
+        initializer(*initargs)
+    # forked from a profiled main thread, stop the inherited profile
+    with _lock:
+        for profile in _profiles:
+            profile.disable()
+        _profiles.clear()
+    _enable()
+    util.Finalize(None, _dump, args=(directory,), exitpriority=100)
+
+
+def initializer(func=None, initargs=()) -> tuple:
+    """ return (initializer, initargs) of multiprocessing.Pool, profile workers when profiling
+
+    stats of a worker are written when it exits after Pool.close() and Pool.join(),
+    workers killed by Pool.terminate() are lost
+    """
+    if _directory is None:
+        return func, initargs
+    return _init_worker, (_directory, func, initargs)
+
+
+def profile_thread():
+    """ ThreadPoolExecutor initializer, profile the thread when profiling """
+    if _directory is not None:
+        _enable()
+
+
+def stop() -> str:
+    """ stop profiling, merge stats of main process and workers into path
+
+    :return: summary of top functions by own time and by cumulative time, None if not profiling
+    """
+    global _directory
+    if _directory is None:
+        return None
+    directory, _directory = _directory, None
+    _dump(directory)
+    files = sorted(glob.glob(os.path.join(directory, '*.prof')))
+    try:
+        stats = pstats.Stats(*files, stream=io.StringIO())
+        if os.path.dirname(_path):
+            os.makedirs(os.path.dirname(_path), exist_ok=True)
+        stats.dump_stats(_path)
+
+        stream = io.StringIO()
+        stats.stream = stream
+        # the temporary file names are noise in the summary
+        stats.files = []
+        stream.write(f'merged {len(files)} profiles of {len({f.rsplit("-", 1)[0] for f in files})} processes\n')
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(_top)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(_top)
+        summary = stream.getvalue()
+        with open(f'{_path}.txt', 'w') as f:
+            f.write(summary)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    logger.info(f'profile written to {_path}, summary to {_path}.txt')
+    return summary
@@ -0,0 +1,274 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""token bucket rate limiter shared by multiprocessing.Pool workers.
+
+ref:
+  - https://docs.docker.com/docker-hub/api/latest/#tag/rate-limiting
+  - https://docs.docker.com/docker-hub/download-rate-limit/
+"""
+
+import multiprocessing
+import time
+from typing import Dict
+from urllib.parse import urlparse
+
+from cisctl import metrics
+from cisctl.logger import logger
+
+# bucket names
+DOCKER_HUB_API = 'docker-hub-api'
+DOCKER_HUB_PUSH = 'docker-hub-push'
+DOCKER_HUB_PULL = 'docker-hub-pull'
+
+DOCKER_HUB_API_HOSTS = ('hub.docker.com', 'registry.hub.docker.com')
+DOCKER_HUB_REGISTRY_HOSTS = ('registry-1.docker.io', 'docker.io', 'index.docker.io')
+
+# {"bucket name": TokenBucket}
+_buckets = dict()
+# {"host": "bucket name"}
+_hosts = dict()
+# buckets only tracking quota of their hosts, requests take no token and wait only when blocked by 429
+_tracked = {DOCKER_HUB_PULL}
+
+
+class TokenBucket(object):
+    """ token bucket kept in shared memory, so all forked workers draw from the same budget """
+
+    def __init__(self, name: str, limit: float, window: float):
+        """
+        :param name: bucket name
+        :param limit: max calls in window, 0 is unlimited
+        :param window: window in seconds
+        """
+        self.name = name
+        self._lock = multiprocessing.Lock()
+        self._capacity = multiprocessing.Value('d', limit, lock=False)
+        self._rate = multiprocessing.Value('d', limit / window if window else 0, lock=False)
+        self._tokens = multiprocessing.Value('d', limit, lock=False)
+        self._updated = multiprocessing.Value('d', time.monotonic(), lock=False)
+        # unix timestamp, no token is handed out before it
+        self._blocked_until = multiprocessing.Value('d', 0, lock=False)
+
+    @property
+    def tokens(self) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens.value
+
+    def _refill(self, now):
+        elapsed = now - self._updated.value
+        if elapsed > 0:
+            self._tokens.value = min(self._capacity.value, self._tokens.value + elapsed * self._rate.value)
+        self._updated.value = now
+
+    def acquire(self, tokens: float = 1, max_wait: float = None) -> float:
+        """ take tokens from bucket, block until they are available
+
+        :param tokens: tokens to take
+        :param max_wait: give up after max_wait seconds, None is wait forever
+        :return: seconds waited, -1 if give up
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                if self._rate.value <= 0 and self._blocked_until.value <= 0:
+                    return waited
+                now = time.monotonic()
+                self._refill(now)
+
+                wait = self._blocked_until.value - time.time()
+                if wait <= 0:
+                    if self._rate.value <= 0:
+                        return waited
+                    if self._tokens.value >= tokens:
+                        self._tokens.value -= tokens
+                        return waited
+                    wait = (tokens - self._tokens.value) / self._rate.value
+
+            if max_wait is not None and waited + wait > max_wait:
+                return -1
+            logger.debug(f'rate limit [{self.name}] exhausted, wait {wait:.2f}s')
+            time.sleep(wait)
+            waited += wait
+
+    def update(self, limit: float = None, remaining: float = None, window: float = None, reset: float = None):
+        """ refill bucket from server side rate limit state
+
+        :param limit: max calls in window
+        :param remaining: remaining calls in window
+        :param window: window in seconds
+        :param reset: unix timestamp when remaining resets
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if limit is not None and window:
+                self._capacity.value = limit
+                self._rate.value = limit / window
+            if remaining is not None:
+                self._tokens.value = min(remaining, self._capacity.value)
+            if reset is not None:
+                if remaining is not None and remaining <= 0:
+                    self._blocked_until.value = reset
+                elif reset <= time.time():
+                    self._blocked_until.value = 0
+
+    def block(self, until: float):
+        """ no token is handed out before unix timestamp `until` """
+        with self._lock:
+            self._tokens.value = 0
+            self._blocked_until.value = max(self._blocked_until.value, until)
+
+
+def _parse_limit(value) -> (float, float):
+    """ parse rate limit header value
+
+    :param value: one of
+        - 180
+        - 100;w=21600
+    :return (limit, window)
+    """
+    if value is None:
+        return None, None
+    parts = str(value).split(';')
+    try:
+        limit = float(parts[0])
+    except ValueError:
+        return None, None
+    window = None
+    for p in parts[1:]:
+        k, _, v = p.strip().partition('=')
+        if k == 'w':
+            try:
+                window = float(v)
+            except ValueError:
+                pass
+    return limit, window
+
+
+def parse_headers(headers) -> Dict:
+    """ parse docker hub rate limit headers
+
+    docker hub api:
+        x-ratelimit-limit: 180
+        x-ratelimit-remaining: 180
+        x-ratelimit-reset: 1646881125
+        x-retry-after: 1646881125  (only with 429)
+    docker hub registry:
+        ratelimit-limit: 100;w=21600
+        ratelimit-remaining: 76;w=21600
+
+    :param headers: case-insensitive response headers
+    :return: {'limit': 180.0, 'remaining': 180.0, 'window': 60.0, 'reset': 1646881125.0}, empty if no header
+    """
+    result = dict()
+    if headers is None:
+        return result
+
+    if headers.get('X-RateLimit-Limit') is not None:
+        limit, window = _parse_limit(headers.get('X-RateLimit-Limit'))
+        remaining, _ = _parse_limit(headers.get('X-RateLimit-Remaining'))
+        result.update({'limit': limit, 'remaining': remaining, 'window': window or 60})
+    elif headers.get('RateLimit-Limit') is not None:
+        limit, window = _parse_limit(headers.get('RateLimit-Limit'))
+        remaining, _ = _parse_limit(headers.get('RateLimit-Remaining'))
+        result.update({'limit': limit, 'remaining': remaining, 'window': window})
+
+    for key in ('X-Retry-After', 'X-RateLimit-Reset'):
+        reset, _ = _parse_limit(headers.get(key))
+        if reset is not None:
+            result['reset'] = reset
+            break
+    return result
+
+
+def register(bucket: TokenBucket, hosts=()):
+    _buckets[bucket.name] = bucket
+    for host in hosts:
+        _hosts[host] = bucket.name
+
+
+def install(buckets: Dict, hosts: Dict):
+    """ multiprocessing.Pool initializer, share parent buckets with worker """
+    _buckets.clear()
+    _buckets.update(buckets)
+    _hosts.clear()
+    _hosts.update(hosts)
+
+
+def state() -> (Dict, Dict):
+    """ return initargs for install() """
+    return dict(_buckets), dict(_hosts)
+
+
+def setup_docker_hub(api_rate_limit: int, push_rate_limit: int):
+    """ register docker hub buckets
+
+    :param api_rate_limit: docker hub api calls per minute, 0 is unlimited
+    :param push_rate_limit: docker hub pushes per hour, 0 is unlimited
+    """
+    register(TokenBucket(DOCKER_HUB_API, api_rate_limit, 60), DOCKER_HUB_API_HOSTS)
+    # taken by name per pushed tag, registry responses carry pull quota headers only
+    register(TokenBucket(DOCKER_HUB_PUSH, push_rate_limit, 3600))
+    # pull quota, e.g. 100;w=21600, HEAD and blob requests are not pulls, so it is tracked and not metered
+    register(TokenBucket(DOCKER_HUB_PULL, 0, 21600), DOCKER_HUB_REGISTRY_HOSTS)
+
+
+def _bucket_for_url(url) -> TokenBucket:
+    host = urlparse(url).hostname
+    name = _hosts.get(host)
+    if name is None:
+        return None
+    return _buckets.get(name)
+
+
+def _observe_wait(bucket: TokenBucket, waited: float) -> float:
+    if waited > 0:
+        metrics.observe('ratelimit_wait_seconds', waited, bucket=bucket.name)
+    return waited
+
+
+def acquire(name: str, tokens: float = 1) -> float:
+    """ take tokens from bucket `name`, no-op if bucket is not registered """
+    bucket = _buckets.get(name)
+    if bucket is None:
+        return 0
+    return _observe_wait(bucket, bucket.acquire(tokens))
+
+
+def acquire_url(url) -> float:
+    """ take a token for a http request to url """
+    bucket = _bucket_for_url(url)
+    if bucket is None:
+        return 0
+    return _observe_wait(bucket, bucket.acquire(0 if bucket.name in _tracked else 1))
+
+
+def observe(url, status_code: int, headers):
+    """ refill bucket from response of a http request to url """
+    bucket = _bucket_for_url(url)
+    if bucket is None:
+        return
+
+    info = parse_headers(headers)
+    if status_code == 429:
+        reset = info.get('reset') or time.time() + 60
+        logger.warning(f'rate limit [{bucket.name}] hit 429, blocked until {reset}')
+        bucket.block(reset)
+        return
+    if info:
+        bucket.update(
+            limit=info.get('limit'),
+            remaining=info.get('remaining'),
+            window=info.get('window'),
+            reset=info.get('reset'))
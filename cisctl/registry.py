@@ -0,0 +1,249 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""OCI distribution registry client.
+
+ref:
+  - https://github.com/opencontainers/distribution-spec/blob/main/spec.md
+  - https://docs.docker.com/registry/spec/api/
+"""
+
+import time
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+from urllib.parse import urlparse
+
+import requests
+
+from cisctl import auth
+from cisctl import config
+from cisctl import exception
+from cisctl.logger import logger
+
+MEDIA_TYPE_DOCKER_MANIFEST = 'application/vnd.docker.distribution.manifest.v2+json'
+MEDIA_TYPE_DOCKER_MANIFEST_LIST = 'application/vnd.docker.distribution.manifest.list.v2+json'
+MEDIA_TYPE_OCI_MANIFEST = 'application/vnd.oci.image.manifest.v1+json'
+MEDIA_TYPE_OCI_INDEX = 'application/vnd.oci.image.index.v1+json'
+
+MANIFEST_LIST_MEDIA_TYPES = (MEDIA_TYPE_DOCKER_MANIFEST_LIST, MEDIA_TYPE_OCI_INDEX)
+MANIFEST_ACCEPT = ', '.join(
+    [MEDIA_TYPE_OCI_INDEX, MEDIA_TYPE_DOCKER_MANIFEST_LIST, MEDIA_TYPE_OCI_MANIFEST, MEDIA_TYPE_DOCKER_MANIFEST])
+
+# registry host to api endpoint
+ENDPOINTS = {
+    'docker.io': 'https://registry-1.docker.io',
+    'index.docker.io': 'https://registry-1.docker.io',
+}
+
+CHUNK_SIZE = 1024 * 1024
+# blob PUT responses the upload is started again after, with a new body
+UPLOAD_RETRY_STATUS = (401, 429, 500, 502, 503, 504)
+
+
+def endpoint(host: str) -> str:
+    """ return registry api endpoint of host, e.g. docker.io -> https://registry-1.docker.io """
+    return ENDPOINTS.get(host, f'https://{host}')
+
+
+def parse_image(image: str) -> (str, str):
+    """ parse image to (registry host, repository)
+
+    :param image: one of
+        - docker.io/gcmirrors/pause
+        - docker.io/nginx
+        - k8s.gcr.io/pause
+        - gcr.io/ml-pipeline/api-server
+    :return: one of
+        - ('docker.io', 'gcmirrors/pause')
+        - ('docker.io', 'library/nginx')
+        - ('k8s.gcr.io', 'pause')
+        - ('gcr.io', 'ml-pipeline/api-server')
+    """
+    host, _, repository = image.partition('/')
+    if host == 'docker.io' and '/' not in repository:
+        repository = f'library/{repository}'
+    return host, repository
+
+
+def select_platform(manifests: List[Dict], os: str, architecture: str) -> Dict:
+    """ return descriptor of os/architecture from manifest list, the first one if not found """
+    for descriptor in manifests:
+        platform = descriptor.get('platform', {})
+        if platform.get('os') == os and platform.get('architecture') == architecture:
+            return descriptor
+    return manifests[0]
+
+
+def _backoff(attempt: int, retry_after: str = None) -> float:
+    """ seconds before retry `attempt`, Retry-After seconds of the response if given, like urllib3 Retry """
+    try:
+        return max(float(retry_after), 0)
+    except (TypeError, ValueError):
+        return config.HTTP_BACKOFF_FACTOR * (2 ** attempt) if attempt else 0
+
+
+class _SizedStream(object):
+    """ iterable request body with known length, so it is sent with Content-Length instead of chunked """
+
+    def __init__(self, iterable: Iterable[bytes], size: int):
+        self._iterable = iterable
+        self._size = size
+
+    def __iter__(self):
+        return iter(self._iterable)
+
+    def __len__(self):
+        return self._size
+
+
+class Registry(object):
+    """ one registry host """
+
+    def __init__(self, host: str):
+        """
+        :param host: registry host, e.g. docker.io, gcr.io, quay.io
+        """
+        self.host = host
+        self.url = endpoint(host)
+
+    def set_credentials(self, user: str, password: str):
+        auth.set_credentials(urlparse(self.url).netloc, user, password)
+
+    def _request(self, method, path, scopes, **kwargs) -> requests.Response:
+        url = path if '://' in path else f'{self.url}/v2/{path}'
+        return auth.request(method, url, scopes=scopes, **kwargs)
+
+    @staticmethod
+    def _raise(resp: requests.Response):
+        raise exception.RegistryException(
+            method=resp.request.method, url=resp.url, code=resp.status_code, content=resp.content[:200])
+
+    def head_manifest(self, repository: str, reference: str) -> (str, str):
+        """ return (digest, media type) of manifest, (None, None) if not found """
+        resp = self._request(
+            'HEAD', f'{repository}/manifests/{reference}', (f'repository:{repository}:pull',),
+            headers={'Accept': MANIFEST_ACCEPT})
+        if resp.status_code == 404:
+            return None, None
+        if resp.status_code != 200:
+            self._raise(resp)
+        return resp.headers.get('Docker-Content-Digest'), resp.headers.get('Content-Type')
+
+    def get_manifest(self, repository: str, reference: str) -> (str, bytes, str):
+        """ return (media type, raw manifest, digest) """
+        resp = self._request(
+            'GET', f'{repository}/manifests/{reference}', (f'repository:{repository}:pull',),
+            headers={'Accept': MANIFEST_ACCEPT})
+        if resp.status_code != 200:
+            self._raise(resp)
+        return resp.headers.get('Content-Type'), resp.content, resp.headers.get('Docker-Content-Digest')
+
+    def put_manifest(self, repository: str, reference: str, media_type: str, body: bytes):
+        resp = self._request(
+            'PUT', f'{repository}/manifests/{reference}', (f'repository:{repository}:pull,push',),
+            headers={'Content-Type': media_type}, data=body)
+        if resp.status_code not in (200, 201):
+            self._raise(resp)
+
+    def list_tags(self, repository: str, page_size: int = 1000) -> List[str]:
+        """ return tags of repository, follow `Link: <...>; rel="next"` pagination, [] if not found """
+        tags = list()
+        path = f'{repository}/tags/list?n={page_size}'
+        while path:
+            resp = self._request('GET', path, (f'repository:{repository}:pull',))
+            if resp.status_code == 404:
+                return tags
+            if resp.status_code != 200:
+                self._raise(resp)
+            tags += resp.json().get('tags') or []
+            next_link = resp.links.get('next', {}).get('url')
+            path = self._absolute(next_link) if next_link else None
+        return tags
+
+    def has_blob(self, repository: str, digest: str) -> bool:
+        resp = self._request(
+            'HEAD', f'{repository}/blobs/{digest}', (f'repository:{repository}:pull,push',),
+            allow_redirects=False)
+        if resp.status_code in (200, 307):
+            return True
+        if resp.status_code == 404:
+            return False
+        self._raise(resp)
+
+    def get_blob(self, repository: str, digest: str) -> requests.Response:
+        """ return streaming response of blob, caller must close it """
+        resp = self._request('GET', f'{repository}/blobs/{digest}', (f'repository:{repository}:pull',), stream=True)
+        if resp.status_code != 200:
+            resp.close()
+            self._raise(resp)
+        return resp
+
+    def mount_blob(self, repository: str, digest: str, from_repository: str) -> bool:
+        """ cross-repository blob mount, return False if registry starts a normal upload instead """
+        resp = self._request(
+            'POST', f'{repository}/blobs/uploads/?mount={digest}&from={from_repository}',
+            (f'repository:{repository}:pull,push', f'repository:{from_repository}:pull'))
+        if resp.status_code == 201:
+            logger.debug(f'mount blob {digest} from {self.host}/{from_repository} to {repository}')
+            return True
+        if resp.status_code == 202:
+            # registry opened an upload session, cancel it
+            location = resp.headers.get('Location')
+            if location:
+                self._request('DELETE', self._absolute(location), (f'repository:{repository}:pull,push',))
+            return False
+        self._raise(resp)
+
+    def upload_blob(self, repository: str, digest: str, open_data: Callable, size: int,
+                    retries: int = config.HTTP_RETRIES):
+        """ monolithic upload, data is streamed
+
+        a streamed body is read once, so the PUT is sent without transport retries or a resend after 401,
+        the upload is started again with data opened again instead
+
+        :param open_data: return a context manager of iterable chunks, e.g. lambda: source.open_blob(digest)
+        :param retries: uploads started again after a connection error, 401, 429 or 5xx
+        """
+        scopes = (f'repository:{repository}:pull,push',)
+        for attempt in range(retries + 1):
+            resp = self._request('POST', f'{repository}/blobs/uploads/', scopes)
+            if resp.status_code != 202:
+                self._raise(resp)
+
+            location = self._absolute(resp.headers['Location'])
+            location += ('&' if '?' in location else '?') + f'digest={digest}'
+            try:
+                with open_data() as data:
+                    resp = self._request(
+                        'PUT', location, scopes, replayable=False,
+                        headers={'Content-Type': 'application/octet-stream'}, data=_SizedStream(data, size))
+            except requests.exceptions.RequestException:
+                if attempt == retries:
+                    raise
+                logger.warning(f'upload blob {digest} to {self.host}/{repository} error, retry')
+                retry_after = None
+            else:
+                if resp.status_code in (201, 204):
+                    return
+                if resp.status_code not in UPLOAD_RETRY_STATUS or attempt == retries:
+                    self._raise(resp)
+                logger.warning(f'upload blob {digest} to {self.host}/{repository} got {resp.status_code}, retry')
+                retry_after = resp.headers.get('Retry-After')
+            time.sleep(_backoff(attempt, retry_after))
+
+    def _absolute(self, location: str) -> str:
+        if location.startswith('/'):
+            return f'{self.url}{location}'
+        return location
@@ -14,9 +14,30 @@
 """python skopeo utils."""
 
 import json
-
+import os
+import re
+import tempfile
+from typing import Dict
+from typing import List
+
+from cisctl import adaptive
+from cisctl import config
+from cisctl import metrics
 from cisctl.bash import Bash
 
+# skopeo sync --keep-going logs: Error copying ref "docker://k8s.gcr.io/pause:3.9": ...
+_sync_error_re = re.compile(r'copying ref \\?"[^"\s]*?:(?P<tag>\w[\w.-]{0,127})\\?"', re.IGNORECASE)
+# e.g. toomanyrequests: You have reached your pull rate limit / 429 Too Many Requests
+_rate_limit_re = re.compile(r'toomanyrequests|too many requests|rate limit', re.IGNORECASE)
+
+
+def _observe(dest_repo: str, code: int, stderr: str):
+    """ feed skopeo result to adaptive concurrency of dest registry """
+    if code == 0:
+        adaptive.success(dest_repo)
+    elif _rate_limit_re.search(stderr or ''):
+        adaptive.congested(dest_repo)
+
 
 class Skopeo(object):
 
@@ -39,16 +60,36 @@ class Skopeo(object):
 
         skopeo copy --insecure-policy --src-tls-verify=false --dest-tls-verify=false -q \
         docker://k8s.gcr.io/pause-amd64:latest docker://docker.io/gcmirrors/pause-amd64:latest
-        :return:
+        :return: True if success
         """
+        cmd = self._copy_cmd(src_repo, dest_repo, name, tag, dest_name, src_transport, dest_transport,
+                             src_tls_verify, dest_tls_verify)
+        code, _, stderr = self.bash.run(cmd, result=True)
+        metrics.inc('skopeo_runs_total', command='copy', code=code)
+        _observe(dest_repo, code, stderr)
+        return code == 0
+
+    async def async_copy(self, src_repo, dest_repo, name, tag, dest_name=None, src_transport='docker',
+                         dest_transport='docker', src_tls_verify='false', dest_tls_verify='false'):
+        """ coroutine of copy(), for asyncio engine """
+        cmd = self._copy_cmd(src_repo, dest_repo, name, tag, dest_name, src_transport, dest_transport,
+                             src_tls_verify, dest_tls_verify)
+        code, _, stderr = await self.bash.async_run(cmd, result=True)
+        metrics.inc('skopeo_runs_total', command='copy', code=code)
+        _observe(dest_repo, code, stderr)
+        return code == 0
+
+    @staticmethod
+    def _copy_cmd(src_repo, dest_repo, name, tag, dest_name, src_transport, dest_transport,
+                  src_tls_verify, dest_tls_verify):
         if dest_name is None:
             dest_name = name
-        cmd = f'skopeo copy --insecure-policy --src-tls-verify={src_tls_verify} --dest-tls-verify={dest_tls_verify} ' \
-              f'-q {src_transport}://{src_repo}/{name}:{tag} {dest_transport}://{dest_repo}/{dest_name}:{tag}'
-        _ = self.bash.run(cmd)
+        return ['skopeo', 'copy', '--insecure-policy', f'--src-tls-verify={src_tls_verify}',
+                f'--dest-tls-verify={dest_tls_verify}', '-q',
+                f'{src_transport}://{src_repo}/{name}:{tag}', f'{dest_transport}://{dest_repo}/{dest_name}:{tag}']
 
     def sync(self, src_repo, dest_repo, name, src_transport='docker', dest_transport='docker',
-             src_tls_verify='false', dest_tls_verify='false'):
+             src_tls_verify='false', dest_tls_verify='false', tags: List[str] = None) -> Dict[str, bool]:
         """ Synchronize one or more images from one location to another
 
         :param src_repo: k8s.gcr.io
@@ -58,14 +99,90 @@ class Skopeo(object):
         :param dest_transport: docker
         :param src_tls_verify: false
         :param dest_tls_verify: false
+        :param tags: only sync these tags in one skopeo invocation, None is all tags
 
         skopeo sync --insecure-policy --src-tls-verify=false --dest-tls-verify=false --src docker --dest docker \
         k8s.gcr.io/pause-amd64 docker.io/gcmirrors
-        :return:
+
+        with tags, source is a generated yaml spec:
+        skopeo sync --insecure-policy --dest-tls-verify=false --keep-going --src yaml --dest docker \
+        /tmp/xxx.yaml docker.io/gcmirrors
+        :return: {tag: True if success}, empty if tags is None
         """
-        cmd = f'skopeo sync --insecure-policy --src-tls-verify={src_tls_verify} --dest-tls-verify={dest_tls_verify} ' \
-              f'--src {src_transport} --dest {dest_transport} {src_repo}/{name} {dest_repo}'
-        _ = self.bash.run(cmd)
+        if not tags:
+            cmd = ['skopeo', 'sync', '--insecure-policy', f'--src-tls-verify={src_tls_verify}',
+                   f'--dest-tls-verify={dest_tls_verify}',
+                   '--src', src_transport, '--dest', dest_transport, f'{src_repo}/{name}', dest_repo]
+            # number of tags is unknown, the run is not timed out
+            code = self.bash.run(cmd, timeout=0)
+            metrics.inc('skopeo_runs_total', command='sync', code=code)
+            return {}
+
+        spec = self._write_sync_spec(src_repo, name, tags, src_tls_verify)
+        try:
+            code, _, stderr = self.bash.run(
+                self._sync_cmd(spec, dest_repo, dest_transport, dest_tls_verify), result=True,
+                timeout=self._sync_timeout(tags))
+        finally:
+            os.remove(spec)
+        _observe(dest_repo, code, stderr)
+        return self._sync_result(tags, code, stderr)
+
+    async def async_sync(self, src_repo, dest_repo, name, tags: List[str], dest_transport='docker',
+                         src_tls_verify='false', dest_tls_verify='false') -> Dict[str, bool]:
+        """ coroutine of sync() with tags, for asyncio engine """
+        spec = self._write_sync_spec(src_repo, name, tags, src_tls_verify)
+        try:
+            code, _, stderr = await self.bash.async_run(
+                self._sync_cmd(spec, dest_repo, dest_transport, dest_tls_verify), result=True,
+                timeout=self._sync_timeout(tags))
+        finally:
+            os.remove(spec)
+        _observe(dest_repo, code, stderr)
+        return self._sync_result(tags, code, stderr)
+
+    @staticmethod
+    def _write_sync_spec(src_repo, name, tags, src_tls_verify) -> str:
+        """ write skopeo sync yaml spec of one image, return the file path
+
+        yaml is a superset of json, so the spec is dumped as json:
+        {"gcr.io": {"images": {"ml-pipeline/api-server": ["2.0.0", "2.0.1"]}, "tls-verify": false}}
+        """
+        registry, _, project = src_repo.partition('/')
+        image = f'{project}/{name}' if project else name
+        spec = {
+            registry: {
+                'images': {image: list(tags)},
+                'tls-verify': str(src_tls_verify).lower() == 'true',
+            }
+        }
+        fd, path = tempfile.mkstemp(prefix='cisctl-sync-', suffix='.yaml')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(spec, f)
+        return path
+
+    @staticmethod
+    def _sync_timeout(tags) -> float:
+        """ a batch copies its tags one by one, each gets COMMAND_TIMEOUT of a skopeo copy, 0 is no timeout """
+        return config.COMMAND_TIMEOUT * len(tags)
+
+    @staticmethod
+    def _sync_cmd(spec, dest_repo, dest_transport, dest_tls_verify) -> List[str]:
+        # without --scoped, skopeo pushes gcr.io/ml-pipeline/api-server:tag to {dest_repo}/api-server:tag
+        return ['skopeo', 'sync', '--insecure-policy', f'--dest-tls-verify={dest_tls_verify}', '--keep-going',
+                '--src', 'yaml', '--dest', dest_transport, spec, dest_repo]
+
+    @staticmethod
+    def _sync_result(tags, code, stderr) -> Dict[str, bool]:
+        """ per tag result of skopeo sync --keep-going, failed refs are logged one by one """
+        metrics.inc('skopeo_runs_total', command='sync', code=code)
+        if code == 0:
+            return {tag: True for tag in tags}
+        failed = set(m.group('tag') for m in _sync_error_re.finditer(stderr or ''))
+        if not failed & set(tags):
+            # skopeo failed before copying, e.g. auth or spec error
+            return {tag: False for tag in tags}
+        return {tag: tag not in failed for tag in tags}
 
     def list_tags(self, transport, repo, name) -> {}:
         """ List tags in the transport/repository specified by the REPOSITORY-NAME
@@ -74,18 +191,14 @@ class Skopeo(object):
         :param repo: k8s.gcr.io or quay.io/metallb
         :param name: pause-amd64
 
-        skopeo list-tags docker://k8s.gcr.io/pause-amd64 | jq -c
-        :return: {"Repository":"k8s.gcr.io/pause-amd64","Tags":["0.0.16"]}
+        skopeo list-tags docker://k8s.gcr.io/pause-amd64
+        :return: {"Repository":"k8s.gcr.io/pause-amd64","Tags":["0.0.16"]}, empty if failed
         """
-        cmd = f'skopeo list-tags {transport}://{repo}/{name} | jq -c'
-        code, stdout, stderr = self.bash.run(cmd, result=True)
-        if code == 0 and stdout is not None:
-            try:
-                result = json.loads(stdout)
-            except json.decoder.JSONDecodeError:
-                result = {}
-        else:
-            result = {}
+        cmd = ['skopeo', 'list-tags', f'{transport}://{repo}/{name}']
+        code, result, _ = self.bash.run_json(cmd, timeout=config.LIST_COMMAND_TIMEOUT)
+        metrics.inc('skopeo_runs_total', command='list-tags', code=code)
+        if not isinstance(result, dict):
+            return {}
 
         return result
 
@@ -0,0 +1,79 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""hermetic sync benchmark.
+
+  python -m cisctl.tests.benchmark --images 10,1000,10000
+  python -m cisctl.tests.benchmark --images 1000 --engine asyncio --latency-ms 20 --throttle-every 50
+"""
+
+import argparse
+import json
+import logging
+
+from cisctl.logger import logger
+from cisctl.tests.benchmark import harness
+from cisctl.v1 import sync
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m cisctl.tests.benchmark', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', default='10,1000,10000', help='comma separated image counts, one run each')
+    parser.add_argument('--tags', type=int, default=10, help='version tags per image, plus `latest`')
+    parser.add_argument('--pending', type=float, default=0.1, help='ratio of images with a new tag to copy')
+    parser.add_argument('--engine', default=sync.ENGINE_PROCESS, choices=[sync.ENGINE_PROCESS, sync.ENGINE_ASYNCIO])
+    parser.add_argument('--copy-engine', default=sync.COPY_ENGINE_SKOPEO,
+                        choices=[sync.COPY_ENGINE_SKOPEO, sync.COPY_ENGINE_NATIVE])
+    parser.add_argument('--workers', type=int, default=8, help='pool size of process engine')
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--copy-concurrency', type=int, default=8)
+    parser.add_argument('--latency-ms', type=float, default=0, help='latency of every fake registry request')
+    parser.add_argument('--throttle-every', type=int, default=0,
+                        help='answer the first attempt of every nth request with 429')
+    parser.add_argument('--k8s-io-every', type=int, default=0, help='every nth image is a registry.k8s.io image')
+    parser.add_argument('--no-sync-batch', action='store_true', help='one skopeo copy per tag')
+    parser.add_argument('--no-verify-digest', action='store_true')
+    parser.add_argument('--adaptive', action='store_true', help='AIMD limits per registry host, ref cisctl.adaptive')
+    parser.add_argument('--json', dest='json_path', default='', help='also write results to this file')
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+
+    logger.setLevel(getattr(logging, args.log_level.upper()))
+    for handler in logger.handlers:
+        handler.setLevel(logger.level)
+
+    results = []
+    print(f'{"images":>8} {"seconds":>9} {"images/s":>9} {"requests":>9} {"req/image":>9} {"429":>6} {"pushed":>7}')
+    for images in [int(i) for i in args.images.split(',') if i]:
+        result = harness.run(
+            images=images, tags=args.tags, pending=args.pending, engine=args.engine, copy_engine=args.copy_engine,
+            workers=args.workers, concurrency=args.concurrency, copy_concurrency=args.copy_concurrency,
+            latency=args.latency_ms / 1000, throttle_every=args.throttle_every, k8s_io_every=args.k8s_io_every,
+            sync_batch=not args.no_sync_batch, verify_digest=not args.no_verify_digest,
+            adaptive_concurrency=args.adaptive)
+        requests = sum(c for k, c in result['registry_requests'].items() if not k.startswith('throttled'))
+        throttled = sum(c for k, c in result['registry_requests'].items() if k.startswith('throttled'))
+        print(f'{images:>8} {result["seconds"]:>9} {result["images_per_second"]:>9} {requests:>9} '
+              f'{result["registry_requests_per_image"]:>9} {throttled:>6} {result["dest_tags_pushed"]:>7}')
+        results.append(result)
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""drive CIS.do_sync end to end against local stand-in registries.
+
+One FakeRegistry serves the source gcr.io style listing, the Docker Hub tags
+api and the distribution api of both sides. bin/skopeo and bin/gcrane are put
+first on PATH, so no request leaves localhost.
+"""
+
+import json
+import os
+import tempfile
+import time
+from typing import Dict
+from urllib.parse import urlparse
+
+from cisctl import auth
+from cisctl import metrics
+from cisctl import registry
+from cisctl.api.docker import DockerV2
+from cisctl.tests.fake_registry import FakeRegistry
+from cisctl.v1 import sync
+
+BIN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bin')
+DEST_REPO = 'docker.io/gcmirrors'
+DAY_MS = 24 * 3600 * 1000
+
+
+def populate(fake: FakeRegistry, images: int, tags: int, pending: float, k8s_io_every: int = 0):
+    """ add synthetic images, return image list
+
+    every image has `tags` version tags and `latest`, dest already has all of them, except the
+    newest version tag of `pending` ratio of images
+
+    :param k8s_io_every: every nth image is a registry.k8s.io image, 0 is none
+    """
+    now = int(time.time() * 1000)
+    pending_every = round(1 / pending) if pending else 0
+    image_list = []
+    for i in range(images):
+        name = f'image-{i}'
+        k8s_io = k8s_io_every and i % k8s_io_every == 0
+        image_list.append(f'registry.k8s.io/{name}' if k8s_io else f'k8s.gcr.io/{name}')
+        dest = f'gcmirrors/{name}'
+        versions = [f'v0.{t}' for t in range(tags)]
+        for t, tag in enumerate(versions + ['latest']):
+            uploaded = now - 30 * DAY_MS + t * 60 * 1000
+            fake.add_image(name, tag, [], uploaded=uploaded)
+            if pending_every and i % pending_every == 0 and tag == versions[-1]:
+                continue
+            fake.copy_tag(name, dest, tag, uploaded=uploaded + 1000)
+    return image_list
+
+
+def run(images: int = 10, tags: int = 10, pending: float = 0.1, engine: str = sync.ENGINE_PROCESS,
+        copy_engine: str = sync.COPY_ENGINE_SKOPEO, workers: int = 8, concurrency: int = 64,
+        copy_concurrency: int = 8, latency: float = 0, throttle_every: int = 0, k8s_io_every: int = 0,
+        sync_batch: bool = True, verify_digest: bool = True, adaptive_concurrency: bool = False) -> Dict:
+    """ sync `images` synthetic images, return throughput and api call counts
+
+    :param latency: seconds every fake registry request waits
+    :param throttle_every: first attempt of every nth request is answered with 429, ref FakeRegistry
+    """
+    fake = FakeRegistry(latency=latency, throttle_every=throttle_every)
+    url = fake.start()
+    saved_path, saved_endpoints = os.environ.get('PATH', ''), os.environ.get('CISCTL_FAKE_ENDPOINTS')
+    saved_urls, saved_registries = dict(sync.SOURCE_REGISTRY_URLS), dict(registry.ENDPOINTS)
+    saved_token_cache = auth._token_cache
+    # no token of the stand-in registries is kept in TOKEN_CACHE_PATH
+    auth.set_token_cache(None)
+    try:
+        image_list = populate(fake, images, tags, pending, k8s_io_every)
+        with tempfile.TemporaryDirectory() as tmp:
+            list_path = os.path.join(tmp, 'images.txt')
+            with open(list_path, 'w') as f:
+                f.write('\n'.join(image_list) + '\n')
+
+            # the fake host itself is mapped for gcrane fallback of registry.k8s.io listing
+            endpoints = {'k8s.gcr.io': url, 'registry.k8s.io': url, 'docker.io': url, urlparse(url).netloc: url}
+            os.environ['PATH'] = f'{BIN_PATH}{os.pathsep}{saved_path}'
+            os.environ['CISCTL_FAKE_ENDPOINTS'] = json.dumps(endpoints)
+            sync.SOURCE_REGISTRY_URLS['k8s.gcr.io'] = url
+            sync.SOURCE_REGISTRY_URLS['registry.k8s.io'] = url
+            registry.ENDPOINTS.update(endpoints)
+
+            cis = sync.CIS(src_transport='docker', dest_transport='docker', copy_engine=copy_engine,
+                           sync_batch=sync_batch, verify_digest=verify_digest)
+            cis._docker = DockerV2(registry_url=url)
+            before = dict(fake.uploaded)
+            metrics.reset()
+            start = time.monotonic()
+            results, _, _ = cis.do_sync(
+                src_image_list_url=list_path, thread_pool_size=workers, dest_repo=DEST_REPO, debug=False,
+                docker_api_rate_limit=0, docker_push_rate_limit=0, engine=engine, concurrency=concurrency,
+                copy_concurrency=copy_concurrency, metrics_textfile='', metrics_json='',
+                adaptive_concurrency=adaptive_concurrency)
+            seconds = time.monotonic() - start
+    finally:
+        fake.stop()
+        os.environ['PATH'] = saved_path
+        if saved_endpoints is None:
+            os.environ.pop('CISCTL_FAKE_ENDPOINTS', None)
+        else:
+            os.environ['CISCTL_FAKE_ENDPOINTS'] = saved_endpoints
+        sync.SOURCE_REGISTRY_URLS.clear()
+        sync.SOURCE_REGISTRY_URLS.update(saved_urls)
+        registry.ENDPOINTS.clear()
+        registry.ENDPOINTS.update(saved_registries)
+        auth._token_cache = saved_token_cache
+
+    data = metrics.snapshot()
+    counters = dict()
+    for name, labels, value in data['counters']:
+        if name in ('skopeo_runs_total', 'tags_total'):
+            key = f'{name}{{{",".join(f"{k}={v}" for k, v in sorted(labels.items()))}}}'
+            counters[key] = counters.get(key, 0) + value
+    pending_images = len([i for i in range(images) if pending and i % round(1 / pending) == 0])
+    return {
+        'images': images,
+        'synced_images': len(results),
+        'pending_tags': pending_images,
+        'engine': engine,
+        'copy_engine': copy_engine,
+        'seconds': round(seconds, 3),
+        'images_per_second': round(images / seconds, 2) if seconds else None,
+        'registry_requests': {f'{method} {kind}': count for (method, kind), count in sorted(fake.requests.items())},
+        'registry_requests_per_image': round(
+            sum(c for (m, _), c in fake.requests.items() if m != 'throttled') / images, 2) if images else None,
+        'counters': counters,
+        'dest_tags_pushed': len([k for k, v in fake.uploaded.items() if before.get(k) != v]),
+    }
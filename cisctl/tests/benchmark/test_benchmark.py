@@ -0,0 +1,36 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""smoke test of benchmark harness, a small end to end sync against local registries."""
+
+import unittest
+
+from cisctl.tests.benchmark import harness
+from cisctl.v1 import sync
+
+
+class BenchmarkTestCase(unittest.TestCase):
+
+    def test_process_skopeo(self):
+        result = harness.run(images=10, tags=3, pending=0.5, workers=2, k8s_io_every=4)
+        self.assertEqual(result['synced_images'], 10)
+        self.assertEqual(result['dest_tags_pushed'], 5)
+        self.assertEqual(result['registry_requests']['GET hub_tags'], 10)
+        self.assertEqual(result['counters']['tags_total{result=copied}'], 5)
+
+    def test_asyncio_native_throttled(self):
+        result = harness.run(images=10, tags=3, pending=0.5, engine=sync.ENGINE_ASYNCIO,
+                             copy_engine=sync.COPY_ENGINE_NATIVE, throttle_every=5)
+        self.assertEqual(result['synced_images'], 10)
+        self.assertEqual(result['dest_tags_pushed'], 5)
+        self.assertGreater(sum(c for k, c in result['registry_requests'].items() if k.startswith('throttled')), 0)
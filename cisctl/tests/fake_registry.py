@@ -0,0 +1,350 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""in-memory OCI distribution registry on localhost, for hermetic tests and benchmarks.
+
+Besides the distribution api, it answers tags/list with the gcr.io `manifest`
+extension and the Docker Hub tags api, so listing, diffing and copying can all
+run against it.
+"""
+
+import collections
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+from datetime import datetime
+from datetime import timezone
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+MEDIA_TYPE_MANIFEST = 'application/vnd.docker.distribution.manifest.v2+json'
+MEDIA_TYPE_MANIFEST_LIST = 'application/vnd.docker.distribution.manifest.list.v2+json'
+MEDIA_TYPE_CONFIG = 'application/vnd.docker.container.image.v1+json'
+MEDIA_TYPE_LAYER = 'application/vnd.docker.image.rootfs.diff.tar.gzip'
+
+_path_re = re.compile(r'^/v2/(?P<repo>.+)/(?P<kind>manifests|blobs/uploads|blobs|tags)/(?P<ref>[^/]*)$')
+_upload_re = re.compile(r'/blobs/uploads/[^/]+$')
+# Docker Hub api, https://hub.docker.com/v2/repositories/gcmirrors/pause/tags?page_size=100
+_hub_tags_re = re.compile(r'^/v2/repositories/(?P<repo>.+)/tags/?$')
+
+
+def digest(body: bytes) -> str:
+    return f'sha256:{hashlib.sha256(body).hexdigest()}'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, without TCP_NODELAY keep-alive requests stall on delayed ack
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):  # noqa
+        pass
+
+    @property
+    def registry(self) -> 'FakeRegistry':
+        return self.server.registry
+
+    def _send(self, code, body=b'', headers=None):
+        self.send_response(code)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD' and body:
+            self.wfile.write(body)
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _dispatch(self):
+        url = urlparse(self.path)
+        if self.registry.latency:
+            time.sleep(self.registry.latency)
+        hub_match = _hub_tags_re.match(url.path)
+        kind = 'hub_tags' if hub_match else url.path.split('/')[-2] if url.path.count('/') > 2 else url.path
+        if url.path == '/token':
+            kind = 'token'
+        with self.registry.lock:
+            self.registry.requests[(self.command, kind)] += 1
+            throttled = self._throttle(url)
+            faults = self.registry.faults.get((self.command, kind))
+            fault = faults.pop(0) if faults else None
+        if throttled:
+            # drain the body, or it is read as the next request on this keep-alive connection
+            self._read_body()
+            with self.registry.lock:
+                self.registry.requests[('throttled', kind)] += 1
+            return self._send(429, b'{"errors":[{"code":"TOOMANYREQUESTS"}]}', {'Retry-After': '0'})
+        if fault:
+            self._read_body()
+            with self.registry.lock:
+                self.registry.requests[('failed', kind)] += 1
+            status, headers = fault if isinstance(fault, tuple) else (fault, None)
+            return self._send(status, b'{"errors":[{"code":"UNAVAILABLE"}]}', headers)
+        if self.registry.redirect and url.path.startswith('/v2/') and url.path != '/v2/':
+            location = f'{self.registry.redirect}{url.path[len("/v2"):]}' + (f'?{url.query}' if url.query else '')
+            return self._send(307, headers={'Location': location})
+        if url.path == '/token':
+            return self._get_token(parse_qs(url.query))
+        if self.registry.token_expires_in is not None and url.path.startswith('/v2/') and not self._authorized():
+            self._read_body()
+            with self.registry.lock:
+                self.registry.requests[('unauthorized', kind)] += 1
+            match = _path_re.match(url.path)
+            scope = f',scope="repository:{match.group("repo")}:pull"' if match else ''
+            return self._send(401, b'{"errors":[{"code":"UNAUTHORIZED"}]}', {
+                'WWW-Authenticate': f'Bearer realm="http://{self.headers["Host"]}/token",service="fake"{scope}'})
+        if hub_match:
+            with self.registry.lock:
+                return self._get_hub_tags(hub_match.group('repo'), parse_qs(url.query))
+
+        match = _path_re.match(url.path)
+        if match is None:
+            return self._send(404)
+        handler = getattr(self, f'_{self.command.lower()}_{match.group("kind").replace("/", "_")}', None)
+        if handler is None:
+            return self._send(405)
+        with self.registry.lock:
+            return handler(match.group('repo'), match.group('ref'), parse_qs(url.query))
+
+    do_GET = do_HEAD = do_PUT = do_POST = do_DELETE = _dispatch
+
+    def _throttle(self, url) -> bool:
+        """ whether to answer with 429, called with registry lock held
+
+        only the first attempt of every nth request is throttled, so a client retrying once always
+        gets through, however concurrent requests interleave. POST opens an upload session and is
+        not retried by clients, it is never throttled
+        """
+        if not self.registry.throttle_every or self.command == 'POST':
+            return False
+        # an upload is retried at a new location of the same blob
+        path = _upload_re.sub('/blobs/uploads/', url.path)
+        key = (self.command, path, tuple(parse_qs(url.query).get('digest', [])))
+        if key in self.registry.attempted:
+            return False
+        self.registry.attempted.add(key)
+        return len(self.registry.attempted) % self.registry.throttle_every == 0
+
+    def _authorized(self) -> bool:
+        scheme, _, token = (self.headers.get('Authorization') or '').partition(' ')
+        with self.registry.lock:
+            return scheme == 'Bearer' and self.registry.issued.get(token, 0) > time.time()
+
+    def _get_token(self, query):
+        """ token endpoint, ref https://distribution.github.io/distribution/spec/auth/token/ """
+        token = uuid.uuid4().hex
+        with self.registry.lock:
+            self.registry.issued[token] = time.time() + (self.registry.token_expires_in or 60)
+        body = {'token': token, 'expires_in': self.registry.token_expires_in, 'scope': query.get('scope', [])}
+        self._send(200, json.dumps(body).encode(), {'Content-Type': 'application/json'})
+
+    def _get_manifests(self, repo, ref, query):
+        manifests = self.registry.repos[repo]['manifests']
+        if ref not in manifests:
+            return self._send(404)
+        media_type, body = manifests[ref]
+        self._send(200, body, {'Content-Type': media_type, 'Docker-Content-Digest': digest(body)})
+
+    _head_manifests = _get_manifests
+
+    def _put_manifests(self, repo, ref, query):
+        body = self._read_body()
+        manifests = self.registry.repos[repo]['manifests']
+        manifests[ref] = manifests[digest(body)] = (self.headers.get('Content-Type'), body)
+        self.registry.uploaded[(repo, ref)] = int(time.time() * 1000)
+        self._send(201, headers={'Docker-Content-Digest': digest(body)})
+
+    def _get_blobs(self, repo, ref, query):
+        if ref not in self.registry.repos[repo]['blobs']:
+            return self._send(404)
+        self._send(200, self.registry.blobs[ref], {'Docker-Content-Digest': ref})
+
+    _head_blobs = _get_blobs
+
+    def _post_blobs_uploads(self, repo, ref, query):
+        mount, from_repo = query.get('mount', [None])[0], query.get('from', [None])[0]
+        if mount and from_repo and mount in self.registry.repos[from_repo]['blobs']:
+            self.registry.repos[repo]['blobs'].add(mount)
+            return self._send(201, headers={'Docker-Content-Digest': mount})
+        upload = uuid.uuid4().hex
+        self._send(202, headers={'Location': f'/v2/{repo}/blobs/uploads/{upload}'})
+
+    def _put_blobs_uploads(self, repo, ref, query):
+        body = self._read_body()
+        expected = query.get('digest', [None])[0]
+        if digest(body) != expected:
+            return self._send(400, b'{"errors":[{"code":"DIGEST_INVALID"}]}')
+        self.registry.blobs[expected] = body
+        self.registry.repos[repo]['blobs'].add(expected)
+        self._send(201, headers={'Docker-Content-Digest': expected})
+
+    def _delete_blobs_uploads(self, repo, ref, query):
+        self._send(204)
+
+    def _get_tags(self, repo, ref, query):
+        if repo not in self.registry.repos:
+            return self._send(404)
+        tags = self.registry.tags(repo)
+        if 'n' in query:
+            # distribution spec pagination, `?n=<page size>&last=<last tag of previous page>`
+            last = query.get('last', [''])[0]
+            page = [t for t in tags if t > last][:int(query['n'][0])]
+            headers = {'Content-Type': 'application/json'}
+            if page and page[-1] != tags[-1]:
+                headers['Link'] = f'</v2/{repo}/tags/list?n={query["n"][0]}&last={page[-1]}>; rel="next"'
+            return self._send(200, json.dumps({'name': repo, 'tags': page}).encode(), headers)
+        # gcr.io extension, ref cisctl.api.gcr.GoogleContainerRegisterV2.list_tags()
+        manifest = dict()
+        for tag in tags:
+            media_type, body = self.registry.repos[repo]['manifests'][tag]
+            item = manifest.setdefault(digest(body), {
+                'imageSizeBytes': str(len(body)), 'mediaType': media_type, 'tag': [], 'timeCreatedMs': '0',
+                'timeUploadedMs': str(self.registry.uploaded.get((repo, tag), 0))})
+            item['tag'].append(tag)
+        self._send(200, json.dumps({'name': repo, 'tags': tags, 'manifest': manifest, 'child': []}).encode(),
+                   {'Content-Type': 'application/json'})
+
+    def _get_hub_tags(self, repo, query):
+        if repo not in self.registry.repos:
+            return self._send(404, b'{"message":"object not found"}', {'Content-Type': 'application/json'})
+        page_size = int(query.get('page_size', ['10'])[0])
+        page = int(query.get('page', ['1'])[0])
+        tags = sorted(self.registry.tags(repo), key=lambda t: -self.registry.uploaded.get((repo, t), 0))
+        results = []
+        for tag in tags[(page - 1) * page_size:page * page_size]:
+            _, body = self.registry.repos[repo]['manifests'][tag]
+            # naive local time, as cisctl.utils.date2timestamp() parses it
+            pushed = datetime.fromtimestamp(self.registry.uploaded.get((repo, tag), 0) / 1000)
+            pushed = pushed.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+            results.append({'name': tag, 'digest': digest(body), 'last_updated': pushed, 'tag_last_pushed': pushed})
+        next_url = None
+        if page * page_size < len(tags):
+            next_url = f'http://{self.headers.get("Host")}/v2/repositories/{repo}/tags' \
+                       f'?page_size={page_size}&ordering=last_updated&page={page + 1}'
+        self._send(200, json.dumps({'count': len(tags), 'next': next_url, 'results': results}).encode(),
+                   {'Content-Type': 'application/json'})
+
+
+class FakeRegistry(object):
+    """ registry keeping repositories, manifests and blobs in memory
+
+    requests counts (method, last path kind) pairs, e.g. ('PUT', 'uploads'), ('HEAD', 'blobs'),
+    ('GET', 'hub_tags') is the Docker Hub tags api, ('GET', 'token') is the token endpoint,
+    ('throttled', kind) are answered with 429, ('unauthorized', kind) with 401, ('failed', kind) with a fault
+    """
+
+    def __init__(self, latency: float = 0, throttle_every: int = 0, redirect: str = None,
+                 token_expires_in: int = None):
+        """
+        :param latency: seconds every request waits before it is answered
+        :param throttle_every: answer the first attempt of every nth request, except POST, with 429 and
+            `Retry-After: 0`, 0 is never
+        :param redirect: answer /v2/<path> with 307 to <redirect>/<path> like registry.k8s.io, None is never
+        :param token_expires_in: /v2/ requests need a bearer token of /token living this many seconds,
+            None is no auth
+        """
+        self.repos = collections.defaultdict(lambda: {'manifests': {}, 'blobs': set()})
+        self.blobs = dict()
+        # {(repo, tag): millisecond timestamp}
+        self.uploaded = dict()
+        self.requests = collections.Counter()
+        self.lock = threading.Lock()
+        self.latency = latency
+        self.throttle_every = throttle_every
+        # (method, path, digest) of requests seen, a retry of one is never throttled
+        self.attempted = set()
+        self.redirect = redirect
+        self.token_expires_in = token_expires_in
+        # {(method, kind): [status or (status, headers), ...]}, the next requests of method and kind are answered
+        # with these statuses
+        self.faults = collections.defaultdict(list)
+        # {token: expires unix time}
+        self.issued = dict()
+        self._server = None
+
+    def tags(self, repo: str):
+        return sorted(t for t in self.repos[repo]['manifests'] if not t.startswith('sha256:'))
+
+    def start(self) -> str:
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.registry = self
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f'http://127.0.0.1:{self._server.server_port}'
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def add_blob(self, repo: str, body: bytes) -> dict:
+        self.blobs[digest(body)] = body
+        self.repos[repo]['blobs'].add(digest(body))
+        return {'mediaType': MEDIA_TYPE_LAYER, 'size': len(body), 'digest': digest(body)}
+
+    def add_image(self, repo: str, tag: str, layers, platforms=None, uploaded: int = None) -> str:
+        """ add image, return manifest digest
+
+        :param layers: list of layer bytes
+        :param platforms: list of (os, architecture), build a manifest list when set
+        :param uploaded: millisecond timestamp of tag, default now. it is also the `created` time of image
+            config, which is left out without uploaded, so images of the same tag and layers share one config
+        """
+        self.uploaded[(repo, tag)] = uploaded or int(time.time() * 1000)
+        image_config = {'tag': tag}
+        if uploaded:
+            image_config['created'] = datetime.fromtimestamp(uploaded / 1000, timezone.utc).strftime(
+                '%Y-%m-%dT%H:%M:%S.%fZ')
+
+        def _manifest(config):
+            config_descriptor = self.add_blob(repo, config)
+            config_descriptor['mediaType'] = MEDIA_TYPE_CONFIG
+            body = json.dumps({
+                'schemaVersion': 2,
+                'mediaType': MEDIA_TYPE_MANIFEST,
+                'config': config_descriptor,
+                'layers': [self.add_blob(repo, layer) for layer in layers],
+            }).encode()
+            self.repos[repo]['manifests'][digest(body)] = (MEDIA_TYPE_MANIFEST, body)
+            return body
+
+        if not platforms:
+            body = _manifest(json.dumps(image_config).encode())
+            self.repos[repo]['manifests'][tag] = (MEDIA_TYPE_MANIFEST, body)
+            return digest(body)
+
+        descriptors = []
+        for _os, architecture in platforms:
+            body = _manifest(json.dumps(dict(image_config, os=_os, architecture=architecture)).encode())
+            descriptors.append({
+                'mediaType': MEDIA_TYPE_MANIFEST, 'size': len(body), 'digest': digest(body),
+                'platform': {'os': _os, 'architecture': architecture}})
+        body = json.dumps({
+            'schemaVersion': 2, 'mediaType': MEDIA_TYPE_MANIFEST_LIST, 'manifests': descriptors}).encode()
+        self.repos[repo]['manifests'][tag] = self.repos[repo]['manifests'][digest(body)] = \
+            (MEDIA_TYPE_MANIFEST_LIST, body)
+        return digest(body)
+
+    def copy_tag(self, src_repo: str, dest_repo: str, tag: str, uploaded: int = None):
+        """ make dest_repo:tag the same manifest as src_repo:tag, like a copy pushed at `uploaded` """
+        media_type, body = self.repos[src_repo]['manifests'][tag]
+        self.repos[dest_repo]['manifests'][tag] = self.repos[dest_repo]['manifests'][digest(body)] = (media_type, body)
+        self.repos[dest_repo]['blobs'].update(self.repos[src_repo]['blobs'])
+        self.uploaded[(dest_repo, tag)] = uploaded or int(time.time() * 1000)
@@ -10,3 +10,8 @@
 #   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 #   License for the specific language governing permissions and limitations
 #   under the License.
+
+from cisctl import auth
+
+# tokens are never written to TOKEN_CACHE_PATH of the user running tests, test_auth sets a cache of its own
+auth.set_token_cache(None)
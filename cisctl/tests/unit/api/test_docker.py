@@ -14,6 +14,7 @@
 """test python skopeo utils."""
 
 import unittest
+from unittest import mock
 
 from cisctl.api.docker import DockerV2
 
@@ -36,3 +37,30 @@ class DockerV2TestCase(unittest.TestCase):
 
         name = 'gcmirrors/no-exist'
         print(self.docker.last_tag(name))
+
+    def test_list_tags_pagination(self):
+        def _tag(name, pushed):
+            return {'name': name, 'last_updated': pushed, 'tag_last_pushed': pushed, 'digest': f'sha256:{name}'}
+
+        base = 'https://registry.hub.docker.com/v2/repositories/gcmirrors/pause/tags'
+        pages = {
+            f'{base}?page_size=100&ordering=last_updated': {
+                'count': 3, 'next': f'{base}?page=2', 'results': [_tag('3.9', '2023-01-02T00:00:00Z')]},
+            f'{base}?page=2': {
+                'count': 3, 'next': f'{base}?page=3', 'results': [_tag('3.8', '2022-01-02T00:00:00Z')]},
+            f'{base}?page=3': {
+                'count': 3, 'next': None, 'results': [_tag('3.7', '2021-01-02T00:00:00Z')]},
+        }
+        with mock.patch('cisctl.api.docker.client.http_get', side_effect=lambda url: (True, pages[url])) as m:
+            result, tags, digests = self.docker.sort_tags('gcmirrors/pause')
+            self.assertTrue(result)
+            self.assertEqual([t for t, _ in tags], ['3.9', '3.8', '3.7'])
+            self.assertEqual(digests['3.7'], 'sha256:3.7')
+            self.assertEqual(m.call_count, 3)
+
+        # stop after the page which reaches tags pushed before since
+        since = 1640995200000  # 2022-01-01
+        with mock.patch('cisctl.api.docker.client.http_get', side_effect=lambda url: (True, pages[url])) as m:
+            _, tags, _ = self.docker.sort_tags('gcmirrors/pause', since=since + 86400000 * 2)
+            self.assertEqual([t for t, _ in tags], ['3.9', '3.8'])
+            self.assertEqual(m.call_count, 2)
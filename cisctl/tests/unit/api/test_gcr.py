@@ -14,6 +14,7 @@
 """test python skopeo utils."""
 
 import unittest
+from unittest import mock
 
 from cisctl.api.gcr import GoogleContainerRegisterV2
 
@@ -30,3 +31,15 @@ class GoogleContainerRegisterV2TestCase(unittest.TestCase):
     def test_sort_tags(self):
         name = 'kube-apiserver'
         print(self.gcr.sort_tags(name))
+
+    def test_tag_sizes(self):
+        manifest = {
+            'sha256:a': {'imageSizeBytes': '1024', 'tag': ['v1', 'stable'], 'timeUploadedMs': '1'},
+            'sha256:b': {'imageSizeBytes': '0', 'tag': ['v2'], 'timeUploadedMs': '2'},
+        }
+        with mock.patch.object(self.gcr, 'list_tags', return_value=(True, {'manifest': manifest})):
+            result, sort_tags, _ = self.gcr.sort_tags('pause')
+        self.assertTrue(result)
+        # manifest list has no size
+        self.assertEqual(self.gcr.pop_tag_sizes('pause'), {'v1': 1024, 'stable': 1024})
+        self.assertEqual(self.gcr.pop_tag_sizes('pause'), {})
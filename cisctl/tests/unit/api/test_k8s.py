@@ -14,8 +14,10 @@
 """test python K8sRegister."""
 
 import unittest
+from unittest import mock
 
 from cisctl.api.k8s import K8sRegister
+from cisctl.tests.fake_registry import FakeRegistry
 
 
 class K8sRegisterTestCase(unittest.TestCase):
@@ -30,3 +32,42 @@ class K8sRegisterTestCase(unittest.TestCase):
     def test_sort_tags(self):
         name = 'addon-builder'
         print(self.k8s.sort_tags(name))
+
+
+class K8sRegisterRedirectTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = FakeRegistry()
+        backend_url = self.backend.start()
+        self.front = FakeRegistry(redirect=f'{backend_url}/v2/k8s-artifacts-prod/images')
+        self.front_url = self.front.start()
+        K8sRegister._backends.pop(self.front_url, None)
+        self.k8s = K8sRegister(registry_url=self.front_url)
+
+    def tearDown(self):
+        self.front.stop()
+        self.backend.stop()
+        K8sRegister._backends.pop(self.front_url, None)
+
+    def test_sort_tags(self):
+        self.backend.add_image('k8s-artifacts-prod/images/pause', '3.8', [b'pause'], uploaded=1000)
+        self.backend.add_image('k8s-artifacts-prod/images/pause', '3.9', [b'pause-3.9'], uploaded=2000)
+        self.backend.add_image('k8s-artifacts-prod/images/etcd', '3.5.9', [b'etcd'], uploaded=3000)
+
+        result, tags, digests = self.k8s.sort_tags('pause')
+        self.assertTrue(result)
+        self.assertEqual([tag for tag, _ in tags], ['3.9', '3.8'])
+        self.assertEqual(set(digests), {'3.8', '3.9'})
+        self.assertEqual(set(self.k8s.pop_tag_sizes('pause')), {'3.8', '3.9'})
+        self.assertTrue(self.k8s.sort_tags('etcd')[0])
+
+        # redirect is resolved by the first listing only
+        self.assertEqual(self.front.requests[('GET', 'tags')], 1)
+        self.assertEqual(self.backend.requests[('GET', 'tags')], 2)
+
+    def test_gcrane_fallback(self):
+        resp = {'name': 'k8s-artifacts-prod/images/pause', 'tags': ['3.9'], 'manifest': {
+            'sha256:1': {'imageSizeBytes': '0', 'tag': ['3.9'], 'timeUploadedMs': '2000'}}}
+        with mock.patch.object(self.k8s.bash, 'run_json', return_value=(0, resp, '')) as run_json:
+            self.assertEqual(self.k8s.sort_tags('pause'), (True, [('3.9', '2000')], {'3.9': 'sha256:1'}))
+        self.assertEqual(run_json.call_args[0][0][:3], ['gcrane', 'ls', '--json'])
@@ -0,0 +1,82 @@
+# Copyright 2022 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""test OCI distribution register api."""
+
+import unittest
+
+from cisctl import registry
+from cisctl.api import oci
+from cisctl.api.oci import OCIRegisterV2
+from cisctl.tests.fake_registry import FakeRegistry
+
+
+class OCIRegisterV2TestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = FakeRegistry()
+        registry.ENDPOINTS['oci.test'] = self.registry.start()
+        self.oci = OCIRegisterV2('oci.test')
+
+    def tearDown(self):
+        self.registry.stop()
+        registry.ENDPOINTS.pop('oci.test')
+
+    def test_list_tags(self):
+        for i in range(5):
+            self.registry.add_image('gcmirrors/pause', f'3.{i}', [b'pause'])
+        # pages follow the Link header
+        self.assertEqual(self.oci.list_tags('oci.test/gcmirrors/pause', page_size=2),
+                         (True, ['3.0', '3.1', '3.2', '3.3', '3.4']))
+        self.assertEqual(self.registry.requests[('GET', 'tags')], 3)
+        self.assertEqual(self.oci.list_tags('gcmirrors/no-exist'), (True, []))
+
+    def test_sort_tags(self):
+        self.registry.add_image('gcmirrors/pause', '3.8', [b'pause'])
+        self.registry.add_image('gcmirrors/pause', '3.9', [b'pause'])
+        self.assertEqual(self.oci.sort_tags('gcmirrors/pause'), (True, [('3.9', 0), ('3.8', 0)], {}))
+        self.assertEqual(self.oci.last_tag('gcmirrors/pause'), ('3.9', 0))
+
+    def test_sort_tags_digests(self):
+        digests = {f'v1.{i}': self.registry.add_image('fluxcd/source-controller', f'v1.{i}', [f'{i}'.encode()])
+                   for i in range(5)}
+        self.registry.add_image('fluxcd/source-controller', 'sha256-abc.sig', [b'sig'])
+        source = OCIRegisterV2('oci.test', project='fluxcd', digests=True, head_concurrency=3)
+        result, tags, tag_digests = source.sort_tags('source-controller')
+        self.assertTrue(result)
+        self.assertEqual(tags, [(f'v1.{i}', 0) for i in reversed(range(5))])
+        self.assertEqual(tag_digests, digests)
+        self.assertEqual(self.registry.requests[('HEAD', 'manifests')], 5)
+        self.assertEqual(self.registry.requests[('GET', 'manifests')], 0)
+
+    def test_sort_tags_timestamps(self):
+        self.registry.add_image('fluxcd/flux', 'v2.0', [b'a'], uploaded=1700000000000)
+        self.registry.add_image('fluxcd/flux', 'v2.1', [b'b'], platforms=[('linux', 'arm64'), ('linux', 'amd64')],
+                                uploaded=1710000000000)
+        self.registry.repos['fluxcd/flux']['manifests']['stable'] = \
+            self.registry.repos['fluxcd/flux']['manifests']['v2.0']
+        source = OCIRegisterV2('oci.test', project='fluxcd', timestamps=True)
+        self.assertTrue(source.has_timestamps)
+        result, tags, _ = source.sort_tags('flux')
+        self.assertTrue(result)
+        self.assertEqual(tags[0], ('v2.1', 1710000000000))
+        self.assertEqual(sorted(tags[1:]), [('stable', 1700000000000), ('v2.0', 1700000000000)])
+        # config of one digest is read once, a manifest list through its linux/amd64 manifest
+        self.assertEqual(self.registry.requests[('GET', 'blobs')], 2)
+        self.assertEqual(self.registry.requests[('GET', 'manifests')], 3)
+
+    def test_created2timestamp(self):
+        self.assertEqual(oci.created2timestamp('2023-11-14T22:13:20.123456789Z'), 1700000000000)
+        self.assertEqual(oci.created2timestamp('2023-11-15T06:13:20+08:00'), 1700000000000)
+        self.assertEqual(oci.created2timestamp('1970-01-01T00:00:00Z'), 0)
+        self.assertEqual(oci.created2timestamp(None), 0)
@@ -0,0 +1,69 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""test python QuayRegisterV2."""
+
+import os
+import time
+import unittest
+from unittest import mock
+
+from cisctl.api.quay import QuayRegisterV2
+
+
+class QuayRegisterV2TestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.quay = QuayRegisterV2(repo='metallb')
+
+    def test_sort_tags(self):
+        pages = {
+            1: {'page': 1, 'has_additional': True, 'tags': [
+                {'name': 'v0.14.0', 'manifest_digest': 'sha256:140', 'size': None, 'is_manifest_list': True,
+                 'start_ts': 1704067200, 'last_modified': 'Mon, 01 Jan 2024 00:00:00 -0000'},
+                {'name': 'sha256-140.sig', 'manifest_digest': 'sha256:sig', 'size': 500, 'start_ts': 1704067200}]},
+            2: {'page': 2, 'has_additional': False, 'tags': [
+                {'name': 'v0.13.12', 'manifest_digest': 'sha256:1312', 'size': 1024,
+                 'last_modified': 'Thu, 14 Dec 2023 21:41:52 -0000'}]},
+        }
+
+        def _http_get(url, data):
+            self.assertEqual(url, 'https://quay.io/api/v1/repository/metallb/speaker/tag/')
+            return True, pages[data['page']]
+
+        with mock.patch('cisctl.api.quay.client.http_get', side_effect=_http_get) as m:
+            result, tags, digests = self.quay.sort_tags('speaker')
+        self.assertEqual(m.call_count, 2)
+        self.assertTrue(result)
+        self.assertEqual(tags, [('v0.14.0', 1704067200000), ('v0.13.12', 1702590112000)])
+        self.assertEqual(digests, {'v0.14.0': 'sha256:140', 'v0.13.12': 'sha256:1312'})
+        self.assertEqual(self.quay.pop_tag_sizes('speaker'), {'v0.13.12': 1024})
+
+    def test_sort_tags_failed(self):
+        with mock.patch('cisctl.api.quay.client.http_get', return_value=(False, {'status': 404})):
+            self.assertEqual(self.quay.sort_tags('no-exist'), (False, [], {}))
+
+    @unittest.skipUnless(hasattr(time, 'tzset'), 'time.tzset is unix only')
+    def test_timestamp_utc(self):
+        saved = os.environ.get('TZ')
+        os.environ['TZ'] = 'Asia/Shanghai'
+        time.tzset()
+        try:
+            for last_modified in ('Thu, 14 Dec 2023 21:41:52 -0000', 'Fri, 15 Dec 2023 05:41:52 +0800'):
+                self.assertEqual(QuayRegisterV2._timestamp({'last_modified': last_modified}), 1702590112000)
+        finally:
+            if saved is None:
+                os.environ.pop('TZ')
+            else:
+                os.environ['TZ'] = saved
+            time.tzset()
@@ -0,0 +1,138 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""test adaptive concurrency limits."""
+
+import multiprocessing
+import threading
+import time
+import unittest
+
+from cisctl import adaptive
+
+
+def _hold_slot(limit, held, release):
+    limit.acquire()
+    held.set()
+    release.wait()
+    limit.release()
+
+
+class AdaptiveLimitTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.limit = adaptive.AdaptiveLimit('copy docker.io', initial=2, minimum=1, maximum=4)
+        self.limit.cooldown = 0
+
+    def test_increase_decrease(self):
+        # +1 / limit per healthy response, about one slot per round
+        for _ in range(3):
+            self.limit.success(0.1)
+        self.assertEqual(self.limit.limit, 3)
+        # slower than twice the recent responses of its kind holds the limit
+        value = self.limit._limit.value
+        self.limit.success(0.5)
+        self.assertEqual(self.limit._limit.value, value)
+        # a slow blob upload is not compared with fast HEADs
+        self.limit.success(5, 'uploads')
+        self.assertGreater(self.limit._limit.value, value)
+        for _ in range(10):
+            self.limit.success()
+        self.assertEqual(self.limit.limit, 4)
+
+        self.assertTrue(self.limit.congested())
+        self.assertEqual(self.limit.limit, 2)
+        self.limit.congested()
+        self.limit.congested()
+        self.assertEqual(self.limit.limit, 1)
+
+        # 429 of requests already in flight are one signal
+        limit = adaptive.AdaptiveLimit('list docker.io', initial=4, minimum=1, maximum=4)
+        self.assertTrue(limit.congested())
+        self.assertFalse(limit.congested())
+        self.assertEqual(limit.limit, 2)
+
+    def test_baseline_decays(self):
+        self.limit.success(0.01, 'manifests')
+        value = self.limit._limit.value
+        for _ in range(3):
+            self.limit.success(0.1, 'manifests')
+        self.assertEqual(self.limit._limit.value, value)
+        # responses of a kind getting slower for good raise the limit again after a few
+        self.limit.success(0.1, 'manifests')
+        self.assertGreater(self.limit._limit.value, value)
+
+    def test_request_kind(self):
+        for url, kind in (('https://registry-1.docker.io/v2/gcmirrors/pause/manifests/3.9', 'manifests'),
+                          ('https://k8s.gcr.io/v2/pause/blobs/sha256:abc', 'blobs'),
+                          ('https://registry-1.docker.io/v2/gcmirrors/pause/blobs/uploads/', 'uploads'),
+                          ('https://k8s.gcr.io/v2/pause/tags/list', 'tags'),
+                          ('https://hub.docker.com/v2/repositories/gcmirrors/pause/tags', 'tags'),
+                          ('https://auth.docker.io/token', 'other')):
+            self.assertEqual(adaptive.request_kind(url), kind)
+
+    def test_acquire_shared_by_workers(self):
+        held, release = multiprocessing.Event(), multiprocessing.Event()
+        workers = [multiprocessing.Process(target=_hold_slot, args=(self.limit, held, release)) for _ in range(2)]
+        for worker in workers:
+            worker.start()
+        held.wait(10)
+        deadline = time.monotonic() + 10
+        while self.limit.in_flight < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertFalse(self.limit.try_acquire())
+
+        release.set()
+        for worker in workers:
+            worker.join(10)
+        self.assertEqual(self.limit.in_flight, 0)
+        self.assertTrue(self.limit.try_acquire())
+
+
+class AdaptiveTestCase(unittest.TestCase):
+
+    def tearDown(self):
+        adaptive.setup([], enabled=False)
+
+    def test_disabled(self):
+        adaptive.setup(['docker.io'], enabled=False)
+        self.assertIsNone(adaptive.get(adaptive.COPY, 'docker.io'))
+        with adaptive.slot(adaptive.COPY, 'docker.io'):
+            adaptive.observe('https://registry-1.docker.io/v2/', 429)
+
+    def test_observe(self):
+        adaptive.setup(['docker.io', 'k8s.gcr.io'], enabled=True, initial=4, minimum=1, maximum=8)
+        adaptive.observe('https://registry-1.docker.io/v2/gcmirrors/pause/manifests/3.9', 429)
+        self.assertEqual(adaptive.get(adaptive.COPY, 'docker.io/gcmirrors').limit, 2)
+        self.assertEqual(adaptive.get(adaptive.LIST, 'registry.hub.docker.com').limit, 2)
+        self.assertEqual(adaptive.get(adaptive.LIST, 'k8s.gcr.io').limit, 4)
+
+        for _ in range(5):
+            adaptive.observe('https://k8s.gcr.io/v2/pause/tags/list', 200, 0.1)
+        self.assertEqual(adaptive.get(adaptive.LIST, 'k8s.gcr.io').limit, 5)
+        self.assertEqual(adaptive.summary(), 'list docker.io=2, copy docker.io=2, list k8s.gcr.io=5, copy k8s.gcr.io=5')
+
+    def test_slot(self):
+        adaptive.setup(['docker.io'], enabled=True, initial=1, minimum=1, maximum=1)
+        entered = threading.Event()
+
+        def _copy():
+            with adaptive.slot(adaptive.COPY, 'docker.io/gcmirrors'):
+                entered.set()
+
+        with adaptive.slot(adaptive.COPY, 'docker.io/gcmirrors', 'docker.io/x-mirrors'):
+            thread = threading.Thread(target=_copy)
+            thread.start()
+            self.assertFalse(entered.wait(0.2))
+        thread.join(10)
+        self.assertTrue(entered.is_set())
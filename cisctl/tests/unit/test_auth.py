@@ -0,0 +1,114 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""test registry token authentication."""
+
+import os
+import stat
+import tempfile
+import time
+import unittest
+from urllib.parse import urlparse
+
+from cisctl import auth
+from cisctl import registry
+from cisctl.cache import TagCache
+from cisctl.tests.fake_registry import FakeRegistry
+
+
+class AuthTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.saved_token_cache = auth._token_cache
+        self.token_cache = TagCache(os.path.join(self.tmp.name, 'tokens.db'), mode=0o600)
+        auth.set_token_cache(self.token_cache)
+        self._start()
+
+    def _start(self, token_expires_in=300):
+        self.fake = FakeRegistry(token_expires_in=token_expires_in)
+        registry.ENDPOINTS['auth.test'] = self.fake.start()
+        self.fake.add_image('gcmirrors/pause', '3.9', [b'pause'])
+        self.registry = registry.Registry('auth.test')
+        self._new_process()
+
+    def _new_process(self):
+        """ forget tokens and challenges in memory, like another pool worker """
+        auth._tokens.clear()
+        auth._challenges.clear()
+        auth._challenges_read.clear()
+
+    def tearDown(self):
+        auth._credentials.pop(urlparse(registry.ENDPOINTS['auth.test']).netloc, None)
+        self.fake.stop()
+        registry.ENDPOINTS.pop('auth.test')
+        self._new_process()
+        auth._token_cache = self.saved_token_cache
+        self.tmp.cleanup()
+
+    def _head(self):
+        digest, _ = self.registry.head_manifest('gcmirrors/pause', '3.9')
+        self.assertIsNotNone(digest)
+
+    def test_token_cached(self):
+        self._head()
+        self._head()
+        self.assertEqual(self.fake.requests[('GET', 'token')], 1)
+        self.assertEqual(self.fake.requests[('unauthorized', 'manifests')], 1)
+
+        # another worker reads token and challenge from disk, neither 401 nor token request
+        self._new_process()
+        self._head()
+        self.assertEqual(self.fake.requests[('GET', 'token')], 1)
+        self.assertEqual(self.fake.requests[('unauthorized', 'manifests')], 1)
+        self.assertEqual(stat.S_IMODE(os.stat(self.token_cache.path).st_mode), 0o600)
+
+        # same scope shares the token, other repositories have tokens of their own
+        self.assertEqual(self.registry.list_tags('gcmirrors/pause'), ['3.9'])
+        self.assertEqual(self.fake.requests[('GET', 'token')], 1)
+        self.assertEqual(self.registry.list_tags('gcmirrors/etcd'), [])
+        self.assertEqual(self.fake.requests[('GET', 'token')], 2)
+
+    def test_token_of_user(self):
+        self._head()
+        # an anonymous token on disk is not reused with credentials, nor the token of another user
+        self._new_process()
+        self.registry.set_credentials('alice', 'secret')
+        self._head()
+        self.assertEqual(self.fake.requests[('GET', 'token')], 2)
+        self._new_process()
+        self.registry.set_credentials('bob', 'secret')
+        self._head()
+        self.assertEqual(self.fake.requests[('GET', 'token')], 3)
+
+        self._new_process()
+        self.registry.set_credentials('alice', 'secret')
+        self._head()
+        self.assertEqual(self.fake.requests[('GET', 'token')], 3)
+
+    def test_token_expired(self):
+        self.fake.stop()
+        self._start(token_expires_in=1)
+        self._head()
+        time.sleep(1)
+        self._head()
+        self.assertEqual(self.fake.requests[('GET', 'token')], 2)
+        # refreshed before it is rejected
+        self.assertEqual(self.fake.requests[('unauthorized', 'manifests')], 1)
+
+    def test_token_revoked(self):
+        self._head()
+        self.fake.issued.clear()
+        self._head()
+        self.assertEqual(self.fake.requests[('GET', 'token')], 2)
+        self.assertEqual(self.fake.requests[('unauthorized', 'manifests')], 2)
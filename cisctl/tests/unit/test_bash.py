@@ -0,0 +1,94 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""test python subprocess utils."""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+from cisctl import bash
+from cisctl.bash import Bash
+
+# writes pid of a grandchild sleeping 60s to argv[1], then sleeps itself
+_SPAWN = 'import subprocess, sys, time\n' \
+         'p = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])\n' \
+         'open(sys.argv[1], "w").write(str(p.pid))\n' \
+         'time.sleep(60)\n'
+
+
+def _alive(pid) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    # reaped by init only after a while, a zombie is dead
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().split()[2] != 'Z'
+    except FileNotFoundError:
+        return False
+
+
+class BashTestCase(unittest.TestCase):
+
+    def test_run(self):
+        code, stdout, stderr = Bash.run([sys.executable, '-c', 'print("a b; c")'], result=True)
+        self.assertEqual((code, stdout, stderr), (0, 'a b; c\n', ''))
+        # no shell, metacharacters are plain args
+        self.assertEqual(Bash.run(['echo', 'x', '|', 'false'], result=True)[1], 'x | false\n')
+        self.assertEqual(Bash.run('echo "x | false"', result=True)[1], 'x | false\n')
+
+    def test_run_timeout(self):
+        with tempfile.TemporaryDirectory() as path:
+            pid_file = os.path.join(path, 'pid')
+            started = time.monotonic()
+            code = Bash.run([sys.executable, '-c', _SPAWN, pid_file], timeout=1)
+            self.assertLess(time.monotonic() - started, 30)
+            self.assertEqual(code, -9)
+            with open(pid_file) as f:
+                grandchild = int(f.read())
+        deadline = time.monotonic() + 5
+        while _alive(grandchild) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertFalse(_alive(grandchild))
+
+    def test_async_run_timeout(self):
+        code, _, _ = asyncio.new_event_loop().run_until_complete(
+            Bash.async_run([sys.executable, '-c', 'import time; time.sleep(60)'], result=True, timeout=0.5))
+        self.assertEqual(code, -9)
+
+    def test_run_json(self):
+        script = 'import json, sys; json.dump({"tags": ["%d" % i for i in range(100000)]}, sys.stdout); ' \
+                 'sys.stderr.write("x" * 200000)'
+        code, resp, stderr = Bash.run_json([sys.executable, '-c', script])
+        self.assertEqual(code, 0)
+        self.assertEqual(len(resp['tags']), 100000)
+        self.assertEqual(len(stderr), 200000)
+
+        self.assertEqual(Bash.run_json([sys.executable, '-c', 'print("not json")'])[:2], (0, None))
+        self.assertEqual(Bash.run_json([sys.executable, '-c', 'print("{}"); exit(1)'])[:2], (1, None))
+        code, resp, _ = Bash.run_json([sys.executable, '-c', 'import time; time.sleep(60)'], timeout=0.5)
+        self.assertEqual((code, resp), (-9, None))
+
+    def test_cap(self):
+        self.assertEqual(bash._cap('abc', limit=10), 'abc')
+        self.assertEqual(bash._cap(b'abcdef', limit=3), 'abc ... (6 bytes)')
+        self.assertEqual(bash._cap('abcdef', limit=0), 'abcdef')
+
+    def test_not_found(self):
+        self.assertEqual(Bash.run(['cisctl-no-such-command']), 127)
+        self.assertEqual(Bash.run_json(['cisctl-no-such-command'])[:2], (127, None))
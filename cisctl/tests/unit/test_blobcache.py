@@ -0,0 +1,76 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""test content addressed blob cache."""
+
+import os
+import tempfile
+import time
+import unittest
+
+from cisctl.blobcache import BlobCache
+from cisctl.tests.fake_registry import digest
+
+
+class BlobCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.blob_cache = BlobCache(path=self.tmp.name, max_bytes=10)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_put_get(self):
+        self.assertIsNone(self.blob_cache.get(digest(b'layer')))
+        path = self.blob_cache.put(digest(b'layer'), [b'la', b'yer'])
+        self.assertEqual(path, self.blob_cache.get(digest(b'layer')))
+        self.assertTrue(os.path.exists(os.path.join(self.tmp.name, 'oci-layout')))
+
+        self.assertRaises(ValueError, self.blob_cache.put, digest(b'layer'), [b'other'])
+        self.assertRaises(ValueError, self.blob_cache.blob_path, 'md5:xxx')
+
+        # corrupted blob is dropped on read
+        with open(path, 'wb') as f:
+            f.write(b'broken')
+        self.assertIsNone(self.blob_cache.get(digest(b'layer')))
+        self.assertFalse(os.path.exists(path))
+
+    def test_evict(self):
+        self.blob_cache.keep_seconds = 0
+        old = self.blob_cache.put(digest(b'old-1'), [b'old-1'])
+        read = self.blob_cache.put(digest(b'old-2'), [b'old-2'])
+        os.utime(old, (time.time() - 20, time.time() - 20))
+        os.utime(read, (time.time() - 10, time.time() - 10))
+        self.blob_cache.get(digest(b'old-2'))
+
+        # least recently read blob is evicted to fit 10 bytes
+        self.blob_cache.put(digest(b'new'), [b'new'])
+        self.assertFalse(os.path.exists(old))
+        self.assertIsNotNone(self.blob_cache.get(digest(b'old-2')))
+        self.assertIsNotNone(self.blob_cache.get(digest(b'new')))
+
+    def test_evict_stale_tmp(self):
+        self.blob_cache.put(digest(b'blob'), [b'blob'])
+        # left by puts killed before their rename, one long ago and one still writing
+        stale = f'{self.blob_cache.blob_path(digest(b"stale"))}.1.tmp'
+        writing = f'{self.blob_cache.blob_path(digest(b"writing"))}.2.tmp'
+        for path in (stale, writing):
+            with open(path, 'wb') as f:
+                f.write(b'partial')
+        os.utime(stale, (time.time() - 120, time.time() - 120))
+
+        self.blob_cache.evict()
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.exists(writing))
+        self.assertIsNotNone(self.blob_cache.get(digest(b'blob')))
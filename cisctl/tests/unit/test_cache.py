@@ -0,0 +1,70 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""test tags cache."""
+
+import os
+import pickle
+import tempfile
+import time
+import unittest
+from multiprocessing import Pool
+
+from cisctl.cache import TagCache
+
+
+def _set(args):
+    cache, i = args
+    cache.set(f'https://gcr.io/v2/ml-pipeline/image-{i}', {'tags': [[f'v{i}', i]]})
+    return cache.get(f'https://gcr.io/v2/ml-pipeline/image-{i}')
+
+
+class TagCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = TagCache(path=os.path.join(self.tmp.name, 'tags.db'), ttl=60, max_entries=10)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_get_set(self):
+        key = 'https://gcr.io/v2/ml-pipeline/api-server'
+        self.assertIsNone(self.cache.get(key))
+        self.cache.set(key, {'tags': [['1.0', 1]], 'digests': {'1.0': 'sha256:1'}})
+        self.assertEqual(self.cache.get(key)['digests'], {'1.0': 'sha256:1'})
+        self.cache.delete(key)
+        self.assertIsNone(self.cache.get(key))
+
+    def test_ttl(self):
+        self.cache.ttl = 0.01
+        self.cache.set('k', 1)
+        time.sleep(0.02)
+        self.assertIsNone(self.cache.get('k'))
+
+    def test_evict(self):
+        for i in range(20):
+            self.cache.set(f'k{i}', i)
+        self.cache.get('k0')
+        self.cache.evict()
+        self.assertEqual(len(self.cache), 10)
+        self.assertEqual(self.cache.get('k0'), 0)
+        self.assertIsNone(self.cache.get('k1'))
+
+    def test_pool_workers(self):
+        self.cache.get('k')
+        self.assertIsNone(pickle.loads(pickle.dumps(self.cache))._local)
+        with Pool(4) as p:
+            results = p.map(_set, [(self.cache, i) for i in range(10)])
+        self.assertEqual(results[3], {'tags': [['v3', 3]]})
+        self.assertEqual(self.cache.get('https://gcr.io/v2/ml-pipeline/image-9'), {'tags': [['v9', 9]]})
@@ -0,0 +1,118 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""test native copy engine."""
+
+import json
+import tempfile
+import time
+import unittest
+
+from cisctl import registry
+from cisctl.blobcache import BlobCache
+from cisctl.copier import Copier
+from cisctl.tests.fake_registry import FakeRegistry
+
+
+class CopierTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.src, self.dest = FakeRegistry(), FakeRegistry()
+        registry.ENDPOINTS['src.test'] = self.src.start()
+        registry.ENDPOINTS['dest.test'] = self.dest.start()
+        self.copier = Copier()
+
+    def tearDown(self):
+        self.src.stop()
+        self.dest.stop()
+        registry.ENDPOINTS.pop('src.test')
+        registry.ENDPOINTS.pop('dest.test')
+
+    def test_copy(self):
+        digest = self.src.add_image('kube-proxy', 'v1.30.0', [b'base', b'proxy'])
+        self.assertTrue(self.copier.copy('src.test/kube-proxy', 'dest.test/gcmirrors/kube-proxy', 'v1.30.0'))
+        self.assertEqual(self.dest.requests[('PUT', 'uploads')], 3)
+        media_type, body = self.dest.repos['gcmirrors/kube-proxy']['manifests']['v1.30.0']
+        self.assertEqual(registry.MEDIA_TYPE_DOCKER_MANIFEST, media_type)
+        self.assertEqual(self.src.repos['kube-proxy']['manifests'][digest][1], body)
+
+        # base layer and config are mounted from gcmirrors/kube-proxy, only the new layer is uploaded
+        self.src.add_image('kube-apiserver', 'v1.30.0', [b'base', b'apiserver'])
+        self.assertTrue(self.copier.copy('src.test/kube-apiserver', 'dest.test/gcmirrors/kube-apiserver', 'v1.30.0'))
+        self.assertEqual(self.dest.requests[('PUT', 'uploads')], 4)
+        self.assertIn(('POST', 'uploads'), self.dest.requests)
+        self.assertEqual(len(self.dest.repos['gcmirrors/kube-apiserver']['blobs']), 3)
+
+        # same digest, skip copy
+        self.assertTrue(self.copier.copy('src.test/kube-proxy', 'dest.test/gcmirrors/kube-proxy', 'v1.30.0'))
+        self.assertEqual(self.dest.requests[('PUT', 'manifests')], 2)
+
+    def test_copy_upload_retry(self):
+        self.src.add_image('pause', '3.9', [b'pause'])
+        # a streamed blob is read once, the upload is started again with the blob read again
+        self.dest.faults[('PUT', 'uploads')] = [503, 401]
+        started = time.monotonic()
+        self.assertTrue(self.copier.copy('src.test/pause', 'dest.test/gcmirrors/pause', '3.9'))
+        self.assertLess(time.monotonic() - started, 10)
+        self.assertEqual(self.dest.requests[('failed', 'uploads')], 2)
+        self.assertEqual(self.dest.requests[('PUT', 'uploads')], 4)
+        self.assertEqual(self.dest.repos['gcmirrors/pause']['manifests']['3.9'],
+                         self.src.repos['pause']['manifests']['3.9'])
+
+    def test_copy_manifest_list(self):
+        self.src.add_image('pause', '3.9', [b'pause'], platforms=[('linux', 'arm64'), ('linux', 'amd64')])
+        self.assertTrue(self.copier.copy('src.test/pause', 'dest.test/gcmirrors/pause', '3.9'))
+        media_type, body = self.dest.repos['gcmirrors/pause']['manifests']['3.9']
+        self.assertEqual(registry.MEDIA_TYPE_DOCKER_MANIFEST, media_type)
+        self.assertIn(b'amd64', self.dest.blobs[json.loads(body)['config']['digest']])
+
+        self.copier.all_platforms = True
+        self.assertTrue(self.copier.copy('src.test/pause', 'dest.test/gcmirrors/pause-all', '3.9'))
+        media_type, _ = self.dest.repos['gcmirrors/pause-all']['manifests']['3.9']
+        self.assertEqual(registry.MEDIA_TYPE_DOCKER_MANIFEST_LIST, media_type)
+
+    def test_copy_not_found(self):
+        self.assertFalse(self.copier.copy('src.test/no-exist', 'dest.test/gcmirrors/no-exist', 'latest'))
+
+    def test_copy_fanout(self):
+        mirror = FakeRegistry()
+        registry.ENDPOINTS['mirror.test'] = mirror.start()
+        try:
+            self.src.add_image('pause', '3.9', [b'pause'])
+            results = self.copier.copy_fanout(
+                'src.test/pause', ['dest.test/gcmirrors/pause', 'mirror.test/gcmirrors/pause'], '3.9')
+        finally:
+            mirror.stop()
+            registry.ENDPOINTS.pop('mirror.test')
+
+        self.assertEqual(results, {'dest.test/gcmirrors/pause': True, 'mirror.test/gcmirrors/pause': True})
+        # manifest and blobs are read from source once for both dests
+        self.assertEqual(self.src.requests[('GET', 'manifests')], 1)
+        self.assertEqual(self.src.requests[('GET', 'blobs')], 2)
+        for dest in (self.dest, mirror):
+            self.assertEqual(dest.repos['gcmirrors/pause']['manifests']['3.9'],
+                             self.src.repos['pause']['manifests']['3.9'])
+            self.assertEqual(dest.requests[('PUT', 'uploads')], 2)
+
+    def test_copy_blob_cache(self):
+        self.src.add_image('kube-proxy', 'v1.30.0', [b'base', b'proxy'])
+        self.src.add_image('kube-proxy', 'v1.30.1', [b'base', b'proxy-1'])
+        with tempfile.TemporaryDirectory() as tmp:
+            self.copier.blob_cache = BlobCache(path=tmp, max_bytes=0)
+            self.assertTrue(self.copier.copy('src.test/kube-proxy', 'dest.test/gcmirrors/kube-proxy', 'v1.30.0'))
+            # another dest registry reads the blobs from cache
+            self.copier._blob_locations.clear()
+            self.dest.repos.clear()
+            self.assertTrue(self.copier.copy('src.test/kube-proxy', 'dest.test/x-mirrors/kube-proxy', 'v1.30.0'))
+            self.assertEqual(self.src.requests[('GET', 'blobs')], 3)
+            self.assertEqual(self.dest.requests[('PUT', 'uploads')], 6)
@@ -32,3 +32,12 @@ class HTTPTestCase(unittest.TestCase):
             url='https://raw.githubusercontent.com/x-mirrors/gcr.io/main/registry.k8s.io/all-repos.txt',
             headers=headers)
         print(resp.split('\n'))
+
+    def test_session_reuse(self):
+        session = client.get_session()
+        self.assertIs(session, client.get_session())
+
+        adapter = session.get_adapter('https://registry.hub.docker.com')
+        self.assertEqual(adapter.max_retries.total, config.HTTP_RETRIES)
+        self.assertEqual(adapter._pool_maxsize, config.HTTP_POOL_MAXSIZE)
+        self.assertEqual(client.timeout, (config.HTTP_CONNECT_TIMEOUT, config.HTTP_READ_TIMEOUT))
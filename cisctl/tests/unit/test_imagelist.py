@@ -0,0 +1,105 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""test source image list."""
+
+import glob
+import hashlib
+import os
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+from cisctl import imagelist
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):  # noqa
+        pass
+
+    def do_GET(self):  # noqa
+        self.server.requests.append(self.headers.get('If-None-Match'))
+        if self.path.endswith('/missing.txt'):
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = b'# k8s images\nk8s.gcr.io/pause\n\nk8s.gcr.io/etcd\n'
+        self.send_response(200)
+        self.send_header('ETag', '"v1"')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class ImageListTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}/all-repos.txt'
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def test_parse_sources(self):
+        self.assertEqual(imagelist.parse_sources('a.txt, https://x/b.txt\nc.txt'), ['a.txt', 'https://x/b.txt', 'c.txt'])
+        self.assertEqual(imagelist.parse_sources(''), [])
+
+    def test_fetch_not_modified(self):
+        cache_dir = os.path.join(self.tmp.name, 'lists')
+        path = imagelist.fetch(self.url, cache_dir)
+        self.assertEqual(imagelist.fetch(self.url, cache_dir), path)
+        self.assertEqual(self.server.requests, [None, '"v1"'])
+
+        # no cache, always download
+        path = imagelist.fetch(self.url, '')
+        self.assertEqual(self.server.requests[-1], None)
+        with open(path) as f:
+            self.assertIn('k8s.gcr.io/pause', f.read())
+        os.remove(path)
+
+    def test_fetch_no_cache_failed(self):
+        # a list left in the temp directory by an earlier version is never served
+        url = self.url.replace('all-repos.txt', 'missing.txt')
+        stale = os.path.join(tempfile.gettempdir(), f'{hashlib.sha256(url.encode()).hexdigest()}.txt')
+        with open(stale, 'w') as f:
+            f.write('k8s.gcr.io/stale\n')
+        try:
+            self.assertIsNone(imagelist.fetch(url, ''))
+        finally:
+            os.remove(stale)
+
+        before = set(glob.glob(os.path.join(tempfile.gettempdir(), 'cisctl-images-*')))
+        self.assertEqual(list(imagelist.iter_images([self.url, url], '')), ['k8s.gcr.io/pause', 'k8s.gcr.io/etcd'])
+        self.assertEqual(set(glob.glob(os.path.join(tempfile.gettempdir(), 'cisctl-images-*'))), before)
+
+    def test_iter_images(self):
+        local = os.path.join(self.tmp.name, 'local.txt')
+        with open(local, 'w') as f:
+            f.write('k8s.gcr.io/etcd\nquay.io/metallb/controller\n')
+
+        images = imagelist.iter_images([self.url, local, os.path.join(self.tmp.name, 'missing.txt')], self.tmp.name)
+        self.assertEqual(next(images), 'k8s.gcr.io/pause')
+        self.assertEqual(list(images), ['k8s.gcr.io/etcd', 'quay.io/metallb/controller'])
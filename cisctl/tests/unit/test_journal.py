@@ -0,0 +1,60 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""test sync journal."""
+
+import os
+import pickle
+import tempfile
+import unittest
+
+from cisctl.journal import Journal
+
+
+class JournalTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.journal = Journal(os.path.join(self.tmp.name, 'journal.ndjson'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_replay(self):
+        self.assertEqual(self.journal.replay(), {})
+
+        key = ('k8s.gcr.io/pause', 'docker.io/gcmirrors/pause')
+        self.journal.plan(*key, [('3.8', 1), ('3.9', 2)], ['3.8', '3.9'], {'3.8': 'sha256:a', '3.9': 'sha256:b'})
+        self.journal.copy(*key, '3.8', 'sha256:a', True)
+        self.journal.copy(*key, '3.9', 'sha256:b', False)
+        self.journal.plan('k8s.gcr.io/etcd', 'docker.io/gcmirrors/etcd', [('3.5', 1)], [], {})
+        self.journal.done('k8s.gcr.io/etcd', 'docker.io/gcmirrors/etcd', '3.5@@@etcd')
+        # line cut by a killed worker
+        with open(self.journal.path, 'a') as f:
+            f.write('{"event":"copy","image":"k8s.gcr')
+
+        states = pickle.loads(pickle.dumps(self.journal)).replay()
+        self.assertEqual(states[key].outstanding(), ['3.9'])
+        self.assertIsNone(states[key].result)
+        self.assertEqual(states[key].plan['digests'], {'3.8': 'sha256:a', '3.9': 'sha256:b'})
+        self.assertEqual(states[('k8s.gcr.io/etcd', 'docker.io/gcmirrors/etcd')].result, '3.5@@@etcd')
+
+        # the cut line is dropped, a resumed run appends whole lines after it
+        self.journal.copy(*key, '3.9', 'sha256:b', True)
+        states = self.journal.replay()
+        self.assertEqual(states[key].outstanding(), [])
+        with open(self.journal.path) as f:
+            self.assertEqual(len(f.readlines()), 6)
+
+        self.journal.truncate()
+        self.assertEqual(self.journal.replay(), {})
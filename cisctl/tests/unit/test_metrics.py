@@ -0,0 +1,69 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""test run metrics."""
+
+import json
+import os
+import tempfile
+import unittest
+from multiprocessing import Pool
+
+from cisctl import metrics
+
+
+def _task(i):
+    metrics.drain()
+    metrics.http('GET', 'https://hub.docker.com/v2/repositories/gcmirrors/pause/tags', 429)
+    with metrics.timer('list_dest', 'docker.io', f'k8s.gcr.io/image-{i}'):
+        pass
+    return metrics.drain()
+
+
+class MetricsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_merge_pool_workers(self):
+        metrics.inc('tags_total', 3, result='skipped')
+        with Pool(2) as p:
+            for snapshot in p.map(_task, range(4)):
+                metrics.merge(snapshot)
+
+        data = metrics.snapshot()
+        self.assertIn(['tags_total', {'result': 'skipped'}, 3], data['counters'])
+        self.assertIn(['http_requests_total', {'code': '429', 'host': 'hub.docker.com', 'method': 'GET'}, 4],
+                      data['counters'])
+        [summary] = data['summaries']
+        self.assertEqual(summary[:3], ['stage_seconds', {'registry': 'docker.io', 'stage': 'list_dest'}, 4])
+        self.assertEqual(len(data['images']), 4)
+
+    def test_export(self):
+        metrics.inc('skopeo_runs_total', command='copy', code=0)
+        metrics.observe('ratelimit_wait_seconds', 1.5, bucket='docker_hub_push')
+        metrics.image('k8s.gcr.io/pause', copy=1.5, copied=2)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            textfile, json_path = os.path.join(tmp, 'cisctl.prom'), os.path.join(tmp, 'cisctl.json')
+            metrics.export(textfile, json_path)
+            with open(textfile) as f:
+                text = f.read()
+            with open(json_path) as f:
+                data = json.load(f)
+
+        self.assertIn('# TYPE cisctl_skopeo_runs_total counter\n', text)
+        self.assertIn('cisctl_skopeo_runs_total{code="0",command="copy"} 1\n', text)
+        self.assertIn('cisctl_ratelimit_wait_seconds_count{bucket="docker_hub_push"} 1\n', text)
+        self.assertIn('cisctl_ratelimit_wait_seconds_max{bucket="docker_hub_push"} 1.500000\n', text)
+        self.assertEqual(data['images'], {'k8s.gcr.io/pause': {'copy': 1.5, 'copied': 2}})
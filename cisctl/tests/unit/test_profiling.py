@@ -0,0 +1,71 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""test profiling hook."""
+
+import os
+import pstats
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
+
+from cisctl import profiling
+
+_initialized = []
+
+
+def _init(value):
+    _initialized.append(value)
+
+
+def _worker_task(i):
+    return sum(range(i * 1000)), list(_initialized)
+
+
+def _thread_task(i):
+    return sum(range(i * 1000))
+
+
+class ProfilingTestCase(unittest.TestCase):
+
+    def test_not_profiling(self):
+        self.assertEqual(profiling.initializer(_init, (1,)), (_init, (1,)))
+        self.assertIsNone(profiling.stop())
+
+    def test_merge_pool_workers(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'profile', 'cisctl.prof')
+            profiling.start(path, top=5)
+
+            initializer, initargs = profiling.initializer(_init, ('ready',))
+            p = Pool(2, initializer=initializer, initargs=initargs)
+            results = p.map(_worker_task, range(4))
+            p.close()
+            p.join()
+            executor = ThreadPoolExecutor(max_workers=2, initializer=profiling.profile_thread)
+            list(executor.map(_thread_task, range(4)))
+            executor.shutdown(wait=True)
+            summary = profiling.stop()
+
+            # the wrapped initializer still runs
+            self.assertEqual([r[1] for r in results], [['ready']] * 4)
+            functions = {f[2] for f in pstats.Stats(path).stats}
+            self.assertIn('_worker_task', functions)
+            self.assertIn('_thread_task', functions)
+            self.assertIn('Ordered by: internal time', summary)
+            self.assertIn('Ordered by: cumulative time', summary)
+            self.assertTrue(summary.startswith('merged'))
+            with open(f'{path}.txt') as f:
+                self.assertEqual(f.read(), summary)
+        self.assertIsNone(profiling.stop())
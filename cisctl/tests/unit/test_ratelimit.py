@@ -0,0 +1,104 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""test rate limit utils."""
+
+import time
+import unittest
+from unittest import mock
+
+from cisctl import client
+from cisctl import config
+from cisctl import exception
+from cisctl import ratelimit
+from cisctl import registry
+from cisctl.tests.fake_registry import FakeRegistry
+
+
+class TokenBucketTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.bucket = ratelimit.TokenBucket('test', limit=2, window=0.2)
+
+    def test_acquire(self):
+        self.assertEqual(self.bucket.acquire(), 0)
+        self.assertEqual(self.bucket.acquire(), 0)
+        # bucket is empty, refill 1 token need 0.1s
+        self.assertGreater(self.bucket.acquire(), 0)
+        self.assertEqual(self.bucket.acquire(max_wait=0.01), -1)
+
+    def test_unlimited(self):
+        bucket = ratelimit.TokenBucket('unlimited', limit=0, window=60)
+        for _ in range(100):
+            self.assertEqual(bucket.acquire(), 0)
+
+    def test_update(self):
+        self.bucket.update(limit=180, remaining=0, window=60, reset=time.time() + 0.1)
+        self.assertGreater(self.bucket.acquire(), 0)
+
+    def test_docker_hub_pull_quota(self):
+        saved = ratelimit.state()
+        try:
+            ratelimit.setup_docker_hub(180, 10)
+            url = 'https://registry-1.docker.io/v2/gcmirrors/pause/manifests/3.9'
+            ratelimit.observe(url, 200, {'RateLimit-Limit': '100;w=21600', 'RateLimit-Remaining': '0;w=21600'})
+            # pull quota headers leave the push bucket alone, and never meter registry requests
+            self.assertEqual(ratelimit._buckets[ratelimit.DOCKER_HUB_PUSH].tokens, 10)
+            self.assertLess(ratelimit._buckets[ratelimit.DOCKER_HUB_PULL].tokens, 1)
+            self.assertEqual(ratelimit.acquire_url(url), 0)
+
+            ratelimit.observe(url, 429, {'X-Retry-After': str(time.time() + 0.1)})
+            self.assertGreater(ratelimit.acquire_url(url), 0)
+            self.assertEqual(ratelimit.acquire(ratelimit.DOCKER_HUB_PUSH), 0)
+        finally:
+            ratelimit.install(*saved)
+
+    def test_docker_hub_pull_429(self):
+        saved = ratelimit.state()
+        fake = FakeRegistry()
+        registry.ENDPOINTS['pull.test'] = fake.start()
+        client._sessions.clear()
+        try:
+            ratelimit.setup_docker_hub(180, 0)
+            # the fake registry stands in for registry-1.docker.io
+            ratelimit.register(ratelimit._buckets[ratelimit.DOCKER_HUB_PULL], ('127.0.0.1',))
+            fake.add_image('library/nginx', 'latest', [b'nginx'])
+            fake.faults[('HEAD', 'manifests')] = [(429, {'X-Retry-After': str(time.time() + 0.5)})]
+            nginx = registry.Registry('pull.test')
+            with mock.patch.object(config, 'HTTP_RETRIES', 0), \
+                    mock.patch.object(ratelimit, 'acquire_url', wraps=ratelimit.acquire_url) as acquire_url:
+                self.assertRaises(exception.RegistryException, nginx.head_manifest, 'library/nginx', 'latest')
+                started = time.monotonic()
+                self.assertIsNotNone(nginx.head_manifest('library/nginx', 'latest')[0])
+            # the request after 429 waits until X-Retry-After
+            self.assertGreater(time.monotonic() - started, 0.3)
+            self.assertEqual(acquire_url.call_count, 2)
+        finally:
+            fake.stop()
+            registry.ENDPOINTS.pop('pull.test')
+            client._sessions.clear()
+            ratelimit.install(*saved)
+
+    def test_parse_headers(self):
+        info = ratelimit.parse_headers({
+            'X-RateLimit-Limit': '180',
+            'X-RateLimit-Remaining': '179',
+            'X-RateLimit-Reset': '1646881125'})
+        self.assertEqual(info, {'limit': 180, 'remaining': 179, 'window': 60, 'reset': 1646881125})
+
+        info = ratelimit.parse_headers({
+            'RateLimit-Limit': '100;w=21600',
+            'RateLimit-Remaining': '76;w=21600'})
+        self.assertEqual(info, {'limit': 100, 'remaining': 76, 'window': 21600})
+
+        self.assertEqual(ratelimit.parse_headers({}), {})
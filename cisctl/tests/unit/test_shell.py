@@ -25,16 +25,15 @@ class CISTestCase(unittest.TestCase):
 
     def test_gcrio_sort_tags(self):
         src_repo, name = 'k8s.gcr.io', 'kube-apiserver'
-        self.cis.init_source_registry_api(src_repo, None)
-        print(self.cis._source_registry.sort_tags(name))
+        print(self.cis.init_source_registry_api(src_repo, None).sort_tags(name))
 
         src_repo, name = 'gcr.io/ml-pipeline', 'api-server'
         if '/' in src_repo:
             registry_url, repo = src_repo.split('/')
-            self.cis.init_source_registry_api(registry_url, repo)
+            source_registry = self.cis.init_source_registry_api(registry_url, repo)
         else:
-            self.cis.init_source_registry_api(src_repo)
-        print(self.cis._source_registry.sort_tags(name))
+            source_registry = self.cis.init_source_registry_api(src_repo)
+        print(source_registry.sort_tags(name))
 
     def test_sync_image_k8s_pause(self):
         image = 'k8s.gcr.io/pause'
@@ -13,8 +13,12 @@
 
 """test python skopeo utils."""
 
+import json
+import os
 import unittest
+from unittest import mock
 
+from cisctl import config
 from cisctl.skopeo import Skopeo
 
 
@@ -40,3 +44,29 @@ class SkopeoTestCase(unittest.TestCase):
         dest_transport = 'docker'
 
         self.skopeo.do_sync(src_repo, dest_repo, name, src_transport, dest_transport)
+
+    def test_sync_tags(self):
+        specs = []
+
+        def _run(cmd, result=False, timeout=None):
+            spec = cmd[-2]
+            self.assertEqual(timeout, config.COMMAND_TIMEOUT * 3)
+            with open(spec) as f:
+                specs.append(json.load(f))
+            self.assertTrue(os.path.exists(spec))
+            stderr = 'time="2024-01-01T00:00:00Z" level=error msg="Error copying ref ' \
+                     '\\"docker://gcr.io/ml-pipeline/api-server:2.0.1\\"" error="manifest unknown"\n'
+            return 1, '', stderr
+
+        with mock.patch.object(self.skopeo.bash, 'run', side_effect=_run):
+            result = self.skopeo.sync(
+                'gcr.io/ml-pipeline', 'docker.io/gcmirrors', 'api-server', tags=['2.0.0', '2.0.1', '2.0.2'])
+
+        self.assertEqual(specs, [{'gcr.io': {'images': {'ml-pipeline/api-server': ['2.0.0', '2.0.1', '2.0.2']},
+                                             'tls-verify': False}}])
+        self.assertEqual(result, {'2.0.0': True, '2.0.1': False, '2.0.2': True})
+
+    def test_sync_tags_failed(self):
+        with mock.patch.object(self.skopeo.bash, 'run', return_value=(1, '', 'unauthorized')):
+            result = self.skopeo.sync('k8s.gcr.io', 'docker.io/gcmirrors', 'pause', tags=['3.8', '3.9'])
+        self.assertEqual(result, {'3.8': False, '3.9': False})
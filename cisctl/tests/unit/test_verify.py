@@ -0,0 +1,62 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""test manifest digest verification."""
+
+import json
+import unittest
+
+from cisctl import registry
+from cisctl.tests.fake_registry import FakeRegistry
+from cisctl.verify import DigestVerifier
+
+
+class DigestVerifierTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.src, self.dest = FakeRegistry(), FakeRegistry()
+        registry.ENDPOINTS['src.test'] = self.src.start()
+        registry.ENDPOINTS['dest.test'] = self.dest.start()
+        self.verifier = DigestVerifier(platform='linux/amd64')
+
+    def tearDown(self):
+        self.src.stop()
+        self.dest.stop()
+        registry.ENDPOINTS.pop('src.test')
+        registry.ENDPOINTS.pop('dest.test')
+
+    def test_unchanged(self):
+        self.src.add_image('pause', 'latest', [b'pause'])
+        self.assertFalse(self.verifier.unchanged('src.test/pause', 'dest.test/gcmirrors/pause', 'latest'))
+
+        self.dest.add_image('gcmirrors/pause', 'latest', [b'pause'])
+        self.assertTrue(self.verifier.unchanged('src.test/pause', 'dest.test/gcmirrors/pause', 'latest'))
+        self.assertEqual(self.dest.requests[('GET', 'manifests')], 0)
+
+        self.src.add_image('pause', 'latest', [b'pause', b'new'])
+        self.assertFalse(self.verifier.unchanged('src.test/pause', 'dest.test/gcmirrors/pause', 'latest'))
+
+    def test_unchanged_manifest_list(self):
+        list_digest = self.src.add_image('pause', '3.9', [b'pause'], platforms=[('linux', 'arm64'), ('linux', 'amd64')])
+        manifests = self.src.repos['pause']['manifests']
+        amd64 = json.loads(manifests['3.9'][1])['manifests'][1]['digest']
+
+        # dest holds linux/amd64 manifest only, as skopeo copy without --all pushes
+        self.dest.repos['gcmirrors/pause']['manifests']['3.9'] = manifests[amd64]
+        self.assertTrue(self.verifier.unchanged('src.test/pause', 'dest.test/gcmirrors/pause', '3.9'))
+
+        self.verifier.all_platforms = True
+        self.assertFalse(self.verifier.unchanged('src.test/pause', 'dest.test/gcmirrors/pause', '3.9'))
+
+        self.dest.repos['gcmirrors/pause']['manifests']['3.9'] = manifests[list_digest]
+        self.assertTrue(self.verifier.unchanged('src.test/pause', 'dest.test/gcmirrors/pause', '3.9'))
@@ -0,0 +1,125 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""test asyncio sync engine."""
+
+import asyncio
+import unittest
+
+from cisctl.v1 import aio
+from cisctl.v1.result import SyncResult
+
+
+class FakeSkopeo(object):
+
+    def __init__(self):
+        self.copied = []
+        self.synced = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def async_copy(self, src_repo, dest_repo, name, tag, dest_name=None, **kwargs):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        self.copied.append(f'{dest_repo}/{dest_name}:{tag}')
+        return True
+
+    async def async_sync(self, src_repo, dest_repo, name, tags, **kwargs):
+        self.synced.append((f'{dest_repo}/{name}', list(tags)))
+        return {tag: True for tag in tags}
+
+
+class FakeDocker(object):
+
+    def __init__(self):
+        self.invalidated = []
+
+    def invalidate(self, name):
+        self.invalidated.append(name)
+
+
+class FakeCIS(object):
+
+    src_transport = 'docker'
+    dest_transport = 'docker'
+    native_copy = False
+
+    def __init__(self, sync_batch=False):
+        self.sync_batch = sync_batch
+        self._skopeo = FakeSkopeo()
+        self._docker = FakeDocker()
+        self.fanout = []
+
+    def dest_api(self, dest_repo):
+        return self._docker
+
+    def batch_copy(self, name, dest_name, tags):
+        return self.sync_batch and len(tags) > 1
+
+    def resume_or_plan(self, image, dest_repo, planned=None):
+        src_repo, name = image.rsplit('/', 1)
+        src_sort_tags = [('v1', 1), ('v2', 2), ('v3', 3)]
+        copy_tags = [] if name == 'synced' else ['v2', 'v3']
+        return src_repo, name, name, src_sort_tags, copy_tags, {}, None
+
+    def sync_image_fanout(self, image, dest_repos):
+        self.fanout.append((image, dest_repos))
+        return [self.finish_image(dest_repo, self.resume_or_plan(image, dest_repo), {}, 0)
+                for dest_repo in dest_repos]
+
+    def record_copy(self, src_repo, name, dest_repo, dest_name, tag, digest, ok):
+        pass
+
+    def finish_image(self, dest_repo, plan, copied, seconds):
+        src_repo, name, dest_name, src_sort_tags, _, _, _ = plan
+        return SyncResult(f'{src_repo}/{name}', dest_name, [_tag for (_tag, _) in src_sort_tags],
+                          copied=len(copied), skipped=len(src_sort_tags) - len(copied))
+
+
+class AsyncioEngineTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cis = FakeCIS()
+
+    def test_run(self):
+        images = [f'k8s.gcr.io/image-{i}' for i in range(10)] + ['k8s.gcr.io/synced']
+        results = aio.run(self.cis, [(image, ['quay.io/gcmirrors'], None) for image in images],
+                          concurrency=4, copy_concurrency=3)
+
+        self.assertEqual(results[0], [SyncResult('k8s.gcr.io/image-0', 'image-0', ['v1', 'v2', 'v3'], copied=2, skipped=1)])
+        self.assertEqual(results[-1], [SyncResult('k8s.gcr.io/synced', 'synced', ['v1', 'v2', 'v3'], skipped=3)])
+        self.assertEqual(len(self.cis._skopeo.copied), 20)
+        self.assertLessEqual(self.cis._skopeo.max_in_flight, 3)
+        self.assertEqual(len(self.cis._docker.invalidated), 10)
+
+    def test_run_sync_batch(self):
+        self.cis = FakeCIS(sync_batch=True)
+        images = [f'k8s.gcr.io/image-{i}' for i in range(5)] + ['k8s.gcr.io/synced']
+        results = aio.run(self.cis, [(image, ['quay.io/gcmirrors'], None) for image in images],
+                          concurrency=4, copy_concurrency=3)
+
+        self.assertEqual(results[0][0].copied, 2)
+        self.assertEqual(self.cis._skopeo.copied, [])
+        self.assertEqual(len(self.cis._skopeo.synced), 5)
+        self.assertIn(('quay.io/gcmirrors/image-0', ['v2', 'v3']), self.cis._skopeo.synced)
+
+    def test_run_fanout(self):
+        tasks = [('k8s.gcr.io/image-0', ['quay.io/gcmirrors', 'ghcr.io/gcmirrors'], None),
+                 ('k8s.gcr.io/image-1', ['quay.io/gcmirrors'], None)]
+        results = aio.run(self.cis, tasks, concurrency=4, copy_concurrency=3)
+
+        self.assertEqual([len(r) for r in results], [2, 1])
+        self.assertEqual(self.cis.fanout, [('k8s.gcr.io/image-0', ['quay.io/gcmirrors', 'ghcr.io/gcmirrors'])])
+        self.assertEqual(len(self.cis._skopeo.copied), 2)
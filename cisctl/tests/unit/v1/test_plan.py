@@ -0,0 +1,85 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""test dry-run plan file."""
+
+import io
+import logging
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from cisctl.logger import logger
+from cisctl.v1 import plan
+from cisctl.v1 import sync
+
+
+class PlanTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.records = plan.entries(
+            'docker.io/gcmirrors',
+            ('k8s.gcr.io', 'pause', 'pause', [('3.8', 1), ('3.9', 2), ('latest', 3)], ['3.9', 'latest'],
+             {'3.9': 'sha256:b', 'latest': 'sha256:b'}, None),
+            {'3.8': 'sha256:a', 'latest': 'sha256:a'})
+        self.records += plan.entries(
+            'quay.io/gcmirrors',
+            ('k8s.gcr.io', 'etcd', 'etcd', [('3.5', 1)], ['3.5'], {}, None), {})
+
+    def test_entries(self):
+        self.assertEqual(self.records[0], {
+            'image': 'k8s.gcr.io/pause', 'dest': 'docker.io/gcmirrors/pause', 'tag': '3.9',
+            'reason': plan.REASON_MISSING, 'src_digest': 'sha256:b', 'dest_digest': None})
+        self.assertEqual((self.records[1]['reason'], self.records[1]['dest_digest']),
+                         (plan.REASON_CHANGED, 'sha256:a'))
+
+    def test_write_read(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in ('plan.ndjson', 'plan.json'):
+                path = os.path.join(tmp, name)
+                plan.write(path, self.records)
+                self.assertEqual(plan.read(path), self.records)
+            with open(os.path.join(tmp, 'plan.ndjson')) as f:
+                self.assertEqual(len(f.readlines()), 3)
+
+    def test_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'plan.ndjson')
+            plan.write(path, self.records)
+            tasks = plan.load(path)
+        self.assertEqual(tasks, [
+            ('k8s.gcr.io/pause', 'docker.io/gcmirrors', (
+                'k8s.gcr.io', 'pause', 'pause', [('3.9', 0), ('latest', 0)], ['3.9', 'latest'],
+                {'3.9': 'sha256:b', 'latest': 'sha256:b'}, None)),
+            ('k8s.gcr.io/etcd', 'quay.io/gcmirrors', (
+                'k8s.gcr.io', 'etcd', 'etcd', [('3.5', 0)], ['3.5'], {'3.5': None}, None)),
+        ])
+
+    def test_stdout_logs_to_stderr(self):
+        handlers = [handler for handler in logger.handlers if type(handler) is logging.StreamHandler]
+        streams = [handler.stream for handler in handlers]
+        try:
+            with tempfile.TemporaryDirectory() as tmp, mock.patch('sys.stdout', new=io.StringIO()) as stdout:
+                for handler in handlers:
+                    handler.setStream(sys.stdout)
+                image_list = os.path.join(tmp, 'images.txt')
+                with open(image_list, 'w') as f:
+                    f.write('# nothing to plan\n')
+                sync.CIS('docker', 'docker').do_plan(image_list, 'docker.io/gcmirrors', '-', docker_api_rate_limit=0)
+                self.assertTrue(all(handler.stream is sys.stderr for handler in handlers))
+                self.assertEqual(stdout.getvalue(), '')
+        finally:
+            for handler, stream in zip(handlers, streams):
+                handler.setStream(stream)
@@ -0,0 +1,54 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""test per-image sync result and README rendering."""
+
+import os
+import pickle
+import tempfile
+import unittest
+
+from cisctl.v1.render import Render
+from cisctl.v1.result import SyncResult
+
+
+class SyncResultTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.result = SyncResult(
+            image='k8s.gcr.io/pause', dest_name='pause', tags=['3.8', '3.9'], digests=['sha256:a', 'sha256:b'],
+            copied=1, skipped=1, size=3 * 1024 * 1024 + 512 * 1024, seconds=0.25)
+
+    def test_pickle(self):
+        data = pickle.dumps(self.result)
+        self.assertEqual(pickle.loads(data), self.result)
+        # fields only, no attribute names
+        self.assertNotIn(b'dest_name', data)
+
+    def test_dict(self):
+        self.assertEqual(SyncResult.from_dict(self.result.as_dict()), self.result)
+        self.assertEqual(SyncResult('k8s.gcr.io/x', 'x', ['v1']).digests, [None])
+
+    def test_human_size(self):
+        self.assertEqual(self.result.human_size, '3.5 MB')
+        self.assertEqual(SyncResult('k8s.gcr.io/x', 'x', [], size=100).human_size, '100 B')
+        self.assertEqual(SyncResult('k8s.gcr.io/x', 'x', []).human_size, '-')
+
+    def test_render_readme(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            Render().readme([self.result, SyncResult('k8s.gcr.io/etcd', 'etcd', ['3.5'])],
+                            'k8s.gcr.io', 'pause', dest_repo='docker.io/gcmirrors', git_repo=tmp)
+            with open(os.path.join(tmp, 'README.md')) as f:
+                readme = f.read()
+        self.assertIn('| 1 | pause | 2 | 3.5 MB |', readme)
+        self.assertIn('| 2 | etcd | 1 | - |', readme)
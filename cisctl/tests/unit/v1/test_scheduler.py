@@ -0,0 +1,32 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""test sync scheduler."""
+
+import unittest
+
+from cisctl.v1 import scheduler
+
+
+class SchedulerTestCase(unittest.TestCase):
+
+    def test_estimate_cost(self):
+        self.assertIsNone(scheduler.estimate_cost(None, ['v1']))
+        self.assertEqual(scheduler.estimate_cost(['v1', 'v2'], ['v1', 'v2']), 3)
+        self.assertEqual(scheduler.estimate_cost(['v1', 'v2'], ['v1']), 23)
+        self.assertEqual(scheduler.estimate_cost(['v1', 'v2'], None), 43)
+
+    def test_longest_first(self):
+        self.assertEqual(scheduler.longest_first([3, 300, None, 3, 30]), [1, 2, 4, 0, 3])
+        self.assertEqual(scheduler.longest_first([None, None]), [0, 1])
+        self.assertEqual(scheduler.longest_first([]), [])
@@ -0,0 +1,35 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""test v1 subcommand arguments."""
+
+import unittest
+
+from cisctl.shell import CISctlShell
+
+
+class ShellTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = CISctlShell().get_subcommand_parser()
+
+    def test_sync(self):
+        args = self.parser.parse_args(['sync', '--plan-file', 'plan.ndjson', '--resume'])
+        self.assertEqual((args.plan_file, args.resume), ('plan.ndjson', True))
+        # 0 is unlimited, only a missing option falls back to config
+        args = self.parser.parse_args(['sync', '--docker-api-rate-limit', '0'])
+        self.assertEqual((args.docker_api_rate_limit, args.docker_push_rate_limit), (0, None))
+
+    def test_plan(self):
+        args = self.parser.parse_args(['plan', '--dest-repo', 'docker.io/gcmirrors', '--concurrency', '8'])
+        self.assertEqual((args.plan_file, args.dest_repo, args.concurrency), ('-', 'docker.io/gcmirrors', 8))
@@ -0,0 +1,205 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""test sync Container Images."""
+
+import os
+import pickle
+import tempfile
+import unittest
+from unittest import mock
+
+from cisctl.api.gcr import GoogleContainerRegisterV2
+from cisctl.api.k8s import K8sRegister
+from cisctl.api.oci import OCIRegisterV2
+from cisctl.api.quay import QuayRegisterV2
+from cisctl.cache import TagCache
+from cisctl.journal import Journal
+from cisctl.v1 import plan
+from cisctl.v1 import sync
+from cisctl.v1.sync import CIS
+
+
+class CISTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cis = CIS(src_transport='docker', dest_transport='docker')
+
+    def test_init_source_registry_api(self):
+        ml_pipeline = self.cis.init_source_registry_api('gcr.io', 'ml-pipeline')
+        metallb = self.cis.init_source_registry_api('quay.io', 'metallb')
+        self.assertIsInstance(ml_pipeline, GoogleContainerRegisterV2)
+        self.assertIsInstance(metallb, QuayRegisterV2)
+        self.assertEqual(ml_pipeline.base_url, 'https://gcr.io/v2/ml-pipeline')
+
+        # built once, reused for later images of the same project
+        self.assertIs(self.cis.init_source_registry_api('gcr.io', 'ml-pipeline'), ml_pipeline)
+        kubeflow = self.cis.init_source_registry_api('gcr.io', 'kubeflow-images-public')
+        self.assertEqual(kubeflow.base_url, 'https://gcr.io/v2/kubeflow-images-public')
+
+        # other registries are listed with the distribution api
+        fluxcd = self.cis.init_source_registry_api('ghcr.io', 'fluxcd')
+        self.assertIsInstance(fluxcd, OCIRegisterV2)
+        self.assertEqual(fluxcd.cache_key('source-controller'), 'https://ghcr.io/v2/fluxcd/source-controller')
+        self.assertFalse(fluxcd.has_timestamps)
+        self.assertIsNone(self.cis.init_source_registry_api('library'))
+
+        # pool workers get a copy of the clients
+        cis = pickle.loads(pickle.dumps(self.cis))
+        self.assertEqual(len(cis._source_registries), 5)
+
+    def test_k8s_register_project(self):
+        addon_manager = self.cis.init_source_registry_api('registry.k8s.io', 'addon-manager')
+        self.assertIsInstance(addon_manager, K8sRegister)
+        self.assertEqual(addon_manager.repository('kube-addon-manager'), 'registry.k8s.io/addon-manager/kube-addon-manager')
+        self.assertNotEqual(addon_manager.cache_key('x'), self.cis.init_source_registry_api('registry.k8s.io').cache_key('x'))
+
+    def test_dest_api(self):
+        self.assertIs(self.cis.dest_api('docker.io/gcmirrors'), self.cis._docker)
+        ghcr = self.cis.dest_api('ghcr.io/gcmirrors')
+        self.assertIsInstance(ghcr, OCIRegisterV2)
+        self.assertIs(self.cis.dest_api('ghcr.io/x-mirrors'), ghcr)
+        self.assertEqual(ghcr.cache_key('ghcr.io/gcmirrors/pause'), 'https://ghcr.io/v2/gcmirrors/pause')
+
+    def test_estimate_cost(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = TagCache(os.path.join(tmp, 'tags.db'))
+            cis = CIS(src_transport='docker', dest_transport='docker', cache=cache)
+            self.assertIsNone(cis.estimate_cost('k8s.gcr.io/kube-apiserver', 'docker.io/gcmirrors'))
+
+            cache.set('https://k8s.gcr.io/v2/kube-apiserver', {
+                'since': 0, 'tags': [['v1.30.1', 2], ['v1.30.0', 1]], 'digests': {}})
+            self.assertEqual(cis.estimate_cost('k8s.gcr.io/kube-apiserver', 'docker.io/gcmirrors'), 43)
+
+            cache.set('https://registry.hub.docker.com/v2/repositories/gcmirrors/kube-apiserver', {
+                'since': 0, 'tags': [['v1.30.0', 1]], 'digests': {}})
+            self.assertEqual(cis.estimate_cost('k8s.gcr.io/kube-apiserver', 'docker.io/gcmirrors'), 23)
+
+    def test_resume(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            journal = Journal(os.path.join(tmp, 'journal.ndjson'))
+            cis = CIS(src_transport='docker', dest_transport='docker', journal=journal, sync_batch=False)
+            plan = ('k8s.gcr.io', 'pause', 'pause', [('3.8', 1), ('3.9', 2)], ['3.8', '3.9'], {'3.8': 'sha256:a'}, 1024)
+            with mock.patch.object(cis, 'plan_image', return_value=plan), \
+                    mock.patch.object(cis, 'copy_tag', side_effect=[True, KeyboardInterrupt]):
+                self.assertRaises(KeyboardInterrupt, cis.sync_image, 'k8s.gcr.io/pause', 'docker.io/gcmirrors')
+
+            # next run continues with 3.9 only, without listing again
+            cis = CIS(src_transport='docker', dest_transport='docker', journal=journal, sync_batch=False)
+            self.assertEqual(cis.resume(), {})
+            with mock.patch.object(cis, 'plan_image') as plan_image, \
+                    mock.patch.object(cis, 'copy_tag', return_value=True) as copy_tag:
+                result = cis.sync_image('k8s.gcr.io/pause', 'docker.io/gcmirrors')
+            plan_image.assert_not_called()
+            copy_tag.assert_called_once_with('k8s.gcr.io', 'pause', 'docker.io/gcmirrors', 'pause', '3.9')
+
+            # 3.8 is copied by the interrupted run
+            self.assertEqual((result.tags, result.digests), (['3.8', '3.9'], ['sha256:a', None]))
+            self.assertEqual((result.copied, result.skipped, result.failed, result.size), (1, 1, 0, 1024))
+            self.assertEqual(cis.resume(), {('k8s.gcr.io/pause', 'docker.io/gcmirrors/pause'): result})
+
+    def test_plan_tags(self):
+        cis = CIS(src_transport='docker', dest_transport='docker', verify_digest=False)
+        source = mock.Mock()
+        source.cached_sort_tags.return_value = (
+            True, [('latest', 3), ('3.9', 2), ('3.8', 1)], {'3.8': 'sha256:a', '3.9': 'sha256:b', 'latest': 'sha256:b'})
+        source.pop_tag_sizes.return_value = {'3.8': 10, '3.9': 20, 'latest': 20}
+        cis._docker = mock.Mock()
+        cis._docker.cached_sort_tags.return_value = (True, [('latest', 4), ('3.8', 1)],
+                                                     {'3.8': 'sha256:a', 'latest': 'sha256:a'})
+        cis._docker.last_tag.return_value = ('latest', 4)
+        with mock.patch.object(cis, 'init_source_registry_api', return_value=source):
+            records = cis.plan_tags('k8s.gcr.io/pause', 'docker.io/gcmirrors')
+            self.assertEqual(cis.plan_image('k8s.gcr.io/pause', 'docker.io/gcmirrors')[-1], 30)
+
+        self.assertEqual([(r['tag'], r['reason'], r['dest_digest']) for r in records],
+                         [('3.9', plan.REASON_MISSING, None), ('latest', plan.REASON_CHANGED, 'sha256:a')])
+
+    def test_plan_tags_oci_dest(self):
+        cis = CIS(src_transport='docker', dest_transport='docker', verify_digest=False)
+        source = ([('3.8', 1), ('3.9', 2), ('latest', 3)], {}, None)
+        dest = cis.dest_api('ghcr.io/gcmirrors')
+        # tags/list has no push time, tags missing in dest and latest are copied
+        with mock.patch.object(dest, 'list_tags', return_value=(True, ['3.8', 'latest'])):
+            records = cis.plan_tags('k8s.gcr.io/pause', 'ghcr.io/gcmirrors', source)
+        self.assertEqual([r['tag'] for r in records], ['3.9', 'latest'])
+
+        with mock.patch.object(dest, 'list_tags', return_value=(True, [])):
+            records = cis.plan_tags('k8s.gcr.io/pause', 'ghcr.io/gcmirrors', source)
+        self.assertEqual([r['tag'] for r in records], ['3.8', '3.9', 'latest'])
+
+    def test_plan_tags_untimed_source(self):
+        cis = CIS(src_transport='docker', dest_transport='docker', verify_digest=False)
+        # OCI source without config timestamps, dest has push time
+        source = ([('v1.0', 0), ('v1.1', 0), ('latest', 0)], {}, None)
+        with mock.patch.object(cis._docker, 'sort_tags', return_value=(True, [('v1.0', 5)], {})):
+            records = cis.plan_tags('ghcr.io/fluxcd/source-controller', 'docker.io/gcmirrors', source)
+        self.assertEqual([r['tag'] for r in records], ['v1.1', 'latest'])
+
+    def test_sync_image_fanout(self):
+        cis = CIS(src_transport='docker', dest_transport='docker', copy_engine=sync.COPY_ENGINE_NATIVE)
+        source = ([('3.8', 1), ('3.9', 2)], {'3.8': 'sha256:a', '3.9': 'sha256:b'}, None)
+        plans = {
+            'docker.io/gcmirrors': ('k8s.gcr.io', 'pause', 'pause', source[0], ['3.9'], source[1], None),
+            'ghcr.io/gcmirrors': ('k8s.gcr.io', 'pause', 'pause', source[0], ['3.8', '3.9'], source[1], None),
+        }
+        with mock.patch.object(cis, 'list_source', return_value=source) as list_source, \
+                mock.patch.object(cis, 'plan_image', side_effect=lambda image, dest_repo, _: plans[dest_repo]), \
+                mock.patch.object(cis, 'copy_tag_fanout', side_effect=lambda *args: [True] * len(args[2])) as fanout:
+            results = cis.sync_image_fanout('k8s.gcr.io/pause', list(plans))
+
+        list_source.assert_called_once_with('k8s.gcr.io/pause')
+        # 3.9 is read from source once for both dests
+        self.assertEqual([c.args for c in fanout.call_args_list], [
+            ('k8s.gcr.io', 'pause', [('docker.io/gcmirrors', 'pause'), ('ghcr.io/gcmirrors', 'pause')], '3.9'),
+            ('k8s.gcr.io', 'pause', [('ghcr.io/gcmirrors', 'pause')], '3.8')])
+        self.assertEqual([(r.copied, r.skipped) for r in results], [(1, 1), (2, 0)])
+
+    def test_do_sync_worker_cis(self):
+        def _sync_image(cis, image, dest_repo, planned):
+            built = len(cis._source_registries)
+            cis.init_source_registry_api('quay.io', 'metallb')
+            return os.getpid(), built
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'images.txt')
+            with open(path, 'w') as f:
+                f.write('quay.io/metallb/controller\nquay.io/metallb/speaker\nquay.io/metallb/frr\n')
+            with mock.patch.object(CIS, 'sync_image', autospec=True, side_effect=_sync_image):
+                results, _, _ = self.cis.do_sync(
+                    src_image_list_url=path, thread_pool_size=1, dest_repo='docker.io/gcmirrors', debug=False,
+                    adaptive_concurrency=False)
+
+        # the worker syncs all images with one CIS, source registry clients are built once
+        self.assertEqual(sorted(built for _, built in results), [0, 1, 1])
+        self.assertEqual(len({pid for pid, _ in results}), 1)
+        self.assertNotEqual(results[0][0], os.getpid())
+
+    def test_do_sync_plan_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'plan.ndjson')
+            plan.write(path, [
+                {'image': 'k8s.gcr.io/pause', 'dest': 'quay.io/gcmirrors/pause', 'tag': tag, 'reason': 'missing',
+                 'src_digest': None, 'dest_digest': None} for tag in ('3.8', '3.9')])
+            cis = CIS(src_transport='docker', dest_transport='docker', copy_engine=sync.COPY_ENGINE_NATIVE)
+            with mock.patch.object(cis, 'plan_image') as plan_image, \
+                    mock.patch.object(cis, 'copy_tag', return_value=True) as copy_tag:
+                results, src_org, _ = cis.do_sync(
+                    src_image_list_url='', thread_pool_size=1, dest_repo='docker.io/gcmirrors', debug=False,
+                    engine=sync.ENGINE_ASYNCIO, plan_file=path)
+
+        plan_image.assert_not_called()
+        self.assertEqual(sorted(c.args for c in copy_tag.call_args_list), [
+            ('k8s.gcr.io', 'pause', 'quay.io/gcmirrors', 'pause', '3.8'),
+            ('k8s.gcr.io', 'pause', 'quay.io/gcmirrors', 'pause', '3.9')])
+        self.assertEqual((results[0].copied, src_org), (2, None))
@@ -139,6 +139,14 @@ def date2timestamp(date_time) -> int:
         return int(dt_utc.timestamp() * 1000)
 
 
+def is_signature_tag(tag) -> bool:
+    """ cosign signature, sbom and attestation tags are not images to sync
+
+    :param tag: e.g. sha256-7939f3c6366155e73cb5025fc1fde5bd70c350cc9cd6b505340f7db8af655832.sbom
+    """
+    return tag.startswith('sha256-') and (tag.endswith('.sbom') or tag.endswith('.sig') or tag.endswith('.att'))
+
+
 def generate_dest_name(src_repo, name):
     """ generate dest repo image name
 
@@ -161,3 +169,10 @@ def generate_dest_name(src_repo, name):
         return f'{t}-{name}'
 
     return name
+
+
+def parse_dest_repos(dest_repo) -> list:
+    """ split comma separated dest repos, e.g.
+    docker.io/gcmirrors,registry.cn-hangzhou.aliyuncs.com/gcmirrors -> [docker.io/gcmirrors, registry.cn-hangzhou.aliyuncs.com/gcmirrors]
+    """
+    return [r.strip() for r in (dest_repo or '').split(',') if r.strip()]
@@ -0,0 +1,136 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""asyncio sync engine, run many images in flight in one process.
+
+Listing and diffing reuse the blocking CIS.plan_image() in a thread pool, the
+pooled http session keeps connections alive between them. skopeo copy and sync run
+as asyncio subprocesses, so no thread is held while a copy is waiting on the network.
+Images synced to several dest repos run the blocking CIS.sync_image_fanout() in the
+thread pool, holding a copy slot.
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from typing import Tuple
+
+from cisctl import adaptive
+from cisctl import metrics
+from cisctl import profiling
+from cisctl import ratelimit
+from cisctl.logger import logger
+
+
+async def _sync_image(cis, image: str, dest_repo: str, planned, list_semaphore: asyncio.Semaphore,
+                      copy_semaphore: asyncio.Semaphore):
+    loop = asyncio.get_event_loop()
+    async with list_semaphore:
+        started = time.monotonic()
+        plan = await loop.run_in_executor(None, cis.resume_or_plan, image, dest_repo, planned)
+    src_repo, name, dest_name, _, copy_tags, digests, _ = plan
+    copied = dict()
+
+    async def _copy(tag):
+        async with copy_semaphore:
+            if cis.native_copy:
+                ok = await loop.run_in_executor(None, cis.copy_tag, src_repo, name, dest_repo, dest_name, tag)
+            else:
+                if dest_repo.startswith('docker.io'):
+                    await loop.run_in_executor(None, ratelimit.acquire, ratelimit.DOCKER_HUB_PUSH)
+                limit = await adaptive.async_acquire(adaptive.COPY, dest_repo)
+                try:
+                    ok = await cis._skopeo.async_copy(
+                        src_repo=src_repo,
+                        dest_repo=dest_repo,
+                        name=name,
+                        tag=tag,
+                        dest_name=dest_name,
+                        src_transport=cis.src_transport,
+                        dest_transport=cis.dest_transport)
+                finally:
+                    adaptive.release(limit)
+            copied[tag] = ok
+            cis.record_copy(src_repo, name, dest_repo, dest_name, tag, digests.get(tag), ok)
+
+    async def _sync(tags):
+        async with copy_semaphore:
+            if dest_repo.startswith('docker.io'):
+                for _ in tags:
+                    await loop.run_in_executor(None, ratelimit.acquire, ratelimit.DOCKER_HUB_PUSH)
+            limit = await adaptive.async_acquire(adaptive.COPY, dest_repo)
+            try:
+                results = await cis._skopeo.async_sync(
+                    src_repo=src_repo,
+                    dest_repo=dest_repo,
+                    name=name,
+                    tags=tags,
+                    dest_transport=cis.dest_transport)
+            finally:
+                adaptive.release(limit)
+            failed = [tag for tag, ok in results.items() if not ok]
+            if failed:
+                logger.error(f'skopeo sync {src_repo}/{name} to {dest_repo} failed tags: {failed}')
+            copied.update(results)
+            for tag, ok in results.items():
+                cis.record_copy(src_repo, name, dest_repo, dest_name, tag, digests.get(tag), ok)
+
+    if copy_tags:
+        with metrics.timer('copy', dest_repo.split('/')[0], f'{src_repo}/{name}'):
+            if cis.batch_copy(name, dest_name, copy_tags):
+                await _sync(copy_tags)
+            else:
+                await asyncio.gather(*[_copy(tag) for tag in copy_tags])
+
+    # dest tags changed, list it again next time
+    if copy_tags:
+        await loop.run_in_executor(None, cis.dest_api(dest_repo).invalidate, f'{dest_repo}/{dest_name}')
+
+    return cis.finish_image(dest_repo, plan, copied, time.monotonic() - started)
+
+
+async def _sync_images(cis, tasks: List[Tuple], concurrency: int, copy_concurrency: int) -> List:
+    list_semaphore = asyncio.Semaphore(concurrency)
+    copy_semaphore = asyncio.Semaphore(copy_concurrency)
+
+    async def _safe_sync_image(image, dest_repos, planned):
+        try:
+            if len(dest_repos) == 1:
+                return [await _sync_image(cis, image, dest_repos[0], planned, list_semaphore, copy_semaphore)]
+            async with copy_semaphore:
+                return await asyncio.get_event_loop().run_in_executor(None, cis.sync_image_fanout, image, dest_repos)
+        except Exception:
+            logger.exception(f'sync image {image} error')
+            return [None] * len(dest_repos)
+
+    return await asyncio.gather(*[_safe_sync_image(*task) for task in tasks])
+
+
+def run(cis, tasks: List[Tuple], concurrency: int, copy_concurrency: int) -> List:
+    """ sync images with asyncio
+
+    :param cis: cisctl.v1.sync.CIS
+    :param tasks: (image, dest repos, planned) to sync, ref CIS.sync_image_task()
+    :param concurrency: max images listing in flight
+    :param copy_concurrency: max skopeo copy in flight
+    :return: sync_image() results of each dest repo of each task, same order as tasks, None if failed
+    """
+    loop = asyncio.new_event_loop()
+    executor = ThreadPoolExecutor(max_workers=concurrency, initializer=profiling.profile_thread)
+    loop.set_default_executor(executor)
+    try:
+        return loop.run_until_complete(_sync_images(cis, tasks, concurrency, copy_concurrency))
+    finally:
+        executor.shutdown(wait=True)
+        loop.close()
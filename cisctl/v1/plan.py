@@ -0,0 +1,96 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""dry-run plan of tags to copy, written by `cisctl plan` and run by `cisctl sync --plan-file`.
+
+One record per tag to copy, e.g.
+
+  {"image": "k8s.gcr.io/pause", "dest": "docker.io/gcmirrors/pause", "tag": "3.9", "reason": "missing",
+   "src_digest": "sha256:...", "dest_digest": null}
+
+A path ending with `.json` is a json array, other paths are ndjson, `-` is stdout.
+"""
+
+import json
+import sys
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+from cisctl import utils
+
+# tag is not in dest
+REASON_MISSING = 'missing'
+# dest tag is another digest, or source tag is pushed after dest was synced
+REASON_CHANGED = 'changed'
+
+
+def entries(dest_repo: str, plan, dest_digests: Dict[str, str]) -> List[Dict]:
+    """ plan records of one image
+
+    :param plan: ref CIS.plan_image()
+    :param dest_digests: {tag: digest or None} of dest tags listed
+    """
+    src_repo, name, dest_name, _, copy_tags, digests, _ = plan
+    return [{
+        'image': f'{src_repo}/{name}',
+        'dest': f'{dest_repo}/{dest_name}',
+        'tag': tag,
+        'reason': REASON_CHANGED if tag in dest_digests else REASON_MISSING,
+        'src_digest': digests.get(tag),
+        'dest_digest': dest_digests.get(tag),
+    } for tag in copy_tags]
+
+
+def write(path: str, records: List[Dict]):
+    f = sys.stdout if path == '-' else open(path, 'w')
+    try:
+        if path.endswith('.json'):
+            json.dump(records, f, indent=2)
+            f.write('\n')
+        else:
+            for record in records:
+                f.write(json.dumps(record, separators=(',', ':')) + '\n')
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
+
+def read(path: str) -> List[Dict]:
+    f = sys.stdin if path == '-' else open(path)
+    try:
+        if path.endswith('.json'):
+            return json.load(f)
+        return [json.loads(line) for line in f if line.strip()]
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def load(path: str) -> List[Tuple[str, str, Tuple]]:
+    """ read plan file as sync tasks, tags of one image are copied together
+
+    :return: [(image, dest repo, plan)], plan ref CIS.plan_image(), its source tags are the planned tags
+    """
+    grouped = dict()
+    for record in read(path):
+        grouped.setdefault((record['image'], record['dest']), []).append(record)
+
+    tasks = []
+    for (image, dest), records in grouped.items():
+        src_repo, name = utils.parse_repo_and_name(image)
+        dest_repo, dest_name = dest.rsplit('/', 1)
+        tags = [record['tag'] for record in records]
+        digests = {record['tag']: record.get('src_digest') for record in records}
+        tasks.append((image, dest_repo, (src_repo, name, dest_name, [(tag, 0) for tag in tags], tags, digests, None)))
+    return tasks
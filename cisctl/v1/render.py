@@ -27,8 +27,11 @@ class Render(object):
         pass
 
     def readme(self, images_list, src_org, src_repo, dest_repo: str, git_repo: str):
-        # for readme.md
-        in_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'template/README.md')
+        """ render README.md of git_repo
+
+        :param images_list: list of cisctl.v1.result.SyncResult
+        """
+        in_path = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'template/README.md')
         out_path = os.path.join(git_repo, 'README.md')
         with open(in_path, 'r') as in_file, open(out_path, 'w') as out_file:
             tmpl = Template(in_file.read())
@@ -0,0 +1,79 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""per-image sync result, returned by pool workers and rendered in README."""
+
+from typing import Dict
+from typing import List
+
+
+class SyncResult(object):
+    """ result of syncing one image
+
+    pickled as a plain tuple of its fields, so a pool worker sends it back to
+    the main process without a per-instance attribute dict
+    """
+
+    __slots__ = ('image', 'dest_name', 'tags', 'digests', 'copied', 'skipped', 'failed', 'size', 'seconds')
+
+    def __init__(self, image: str, dest_name: str, tags: List[str], digests: List[str] = None, copied: int = 0,
+                 skipped: int = 0, failed: int = 0, size: int = None, seconds: float = 0):
+        """
+        :param image: source image, e.g. k8s.gcr.io/pause
+        :param dest_name: dest image name, e.g. pause
+        :param tags: source tags sorted by timestamp asc
+        :param digests: manifest digest of each tag, None if unknown
+        :param copied: tags copied by this run
+        :param skipped: tags already synced, or synced by an interrupted run
+        :param failed: tags failed to copy
+        :param size: bytes of distinct source manifests, None if registry listing has no size
+        :param seconds: seconds taken to list and copy
+        """
+        self.image = image
+        self.dest_name = dest_name
+        self.tags = tags
+        self.digests = digests if digests is not None else [None] * len(tags)
+        self.copied = copied
+        self.skipped = skipped
+        self.failed = failed
+        self.size = size
+        self.seconds = seconds
+
+    def __reduce__(self):
+        return SyncResult, tuple(getattr(self, field) for field in self.__slots__)
+
+    def __eq__(self, other):
+        return isinstance(other, SyncResult) and self.as_dict() == other.as_dict()
+
+    def __repr__(self):
+        return f'SyncResult({self.image}, {self.dest_name}, tags={len(self.tags)}, copied={self.copied}, ' \
+               f'skipped={self.skipped}, failed={self.failed}, size={self.size})'
+
+    @property
+    def human_size(self) -> str:
+        """ e.g. 12.3 MB, `-` if size is unknown """
+        if not self.size:
+            return '-'
+        size = float(self.size)
+        for unit in ('B', 'KB', 'MB', 'GB'):
+            if size < 1024:
+                return f'{size:.1f} {unit}' if unit != 'B' else f'{int(size)} B'
+            size /= 1024
+        return f'{size:.1f} TB'
+
+    def as_dict(self) -> Dict:
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, value: Dict) -> 'SyncResult':
+        return cls(**{field: value[field] for field in cls.__slots__ if field in value})
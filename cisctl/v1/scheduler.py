@@ -0,0 +1,53 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""order images across sync workers, longest first.
+
+Pool workers take the next image from one shared task queue as soon as they are
+idle, so dispatching the most expensive images first (LPT scheduling) keeps a
+giant repository like kube-apiserver from starting last and running alone,
+ref https://en.wikipedia.org/wiki/Longest-processing-time-first_scheduling
+"""
+
+from typing import List
+from typing import Optional
+
+# relative cost of listing one source tag and copying one pending tag
+LIST_TAG_COST = 1
+COPY_TAG_COST = 20
+# cost of an image without any cached listing
+IMAGE_COST = 1
+
+
+def estimate_cost(src_tags: Optional[List[str]], dest_tags: Optional[List[str]]) -> Optional[float]:
+    """ estimate sync cost of one image from cached source and dest tags
+
+    :param src_tags: cached source tags, None if not cached
+    :param dest_tags: cached dest tags, None if not cached, then every source tag is pending
+    :return: cost, None if unknown
+    """
+    if src_tags is None:
+        return None
+    pending = set(src_tags) - set(dest_tags or [])
+    return IMAGE_COST + LIST_TAG_COST * len(src_tags) + COPY_TAG_COST * len(pending)
+
+
+def longest_first(costs: List[Optional[float]]) -> List[int]:
+    """ return indexes of images, most expensive first
+
+    images of unknown cost are scheduled with the most expensive ones, a first sync of a
+    repository is usually its longest, ties keep the list order
+    """
+    known = [cost for cost in costs if cost is not None]
+    unknown_cost = max(known) if known else 0
+    return sorted(range(len(costs)), key=lambda i: -(unknown_cost if costs[i] is None else costs[i]))
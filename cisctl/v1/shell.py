@@ -13,7 +13,11 @@
 
 import os
 
+from cisctl import blobcache
+from cisctl import cache
 from cisctl import config
+from cisctl import journal
+from cisctl import registry
 from cisctl import utils
 from cisctl.v1 import render
 from cisctl.v1 import sync
@@ -50,47 +54,219 @@ from cisctl.v1 import sync
 @utils.arg(
     '--git-repo', metavar='<str>', help='git repo',
     default="gcmirrors")
-@utils.arg(
-    '--src-image-list-url', metavar='<url>',
-    help='src image list url',
-    default="https://raw.githubusercontent.com/x-mirrors/gcr.io/main/registry.k8s.io/all-repos.txt")
 @utils.arg(
     '--thread-pool-size', dest='thread_pool_size', metavar='<integer>', type=int, default=2,
     help='thread pool size.')
 @utils.arg(
     '--dest-repo', metavar='<str>',
-    help='dest repo',
+    help='dest repos separated by comma, source of each image is read once for all of them.',
     default="")
 @utils.arg(
     '--job-batch-size', dest='job_batch_size', metavar='<integer>', type=int, default=3,
-    help='job batch size.')
+    help='deprecated and ignored, use --docker-api-rate-limit and --docker-push-rate-limit.')
+@utils.arg(
+    '--docker-api-rate-limit', dest='docker_api_rate_limit', metavar='<integer>', type=int, default=None,
+    help='docker hub api calls per minute, refilled from docker hub rate limit headers, 0 is unlimited.')
+@utils.arg(
+    '--docker-push-rate-limit', dest='docker_push_rate_limit', metavar='<integer>', type=int, default=None,
+    help='docker hub pushes per hour, 0 is unlimited.')
 @utils.arg(
     '--src-image-list-url', metavar='<url>',
-    help='src image list url',
+    help='src image list urls or local files, separated by comma, images in several lists are synced once.',
     default="https://raw.githubusercontent.com/x-mirrors/gcr.io/main/registry.k8s.io/all-repos.txt")
 @utils.arg(
     '--after-timeuploadedms', dest='after_timeuploadedms', metavar='<integer>', type=int, default=0,
     help='job batch size.')
+@utils.arg(
+    '--cache-path', metavar='<path>',
+    help='source and dest tags cache sqlite file, "none" disables the cache.',
+    default="")
+@utils.arg(
+    '--cache-ttl', dest='cache_ttl', metavar='<integer>', type=int, default=0,
+    help='tags cache time to live in second.')
+@utils.arg(
+    '--engine', metavar='<engine>', choices=[sync.ENGINE_PROCESS, sync.ENGINE_ASYNCIO],
+    help='sync engine, "process" runs a multiprocessing pool of --thread-pool-size, '
+         '"asyncio" runs images as coroutines in one process.',
+    default="")
+@utils.arg(
+    '--concurrency', dest='concurrency', metavar='<integer>', type=int, default=0,
+    help='max images listing in flight of asyncio engine.')
+@utils.arg(
+    '--copy-concurrency', dest='copy_concurrency', metavar='<integer>', type=int, default=0,
+    help='max skopeo copy in flight of asyncio engine.')
+@utils.arg(
+    '--copy-engine', metavar='<engine>', choices=[sync.COPY_ENGINE_SKOPEO, sync.COPY_ENGINE_NATIVE],
+    help='copy engine, "skopeo" runs skopeo copy per tag, "native" copies with the registry api '
+         'and mounts blobs across repositories of the dest namespace.',
+    default="")
+@utils.arg(
+    '--adaptive-concurrency', action='store_true',
+    help='raise listings and copies in flight per registry host while responses are healthy, '
+         'cut them on 429 / 5xx, --thread-pool-size and --copy-concurrency grow to ADAPTIVE_MAX.',
+    default=False)
+@utils.arg(
+    '--blob-cache-path', metavar='<path>',
+    help='OCI layout directory native copy engine downloads blobs to and pushes them from, '
+         'each blob is fetched from source once.',
+    default="")
+@utils.arg(
+    '--blob-cache-max-bytes', dest='blob_cache_max_bytes', metavar='<integer>', type=int, default=0,
+    help='byte budget of blob cache, least recently read blobs are evicted.')
+@utils.arg(
+    '--journal-path', metavar='<path>',
+    help='journal of planned and copied tags, "none" disables it.',
+    default="")
+@utils.arg(
+    '--resume', action='store_true',
+    help='continue the interrupted run recorded in journal, skip images it already synced.',
+    default=False)
+@utils.arg(
+    '--metrics-textfile', metavar='<path>',
+    help='write run metrics as prometheus textfile, e.g. /var/lib/node_exporter/cisctl.prom.',
+    default="")
+@utils.arg(
+    '--metrics-json', metavar='<path>',
+    help='write run metrics as json, with per image durations.',
+    default="")
+@utils.arg(
+    '--profile', dest='profile_path', metavar='<path>',
+    help='cProfile main process and every pool worker, write merged pstats to path and top functions to path.txt.',
+    default="")
+@utils.arg(
+    '--profile-top', dest='profile_top', metavar='<integer>', type=int, default=0,
+    help='functions listed in profile summary.')
+@utils.arg(
+    '--plan-file', metavar='<path>',
+    help='copy the tags of a plan written by `cisctl plan` as given, without listing, '
+         'README is not rendered.',
+    default="")
 def do_sync(args):
     """sync Container Images."""
     # 1. do sync
+    _cache = _tags_cache(args)
+
+    _copy_engine = args.copy_engine if args.copy_engine else config.COPY_ENGINE
+
+    _journal_path = args.journal_path if args.journal_path else config.JOURNAL_PATH
+    _journal = None
+    if _journal_path and _journal_path != 'none':
+        _journal = journal.Journal(path=_journal_path)
+
+    _blob_cache_path = args.blob_cache_path if args.blob_cache_path else config.BLOB_CACHE_PATH
+    _blob_cache = None
+    if _blob_cache_path and _blob_cache_path != 'none':
+        _blob_cache = blobcache.BlobCache(
+            path=_blob_cache_path,
+            max_bytes=args.blob_cache_max_bytes if args.blob_cache_max_bytes else config.BLOB_CACHE_MAX_BYTES)
+
     _cis = sync.CIS(
         src_transport=args.src_transport if args.src_transport else os.environ.get('SRC_TRANSPORT', 'docker'),
         dest_transport=args.dest_transport if args.dest_transport else os.environ.get('DEST_TRANSPORT', 'docker'),
-        after_timeuploadedms=args.after_timeuploadedms if args.after_timeuploadedms else int(os.environ.get('AFTER_TIMEUPLOADEDMS', 0)))
+        after_timeuploadedms=args.after_timeuploadedms if args.after_timeuploadedms else int(os.environ.get('AFTER_TIMEUPLOADEDMS', 0)),
+        cache=_cache,
+        copy_engine=_copy_engine,
+        journal=_journal,
+        blob_cache=_blob_cache)
 
     _git_repo=args.git_repo if args.git_repo else os.environ.get('GIT_REPO', 'gcmirrors')
     _dest_repo = args.dest_repo if args.dest_repo else os.environ.get('DEST_REPO', f'docker.io/{_git_repo}')
 
+    # the first dest repo, others log in with auth files of `skopeo login`
+    _first_dest_repo = utils.parse_dest_repos(_dest_repo)[0]
+    if _copy_engine == sync.COPY_ENGINE_NATIVE and os.environ.get('DEST_TRANSPORT_USER'):
+        registry.Registry(_first_dest_repo.split('/')[0]).set_credentials(
+            os.environ.get('DEST_TRANSPORT_USER'), os.environ.get('DEST_TRANSPORT_PASSWORD'))
+
     result_images_list, src_org, src_repo = _cis.do_sync(
         src_image_list_url=args.src_image_list_url if args.src_image_list_url else os.environ.get(
             'SRC_IMAGE_LIST_URL', 'https://raw.githubusercontent.com/x-mirrors/gcr.io/main/registry.k8s.io/all-repos.txt'),
         thread_pool_size=args.thread_pool_size if args.thread_pool_size else int(os.environ.get('THREAD_POOL_NUM', 2)),
         dest_repo=_dest_repo,
-        job_batch_size=args.job_batch_size if args.job_batch_size else int(os.environ.get('JOB_BATCH_COUNT', 3)),  # Only work when source is docker, because https://docs.docker.com/docker-hub/api/latest/#tag/rate-limiting
         debug=True if args.debug == 'DEBUG' else os.environ.get('LOG_LEVEL', False),
+        docker_api_rate_limit=args.docker_api_rate_limit if args.docker_api_rate_limit is not None else config.DOCKER_HUB_API_RATE_LIMIT,
+        docker_push_rate_limit=args.docker_push_rate_limit if args.docker_push_rate_limit is not None else config.DOCKER_HUB_PUSH_RATE_LIMIT,
+        engine=args.engine if args.engine else os.environ.get('ENGINE', sync.ENGINE_PROCESS),
+        concurrency=args.concurrency if args.concurrency else config.CONCURRENCY,
+        copy_concurrency=args.copy_concurrency if args.copy_concurrency else config.COPY_CONCURRENCY,
+        resume=args.resume or os.environ.get('RESUME', 'false').lower() == 'true',
+        metrics_textfile=args.metrics_textfile if args.metrics_textfile else config.METRICS_TEXTFILE,
+        metrics_json=args.metrics_json if args.metrics_json else config.METRICS_JSON,
+        profile_path=args.profile_path if args.profile_path else config.PROFILE_PATH,
+        profile_top=args.profile_top if args.profile_top else config.PROFILE_TOP,
+        plan_file=args.plan_file,
+        adaptive_concurrency=args.adaptive_concurrency or config.ADAPTIVE_CONCURRENCY,
     )
 
+    if src_org is None:
+        return
+
     # 2. render readme
     _render = render.Render()
-    _render.readme(result_images_list, src_org, src_repo, dest_repo=_dest_repo, git_repo=_git_repo)
+    _render.readme(result_images_list, src_org, src_repo, dest_repo=_first_dest_repo, git_repo=_git_repo)
+
+
+def _tags_cache(args):
+    _cache_path = args.cache_path if args.cache_path else config.CACHE_PATH
+    if _cache_path and _cache_path != 'none':
+        return cache.TagCache(path=_cache_path, ttl=args.cache_ttl if args.cache_ttl else config.CACHE_TTL)
+    return None
+
+
+@utils.arg(
+    '--src-transport', metavar='<str>',
+    help='src transport',
+    default="")
+@utils.arg(
+    '--dest-transport', metavar='<str>',
+    help='dest transport',
+    default="")
+@utils.arg(
+    '--git-repo', metavar='<str>', help='git repo',
+    default="gcmirrors")
+@utils.arg(
+    '--src-image-list-url', metavar='<url>',
+    help='src image list urls or local files, separated by comma, images in several lists are planned once.',
+    default="https://raw.githubusercontent.com/x-mirrors/gcr.io/main/registry.k8s.io/all-repos.txt")
+@utils.arg(
+    '--dest-repo', metavar='<str>',
+    help='dest repos separated by comma, source of each image is read once for all of them.',
+    default="")
+@utils.arg(
+    '--docker-api-rate-limit', dest='docker_api_rate_limit', metavar='<integer>', type=int, default=None,
+    help='docker hub api calls per minute, refilled from docker hub rate limit headers, 0 is unlimited.')
+@utils.arg(
+    '--after-timeuploadedms', dest='after_timeuploadedms', metavar='<integer>', type=int, default=0,
+    help='only plan source tags uploaded after this millisecond timestamp.')
+@utils.arg(
+    '--cache-path', metavar='<path>',
+    help='source and dest tags cache sqlite file, "none" disables the cache.',
+    default="")
+@utils.arg(
+    '--cache-ttl', dest='cache_ttl', metavar='<integer>', type=int, default=0,
+    help='tags cache time to live in second.')
+@utils.arg(
+    '--concurrency', dest='concurrency', metavar='<integer>', type=int, default=0,
+    help='max images listing in flight.')
+@utils.arg(
+    '--plan-file', metavar='<path>',
+    help='ndjson plan of (image, dest, tag, reason, src_digest, dest_digest), json array if it ends with .json, '
+         '"-" is stdout, logs then go to stderr.',
+    default="-")
+def do_plan(args):
+    """list source and mirror of all images, write the tags sync would copy, copy nothing."""
+    _cis = sync.CIS(
+        src_transport=args.src_transport if args.src_transport else os.environ.get('SRC_TRANSPORT', 'docker'),
+        dest_transport=args.dest_transport if args.dest_transport else os.environ.get('DEST_TRANSPORT', 'docker'),
+        after_timeuploadedms=args.after_timeuploadedms if args.after_timeuploadedms else int(os.environ.get('AFTER_TIMEUPLOADEDMS', 0)),
+        cache=_tags_cache(args))
+
+    _git_repo = args.git_repo if args.git_repo else os.environ.get('GIT_REPO', 'gcmirrors')
+    _cis.do_plan(
+        src_image_list_url=args.src_image_list_url if args.src_image_list_url else os.environ.get(
+            'SRC_IMAGE_LIST_URL', 'https://raw.githubusercontent.com/x-mirrors/gcr.io/main/registry.k8s.io/all-repos.txt'),
+        dest_repo=args.dest_repo if args.dest_repo else os.environ.get('DEST_REPO', f'docker.io/{_git_repo}'),
+        plan_file=args.plan_file,
+        concurrency=args.concurrency if args.concurrency else config.CONCURRENCY,
+        docker_api_rate_limit=args.docker_api_rate_limit if args.docker_api_rate_limit is not None else config.DOCKER_HUB_API_RATE_LIMIT,
+    )
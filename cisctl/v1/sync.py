@@ -13,56 +13,206 @@
 
 """sync containers image from one register to others."""
 
+import collections
 import os
 import time
-
+from concurrent.futures import ThreadPoolExecutor
 from multiprocessing import Pool
-
-from cisctl import client, config
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from cisctl import adaptive
+from cisctl import config
+from cisctl import imagelist
+from cisctl import metrics
+from cisctl import profiling
+from cisctl import ratelimit
 from cisctl import utils
+from cisctl.api import RegisterBaseAPIV2
 from cisctl.api.docker import DockerV2
 from cisctl.api.gcr import GoogleContainerRegisterV2
 from cisctl.api.k8s import K8sRegister
+from cisctl.api.oci import OCIRegisterV2
 from cisctl.api.quay import QuayRegisterV2
+from cisctl.blobcache import BlobCache
+from cisctl.cache import TagCache
+from cisctl.copier import Copier
+from cisctl.journal import Journal
+from cisctl.logger import log_to_stderr
 from cisctl.logger import logger
 from cisctl.skopeo import Skopeo
+from cisctl.verify import DigestVerifier
+from cisctl.v1 import aio
+from cisctl.v1 import plan
+from cisctl.v1 import scheduler
+from cisctl.v1.result import SyncResult
+
+# one day, tolerate clock skew between source and dest registry
+DEST_TAGS_SINCE_MARGIN_MS = 24 * 3600 * 1000
+
+ENGINE_PROCESS = 'process'
+ENGINE_ASYNCIO = 'asyncio'
+
+COPY_ENGINE_SKOPEO = 'skopeo'
+COPY_ENGINE_NATIVE = 'native'
+
+# source registry to its api url, benchmarks point them at local stand-in registries
+SOURCE_REGISTRY_URLS = {
+    'gcr.io': 'https://gcr.io',
+    'k8s.gcr.io': 'https://k8s.gcr.io',
+    'quay.io': 'https://quay.io',
+    'registry.k8s.io': 'https://registry.k8s.io',
+}
+
+
+# CIS of this pool worker, set once by _init_worker()
+_worker_cis = None
+
+
+def _init_worker(ratelimit_state, adaptive_state, cis=None):
+    """ multiprocessing.Pool initializer, share rate limit buckets and adaptive limits of parent
+
+    :param cis: CIS run by _sync_image_task() of this worker, its registry clients, tag cache connection,
+        blob locations and verified digests are kept for all images the worker syncs
+    """
+    global _worker_cis
+    ratelimit.install(*ratelimit_state)
+    adaptive.install(*adaptive_state)
+    _worker_cis = cis
+
+
+def _sync_image_task(image: str, dest_repos: List[str], planned: Tuple = None) -> (List, Dict):
+    """ CIS.sync_image_task() of the CIS of this pool worker, tasks do not carry a copy of it """
+    return _worker_cis.sync_image_task(image, dest_repos, planned)
+
+
+def _normalize_image(image: str) -> str:
+    """ gcr.io/google-containers is moved to k8s.gcr.io """
+    if image.startswith('gcr.io/google-containers'):
+        return image.replace('gcr.io/google-containers', 'k8s.gcr.io')
+    return image
 
 
 class CIS(object):
     """sync Container Images."""
-    def __init__(self, src_transport: str, dest_transport: str, after_timeuploadedms: int = 0):
+    def __init__(self, src_transport: str, dest_transport: str, after_timeuploadedms: int = 0,
+                 cache: TagCache = None, copy_engine: str = config.COPY_ENGINE,
+                 sync_batch: bool = config.SKOPEO_SYNC_BATCH, verify_digest: bool = config.VERIFY_DIGEST,
+                 journal: Journal = None, blob_cache: BlobCache = None):
+        """
+        :param cache: source and dest tags cache shared by pool workers, None is no cache
+        :param copy_engine: `skopeo` runs skopeo copy per tag,
+            `native` copies with the registry api and cross-repository blob mount, only for docker transport
+        :param sync_batch: skopeo engine copies all tags of one image with one skopeo sync
+        :param verify_digest: HEAD source and dest manifest of tags already in dest, skip copy if digests match
+        :param journal: record planned and copied tags, None is no journal
+        :param blob_cache: local stage of blobs copied by native copy engine, None is no cache
+        """
+        self._cache = cache
+        self._journal = journal
+        # {(image, dest image): journal.ImageState} of the interrupted run
+        self._resume = dict()
         self._skopeo = Skopeo()
-        self._docker = DockerV2()
-        self._source_registry = None
+        self._copier = Copier(cache=cache, blob_cache=blob_cache)
+        self.copy_engine = copy_engine
+        self.sync_batch = sync_batch
+        self._docker = DockerV2(cache=cache)
+        # {dest registry host: OCIRegisterV2} of dest registries other than Docker Hub
+        self._dest_registries = dict()
+        # {(registry_url, repo): RegisterBaseAPIV2}
+        self._source_registries = dict()
 
         self.src_transport = src_transport
         self.dest_transport = dest_transport
         self.after_timeuploadedms = after_timeuploadedms
 
+        self.verify_digest = verify_digest
+        # skopeo copy pushes one platform of a manifest list
+        self._verifier = DigestVerifier(all_platforms=self.native_copy and self._copier.all_platforms)
+
     def init_source_registry_api(self, registry_url, repo=None):
-        """ init source registry api
+        """ return source registry api of (registry_url, repo), each one is built once per worker
 
-        :param registry_url: k8s.gcr.io or gcr.io or quay.io
+        :param registry_url: k8s.gcr.io or gcr.io or quay.io, or any registry host, e.g. ghcr.io
         :param repo: is google cloud project
             - None : k8s.gcr.io/pause
             - ingress-nginx : k8s.gcr.io/ingress-nginx/controller
             - ml-pipeline : gcr.io/ml-pipeline/api-server
             - metallb : quay.io/metallb/controller
             - knative-releases/knative.dev/eventing/cmd : gcr.io/knative-releases/knative.dev/eventing/cmd/webhook
-        :return: None
+        :return: RegisterBaseAPIV2, None if registry_url is not a registry host
         """
-        if self._source_registry is None:
+        key = (registry_url, repo)
+        if key not in self._source_registries:
+            source_registry = None
             if registry_url.startswith('gcr.io'):
-                self._source_registry = GoogleContainerRegisterV2(registry_url='https://gcr.io', project=repo)
+                source_registry = GoogleContainerRegisterV2(
+                    registry_url=SOURCE_REGISTRY_URLS['gcr.io'], project=repo, cache=self._cache)
             elif registry_url.startswith('k8s.gcr.io'):
-                self._source_registry = GoogleContainerRegisterV2(registry_url='https://k8s.gcr.io', project=repo)
+                source_registry = GoogleContainerRegisterV2(
+                    registry_url=SOURCE_REGISTRY_URLS['k8s.gcr.io'], project=repo, cache=self._cache)
             elif registry_url.startswith('quay.io'):
-                self._source_registry = QuayRegisterV2(registry_url='https://quay.io', repo=repo)
+                source_registry = QuayRegisterV2(
+                    registry_url=SOURCE_REGISTRY_URLS['quay.io'], repo=repo, cache=self._cache)
             elif registry_url.startswith('registry.k8s.io'):
-                self._source_registry = K8sRegister(registry_url='https://registry.k8s.io', project=repo)
+                source_registry = K8sRegister(
+                    registry_url=SOURCE_REGISTRY_URLS['registry.k8s.io'], project=repo, cache=self._cache)
+            elif '.' in registry_url or ':' in registry_url or registry_url == 'localhost':
+                # any other registry, e.g. ghcr.io, public.ecr.aws, docker.io, with the distribution api.
+                # created time of config blobs is only read when tags older than after_timeuploadedms are skipped
+                source_registry = OCIRegisterV2(
+                    registry_url, project=repo, cache=self._cache, digests=True,
+                    timestamps=self.after_timeuploadedms > 0)
+            self._source_registries[key] = source_registry
+        return self._source_registries[key]
+
+    def dest_api(self, dest_repo: str) -> RegisterBaseAPIV2:
+        """ dest registry api of dest_repo, Docker Hub is listed with its tags api, others with tags/list
+
+        :param dest_repo: e.g. docker.io/gcmirrors, registry.cn-hangzhou.aliyuncs.com/gcmirrors
+        """
+        host = dest_repo.split('/')[0]
+        if host in ratelimit.DOCKER_HUB_REGISTRY_HOSTS:
+            return self._docker
+        if host not in self._dest_registries:
+            self._dest_registries[host] = OCIRegisterV2(host, cache=self._cache)
+        return self._dest_registries[host]
+
+    @property
+    def native_copy(self) -> bool:
+        """ native copy engine only speaks the registry api, other transports fall back to skopeo """
+        return self.copy_engine == COPY_ENGINE_NATIVE and \
+            self.src_transport == 'docker' and self.dest_transport == 'docker'
+
+    def batch_copy(self, name: str, dest_name: str, tags: List[str]) -> bool:
+        """ whether tags are copied with one skopeo sync, which always pushes to {dest_repo}/{name} """
+        return self.sync_batch and not self.native_copy and len(tags) > 1 and dest_name == name and \
+            self.src_transport == 'docker' and self.dest_transport == 'docker'
+
+    def estimate_cost(self, image: str, dest_repo: str) -> Optional[float]:
+        """ estimate sync cost of image from cached source and dest tags, ref scheduler.estimate_cost()
+
+        :return: cost, None if source tags are not cached
+        """
+        if self._cache is None:
+            return None
+        src_repo, name = utils.parse_repo_and_name(image)
+        dest_name = utils.generate_dest_name(src_repo, name)
+        source_registry = self.init_source_registry_api(*utils.parse_registry_url_and_project(src_repo))
+        if source_registry is None:
+            return None
 
-    def sync_image(self, image: str, dest_repo: str):
-        """ sync image
+        src_value = self._cache.get(source_registry.cache_key(name))
+        dest_value = self._cache.get(self.dest_api(dest_repo).cache_key(f'{dest_repo}/{dest_name}'))
+        return scheduler.estimate_cost(
+            [tag for (tag, _) in src_value['tags']] if src_value else None,
+            [tag for (tag, _) in dest_value['tags']] if dest_value else None)
+
+    def plan_image(self, image: str, dest_repo: str, source: Tuple = None) \
+            -> (str, str, str, List[Tuple[str, int]], List[str], Dict[str, str], Optional[int]):
+        """ list source and dest tags of image, and decide which tags need to copy
 
         :param image: one of
         - k8s.gcr.io/pause
@@ -71,147 +221,537 @@ class CIS(object):
         - gcr.io/knative-releases/knative.dev/eventing/cmd/webhook
         - registry.k8s.io/addon-builder
         :param dest_repo(str): e.g. docker.io/gcmirrors
+        :param source: list_source() of image, listed if None
+        :return (src_repo, name, dest_name, src_sort_tags, copy_tags, digests, size)
+            src_sort_tags is source tags sorted by timestamp asc, copy_tags is tags need to copy,
+            digests is source tag to manifest digest, size is bytes of distinct source manifests or None
+        """
+        return self._plan_image(image, dest_repo, source)[0]
+
+    def list_source(self, image: str) -> Optional[Tuple[List[Tuple[str, int]], Dict[str, str], Optional[int]]]:
+        """ list source tags of image, plans of several dest repos share it
+
+        :param image: ref plan_image()
+        :return: (src_sort_tags, digests, size) ref plan_image(), None if source registry is not supported
         """
-        logger.debug(f'Begin to sync image: [{image}], sub pid is [{os.getpid()}]')
         src_repo, name = utils.parse_repo_and_name(image)
-        dest_name = utils.generate_dest_name(src_repo, name)
         if '/' in src_repo:
             registry_url, repo = utils.parse_registry_url_and_project(src_repo)
-            self.init_source_registry_api(registry_url, repo)
+            source_registry = self.init_source_registry_api(registry_url, repo)
         else:
-            self.init_source_registry_api(src_repo)
-
-        _, src_sort_tags, src_tag_digest_dict = self._source_registry.sort_tags(name)
+            source_registry = self.init_source_registry_api(src_repo)
+        if source_registry is None:
+            logger.warning(f'sync image {image}, source registry {src_repo} is not supported, skip.')
+            return None
+
+        with metrics.timer('list_source', src_repo.split('/')[0], f'{src_repo}/{name}'), \
+                adaptive.slot(adaptive.LIST, src_repo):
+            _, src_sort_tags, src_tag_digest_dict = source_registry.cached_sort_tags(name)
         src_sort_tags.reverse()
+        # tags of one digest are counted once
+        sizes = source_registry.pop_tag_sizes(name)
+        size = sum({src_tag_digest_dict.get(tag, tag): b for tag, b in sizes.items()}.values()) or None
+        return src_sort_tags, src_tag_digest_dict, size
 
+    def _plan_image(self, image: str, dest_repo: str, source: Tuple = None) -> (Tuple, Dict[str, str]):
+        """ plan_image(), also return {tag: digest or None} of dest tags listed """
+        logger.debug(f'Begin to sync image: [{image}], sub pid is [{os.getpid()}]')
+        src_repo, name = utils.parse_repo_and_name(image)
+        dest_name = utils.generate_dest_name(src_repo, name)
+        if source is None:
+            source = self.list_source(image)
+        if source is None:
+            return (src_repo, name, dest_name, [], [], {}, None), {}
+        src_sort_tags, src_tag_digest_dict, size = source
+
+        image_key = f'{src_repo}/{name}'
+
+        # a synced tag is always pushed after its source is uploaded, so dest tags pushed
+        # before the oldest source tag (minus clock skew margin) need not be listed
+        since = min([int(_timestamp) for (_, _timestamp) in src_sort_tags] or [0]) - DEST_TAGS_SINCE_MARGIN_MS
         target_image_name = f'{dest_repo}/{dest_name}'
-        result, synced_tags_with_timestamp, synced_tag_digest_dict = \
-            self._docker.sort_tags(target_image_name)
-        last_tag, last_timestamp = self._docker.last_tag(target_image_name, synced_tags_with_timestamp)
+        dest_api = self.dest_api(dest_repo)
+        with metrics.timer('list_dest', dest_repo.split('/')[0], image_key), adaptive.slot(adaptive.LIST, dest_repo):
+            result, synced_tags_with_timestamp, synced_tag_digest_dict = \
+                dest_api.cached_sort_tags(target_image_name, since=since if since > 0 else None)
+        last_tag, last_timestamp = dest_api.last_tag(target_image_name, synced_tags_with_timestamp)
 
         # call docker api occur exception, skip sync
         if result is False and last_tag is None and last_timestamp is None:
             logger.warning(f'sync image {image}, docker api limit, exist.')
-            # the result is need to sync
-            return f'{"@@".join([_tag for (_tag, _) in src_sort_tags])}@@@{dest_name}'
-
-        do_sync_flag = False
-        next_do_sync_flag = False
-        if last_tag is None:  # never synced
-            do_sync_flag = True
-        synced_flag = False
+            return (src_repo, name, dest_name, src_sort_tags, [], src_tag_digest_dict, size), {}
+
         synced_tags = {k for k, _ in synced_tags_with_timestamp}
-        for (src_tag, src_uploaded_timestamp) in src_sort_tags:
-            src_tag_digest = src_tag_digest_dict.get(src_tag)
-            synced_tag_digest = synced_tag_digest_dict.get(src_tag)
-
-            if do_sync_flag is False and int(src_uploaded_timestamp) > self.after_timeuploadedms:
-                # check already synced flag
-                if synced_flag is False and src_tag != 'latest' and src_tag in synced_tags:
-                    synced_flag = True
-
-                # if oldest tag is sync and new tag not in synced_tags, do sync
-                # fix some tag not sync bug
-                if synced_flag is True and src_tag not in synced_tags:
-                    do_sync_flag = True
-
-                # if src_uploaded_timestamp > last_timestamp: src is update, do sync
-                if last_timestamp is not None and int(src_uploaded_timestamp) > int(last_timestamp):
-                    do_sync_flag = True
-
-                # already synced but image digest is not match, do sync again
-                # TODO: xiexianbin, not fix https://www.xiexianbin.cn/container/tools/skopeo/#fq
-                # if synced_flag is True and src_tag_digest is not None \
-                #         and synced_tag_digest is not None \
-                #         and src_tag_digest != synced_tag_digest:
-                #     do_sync_flag = True
-
-                # update do_sync_flag to True
-                if src_tag == 'latest' or next_do_sync_flag is True:
-                    do_sync_flag = True
-
-                # find last synced image tag, update next_do_sync_flag to True
-                if src_tag == last_tag:
-                    next_do_sync_flag = True
-
-            # skip condition: already synced tags
-            if do_sync_flag is False:
-                continue
-            if do_sync_flag is True and src_tag_digest is not None \
-                    and synced_tag_digest is not None \
-                    and src_tag_digest == synced_tag_digest:
+        # e.g. OCI source listed without config timestamps
+        src_untimed = not any(int(_timestamp) for (_, _timestamp) in src_sort_tags)
+        copy_tags = []
+        if (not dest_api.has_timestamps or src_untimed) and last_tag is not None:
+            # dest or source listing has no push time, copy tags missing in dest,
+            # verify_tags() checks digest of the others
+            copy_tags = [src_tag for (src_tag, src_uploaded_timestamp) in src_sort_tags if src_tag == 'latest' or
+                         (src_tag not in synced_tags and
+                          (src_untimed or int(src_uploaded_timestamp) > self.after_timeuploadedms))]
+        else:
+            do_sync_flag = False
+            next_do_sync_flag = False
+            if last_tag is None:  # never synced
+                do_sync_flag = True
+            synced_flag = False
+            for (src_tag, src_uploaded_timestamp) in src_sort_tags:
+                src_tag_digest = src_tag_digest_dict.get(src_tag)
+                synced_tag_digest = synced_tag_digest_dict.get(src_tag)
+
+                if do_sync_flag is False and int(src_uploaded_timestamp) > self.after_timeuploadedms:
+                    # check already synced flag
+                    if synced_flag is False and src_tag != 'latest' and src_tag in synced_tags:
+                        synced_flag = True
+
+                    # if oldest tag is sync and new tag not in synced_tags, do sync
+                    # fix some tag not sync bug
+                    if synced_flag is True and src_tag not in synced_tags:
+                        do_sync_flag = True
+
+                    # if src_uploaded_timestamp > last_timestamp: src is update, do sync
+                    if last_timestamp is not None and int(src_uploaded_timestamp) > int(last_timestamp):
+                        do_sync_flag = True
+
+                    # already synced but image digest is not match is checked by verify_tags()
+
+                    # update do_sync_flag to True
+                    if src_tag == 'latest' or next_do_sync_flag is True:
+                        do_sync_flag = True
+
+                    # find last synced image tag, update next_do_sync_flag to True
+                    if src_tag == last_tag:
+                        next_do_sync_flag = True
+
+                # skip condition: already synced tags
+                if do_sync_flag is False:
+                    continue
+                if do_sync_flag is True and src_tag_digest is not None \
+                        and synced_tag_digest is not None \
+                        and src_tag_digest == synced_tag_digest:
+                    continue
+
+                copy_tags.append(src_tag)
+
+        metrics.inc('tags_total', len(src_sort_tags) - len(copy_tags), result='skipped')
+        with metrics.timer('verify', dest_repo.split('/')[0], image_key):
+            copy_tags = self.verify_tags(src_repo, name, target_image_name, copy_tags, synced_tags)
+        dest_digests = {tag: synced_tag_digest_dict.get(tag) for tag in synced_tags}
+        return (src_repo, name, dest_name, src_sort_tags, copy_tags, src_tag_digest_dict, size), dest_digests
+
+    def plan_tags(self, image: str, dest_repo: str, source: Tuple = None) -> List[Dict]:
+        """ plan records of tags need to copy, ref cisctl.v1.plan """
+        return plan.entries(dest_repo, *self._plan_image(image, dest_repo, source))
+
+    def verify_tags(self, src_repo: str, name: str, dest_image: str, tags: List[str], synced_tags) -> List[str]:
+        """ drop tags whose dest manifest digest already matches source, e.g. unchanged `latest`
+
+        :param dest_image: docker.io/gcmirrors/pause
+        :param tags: tags planned to copy
+        :param synced_tags: tags exist in dest, others need copy without checking
+        :return: tags need to copy
+        """
+        if not self.verify_digest or self.src_transport != 'docker' or self.dest_transport != 'docker':
+            return tags
+
+        copy_tags = []
+        for tag in tags:
+            if tag in synced_tags and self._verifier.unchanged(f'{src_repo}/{name}', dest_image, tag):
+                logger.debug(f'{dest_image}:{tag} digest matches {src_repo}/{name}:{tag}, skip copy')
+                metrics.inc('tags_total', result='unchanged')
                 continue
-
-            self._skopeo.copy(
+            copy_tags.append(tag)
+        return copy_tags
+
+    def copy_tag(self, src_repo: str, name: str, dest_repo: str, dest_name: str, tag: str) -> bool:
+        """ copy one tag of image to dest repo, docker hub pushes take a token from rate limiter """
+        if dest_repo.startswith('docker.io'):
+            ratelimit.acquire(ratelimit.DOCKER_HUB_PUSH)
+        with adaptive.slot(adaptive.COPY, dest_repo):
+            if self.native_copy:
+                return self._copier.copy(f'{src_repo}/{name}', f'{dest_repo}/{dest_name}', tag)
+            return self._skopeo.copy(
                 src_repo=src_repo,
                 dest_repo=dest_repo,
                 name=name,
-                tag=src_tag,
+                tag=tag,
                 dest_name=dest_name,
                 src_transport=self.src_transport,
                 dest_transport=self.dest_transport)
 
-        return f'{"@@".join([_tag for (_tag, _) in src_sort_tags])}@@@{dest_name}'
-
-    def do_sync(self, src_image_list_url: str, thread_pool_size: int,
-                dest_repo: str, job_batch_size: int, debug: bool):
-        headers = {
-            'Content-Type': 'application/text'
-        }
-        result, resp = client.http_get(url=src_image_list_url, headers=headers)
-        _target_images_list = resp.split('\n')
-        target_images_list = []
-        for image in _target_images_list:
-            image = image.replace('\n', '')
-            # skip empty and '#" image
-            if image == '' or image.startswith("#"):
-                continue
-            target_images_list.append(image)
-        result_images_list = []
-
-        logger.info(f'init multiprocessing pool, main pid is [{os.getpid()}]')
-        p = Pool(thread_pool_size)
-        subprocess_result = []
-
-        # fix Docker API Rate Limiting
-        if len(target_images_list) > 180 and dest_repo.startswith("docker.io"):
-            interval_hour = 24 / job_batch_size
-            batch_num = int(time.localtime().tm_hour / interval_hour)
-            images_count_per_job = int(len(target_images_list) / job_batch_size) + 1
-
-            start_index = batch_num * images_count_per_job
-            end_index = (batch_num + 1) * images_count_per_job - 1
-            target_images_list = target_images_list[start_index:end_index+1]
-            logger.info(
-                f'BATCH Jobs matched, start_index is {start_index}, end_index is {end_index}, '
-                f'JOB_BATCH_COUNT is {job_batch_size}, batch_num is {batch_num}, '
-                f'images_count_per_job is {images_count_per_job}, begin to sync image size '
-                f'is {len(target_images_list)}')
-
-        for image in target_images_list:
-            if image.startswith('gcr.io/google-containers'):
-                image = image.replace('gcr.io/google-containers', 'k8s.gcr.io')
-            subprocess_result.append(p.apply_async(self.sync_image, args=(image, dest_repo,)))
-
-        for result in subprocess_result:
-            r = result.get()
-            r = r.split('@@@')
-            if len(r) != 2:
-                continue
+    def copy_tags(self, src_repo: str, name: str, dest_repo: str, dest_name: str, tags: List[str],
+                  digests: Dict[str, str] = None) -> Dict[str, bool]:
+        """ copy tags of image to dest repo, each result is journaled
 
-            src_image_tags = r[0].split('@@')
+        :param digests: source tag to manifest digest, recorded in journal
+        :return: {tag: True if success}
+        """
+        with metrics.timer('copy', dest_repo.split('/')[0], f'{src_repo}/{name}'):
+            return self._copy_tags(src_repo, name, dest_repo, dest_name, tags, digests)
+
+    def _copy_tags(self, src_repo, name, dest_repo, dest_name, tags, digests) -> Dict[str, bool]:
+        if not self.batch_copy(name, dest_name, tags):
+            results = dict()
+            for tag in tags:
+                results[tag] = self.copy_tag(src_repo, name, dest_repo, dest_name, tag)
+                self.record_copy(src_repo, name, dest_repo, dest_name, tag, (digests or {}).get(tag), results[tag])
+            return results
+
+        if dest_repo.startswith('docker.io'):
+            for _ in tags:
+                ratelimit.acquire(ratelimit.DOCKER_HUB_PUSH)
+        with adaptive.slot(adaptive.COPY, dest_repo):
+            results = self._skopeo.sync(
+                src_repo=src_repo,
+                dest_repo=dest_repo,
+                name=name,
+                src_transport=self.src_transport,
+                dest_transport=self.dest_transport,
+                tags=tags)
+        failed = [tag for tag, ok in results.items() if not ok]
+        if failed:
+            logger.error(f'skopeo sync {src_repo}/{name} to {dest_repo} failed tags: {failed}')
+        for tag, ok in results.items():
+            self.record_copy(src_repo, name, dest_repo, dest_name, tag, (digests or {}).get(tag), ok)
+        return results
+
+    @staticmethod
+    def journal_key(image: str, dest_repo: str) -> (str, str):
+        """ (image, dest image) key of journal records """
+        src_repo, name = utils.parse_repo_and_name(image)
+        return f'{src_repo}/{name}', f'{dest_repo}/{utils.generate_dest_name(src_repo, name)}'
 
-            result_images_list.append({
-                'name': r[1],
-                'tags': src_image_tags,
-                'tags_count': len(src_image_tags),
-                'total_size': '-',
-                'date': utils.now()})
+    def resume(self) -> Dict[Tuple[str, str], SyncResult]:
+        """ load journal of the interrupted run, sync_image() continues unfinished images from it
 
-        p.close()
-        p.join()
-        logger.info('All subprocess done.')
+        :return: {journal key: sync_image() result} of images already done
+        """
+        if self._journal is None:
+            return {}
+        states = self._journal.replay()
+        done = {key: SyncResult.from_dict(state.result) for key, state in states.items()
+                if isinstance(state.result, dict)}
+        # only unfinished states are pickled to pool workers with self
+        self._resume = {key: state for key, state in states.items() if key not in done}
+        logger.info(f'resume from journal {self._journal.path}, {len(done)} images done, '
+                    f'{len(self._resume)} images unfinished')
+        return done
+
+    def resume_or_plan(self, image: str, dest_repo: str, planned: Tuple = None, source: Tuple = None) \
+            -> Tuple[str, str, str, List[Tuple[str, int]], List[str], Dict[str, str], Optional[int]]:
+        """ plan image, or continue the plan journaled by an interrupted run
+
+        :param planned: plan read from plan file, used instead of listing
+        :param source: ref plan_image()
+        :return: plan ref plan_image(), copy_tags of a resumed plan are the tags not copied yet
+        """
+        src_repo, name = utils.parse_repo_and_name(image)
+        dest_name = utils.generate_dest_name(src_repo, name)
+        state = self._resume.get(self.journal_key(image, dest_repo))
+        if state is not None and state.plan is not None:
+            record = state.plan
+            return (src_repo, name, dest_name, [tuple(t) for t in record['src_sort_tags']],
+                    state.outstanding(), record['digests'], record.get('size'))
+
+        _plan = planned if planned is not None else self.plan_image(image, dest_repo, source)
+        if self._journal is not None:
+            src_repo, name, dest_name, src_sort_tags, copy_tags, digests, size = _plan
+            self._journal.plan(
+                f'{src_repo}/{name}', f'{dest_repo}/{dest_name}', src_sort_tags, copy_tags, digests, size)
+        return _plan
+
+    def record_copy(self, src_repo: str, name: str, dest_repo: str, dest_name: str, tag: str, digest: str, ok: bool):
+        """ count copy result in metrics and journal """
+        metrics.inc('tags_total', result='copied' if ok else 'failed')
+        metrics.image(f'{src_repo}/{name}', copied=1 if ok else 0, failed=0 if ok else 1)
+        if self._journal is not None:
+            self._journal.copy(f'{src_repo}/{name}', f'{dest_repo}/{dest_name}', tag, digest, ok)
+
+    def finish_image(self, dest_repo: str, plan, copied: Dict[str, bool], seconds: float) -> SyncResult:
+        """ journal image as done, return sync_image() result
+
+        :param plan: ref plan_image()
+        :param copied: copy_tags() result, {tag: True if success}
+        :param seconds: seconds taken to plan and copy image
+        """
+        src_repo, name, dest_name, src_sort_tags, _, digests, size = plan
+        tags = [_tag for (_tag, _) in src_sort_tags]
+        ok = len([tag for tag, success in copied.items() if success])
+        result = SyncResult(
+            image=f'{src_repo}/{name}',
+            dest_name=dest_name,
+            tags=tags,
+            digests=[digests.get(tag) for tag in tags],
+            copied=ok,
+            skipped=len(tags) - len(copied),
+            failed=len(copied) - ok,
+            size=size,
+            seconds=round(seconds, 3))
+        if self._journal is not None:
+            self._journal.done(result.image, f'{dest_repo}/{dest_name}', result.as_dict())
+        return result
+
+    def sync_image(self, image: str, dest_repo: str, planned: Tuple = None) -> SyncResult:
+        """ sync image
 
-        _target_info = target_images_list[0].split('/')
+        :param image: ref plan_image()
+        :param dest_repo(str): e.g. docker.io/gcmirrors
+        :param planned: ref resume_or_plan()
+        """
+        started = time.monotonic()
+        _plan = self.resume_or_plan(image, dest_repo, planned)
+        src_repo, name, dest_name, _, copy_tags, digests, _ = _plan
+        copied = dict()
+        if copy_tags:
+            copied = self.copy_tags(src_repo, name, dest_repo, dest_name, copy_tags, digests)
+
+        # dest tags changed, list it again next time
+        if copy_tags:
+            self.dest_api(dest_repo).invalidate(f'{dest_repo}/{dest_name}')
+
+        return self.finish_image(dest_repo, _plan, copied, time.monotonic() - started)
+
+    def sync_image_fanout(self, image: str, dest_repos: List[str]) -> List[SyncResult]:
+        """ sync image to several dest repos, source is listed once and each dest is planned on its own
+
+        native copy engine reads each source manifest and blob once for all dests need it,
+        skopeo engine copies from source to each dest.
+
+        :param image: ref plan_image()
+        :param dest_repos: e.g. [docker.io/gcmirrors, registry.cn-hangzhou.aliyuncs.com/gcmirrors]
+        :return: sync_image() result of each dest repo
+        """
+        started = time.monotonic()
+        source = None
+        if any(self.journal_key(image, dest_repo) not in self._resume for dest_repo in dest_repos):
+            source = self.list_source(image)
+        plans = [self.resume_or_plan(image, dest_repo, source=source) for dest_repo in dest_repos]
+        src_repo, name = plans[0][0], plans[0][1]
+
+        copied = [dict() for _ in dest_repos]
+        if self.native_copy:
+            # {tag: [index of dest repos need it]}
+            tag_dests = collections.OrderedDict()
+            for i, _plan in enumerate(plans):
+                for tag in _plan[4]:
+                    tag_dests.setdefault(tag, []).append(i)
+            for tag, indexes in tag_dests.items():
+                results = self.copy_tag_fanout(
+                    src_repo, name, [(dest_repos[i], plans[i][2]) for i in indexes], tag)
+                for i, ok in zip(indexes, results):
+                    copied[i][tag] = ok
+                    self.record_copy(src_repo, name, dest_repos[i], plans[i][2], tag, plans[i][5].get(tag), ok)
+        else:
+            for i, (_, _, dest_name, _, copy_tags, digests, _) in enumerate(plans):
+                if copy_tags:
+                    copied[i] = self.copy_tags(src_repo, name, dest_repos[i], dest_name, copy_tags, digests)
+
+        seconds = time.monotonic() - started
+        results = []
+        for dest_repo, _plan, _copied in zip(dest_repos, plans, copied):
+            # dest tags changed, list it again next time
+            if _plan[4]:
+                self.dest_api(dest_repo).invalidate(f'{dest_repo}/{_plan[2]}')
+            results.append(self.finish_image(dest_repo, _plan, _copied, seconds))
+        return results
+
+    def copy_tag_fanout(self, src_repo: str, name: str, dests: List[Tuple[str, str]], tag: str) -> List[bool]:
+        """ copy one tag to several dests with native copy engine, ref Copier.copy_fanout()
+
+        :param dests: [(dest_repo, dest_name), ...]
+        :return: copy result of each dest
+        """
+        for dest_repo, _ in dests:
+            if dest_repo.startswith('docker.io'):
+                ratelimit.acquire(ratelimit.DOCKER_HUB_PUSH)
+        dest_images = [f'{dest_repo}/{dest_name}' for dest_repo, dest_name in dests]
+        hosts = '+'.join(sorted({dest_repo.split('/')[0] for dest_repo, _ in dests}))
+        with metrics.timer('copy', hosts, f'{src_repo}/{name}'), \
+                adaptive.slot(adaptive.COPY, *[dest_repo for dest_repo, _ in dests]):
+            results = self._copier.copy_fanout(f'{src_repo}/{name}', dest_images, tag)
+        return [results[dest_image] for dest_image in dest_images]
+
+    def sync_image_task(self, image: str, dest_repos: List[str], planned: Tuple = None) -> (List[SyncResult], Dict):
+        """ sync_image() or sync_image_fanout() in pool worker, also return metrics recorded by it to main process
+
+        :return: (sync_image() result of each dest repo, metrics)
+        """
+        metrics.drain()
+        if len(dest_repos) == 1:
+            results = [self.sync_image(image, dest_repos[0], planned)]
+        else:
+            results = self.sync_image_fanout(image, dest_repos)
+        return results, metrics.drain()
+
+    def do_sync(self, src_image_list_url: str, thread_pool_size: int, dest_repo: str, debug: bool,
+                docker_api_rate_limit: int = config.DOCKER_HUB_API_RATE_LIMIT,
+                docker_push_rate_limit: int = config.DOCKER_HUB_PUSH_RATE_LIMIT,
+                engine: str = ENGINE_PROCESS, concurrency: int = config.CONCURRENCY,
+                copy_concurrency: int = config.COPY_CONCURRENCY, resume: bool = False,
+                metrics_textfile: str = config.METRICS_TEXTFILE, metrics_json: str = config.METRICS_JSON,
+                profile_path: str = config.PROFILE_PATH, profile_top: int = config.PROFILE_TOP,
+                plan_file: str = '', adaptive_concurrency: bool = config.ADAPTIVE_CONCURRENCY):
+        """ sync all images of src_image_list_url to each of dest_repo
+
+        Docker Hub api calls and pushes of all pool workers draw from shared token buckets,
+        ref https://docs.docker.com/docker-hub/api/latest/#tag/rate-limiting
+
+        :param src_image_list_url: image list urls or local files, separated by comma or whitespace
+        :param thread_pool_size: multiprocessing pool size of process engine
+        :param dest_repo: dest repos separated by comma, source of each image is listed once for all of them
+        :param docker_api_rate_limit: docker hub api calls per minute, 0 is unlimited
+        :param docker_push_rate_limit: docker hub pushes per hour, 0 is unlimited
+        :param engine: `process` runs sync_image in multiprocessing pool,
+            `asyncio` runs listing and skopeo copy as coroutines in one process
+        :param concurrency: max images listing in flight of asyncio engine
+        :param copy_concurrency: max skopeo copy in flight of asyncio engine
+        :param resume: skip images journaled as done and continue unfinished ones, otherwise start a new journal
+        :param metrics_textfile: write run metrics of all workers as prometheus textfile, empty is not write
+        :param metrics_json: write run metrics of all workers as json, empty is not write
+        :param profile_path: cProfile main process and pool workers, write merged pstats to it, empty is not profile
+        :param profile_top: functions listed in profile summary
+        :param plan_file: copy tags of plan written by do_plan() as given instead of listing src_image_list_url,
+            its dest is used instead of dest_repo
+        :param adaptive_concurrency: cap listings and copies in flight per registry host with AIMD limits,
+            ref cisctl.adaptive, the pool of process engine and copy_concurrency grow to ADAPTIVE_MAX under them
+        :return: (sync_image() results of the first dest repo in list order, src org, src repo)
+        """
+        if profile_path:
+            profiling.start(profile_path, profile_top)
+        ratelimit.setup_docker_hub(docker_api_rate_limit, docker_push_rate_limit)
+
+        sources = imagelist.parse_sources(src_image_list_url)
+        first_image = None
+
+        def _images():
+            nonlocal first_image
+            for image in imagelist.iter_images(sources):
+                if first_image is None:
+                    first_image = image
+                yield _normalize_image(image)
+
+        done = dict()
+        if self._journal is not None:
+            if resume:
+                done = self.resume()
+            else:
+                self._journal.truncate()
+
+        if plan_file:
+            # tags planned by `cisctl plan`, nothing is listed
+            tasks = [(image, [_dest_repo], planned) for image, _dest_repo, planned in plan.load(plan_file)]
+            logger.info(f'run plan {plan_file}, {len(tasks)} images')
+        else:
+            tasks = [(image, utils.parse_dest_repos(dest_repo), None) for image in _images()]
+        # README is rendered from results of the first dest of each image
+        first_dests = [_dest_repos[0] for _, _dest_repos, _ in tasks]
+        # {(task index, dest repo): sync_image() result}
+        subprocess_result = dict()
+        for i, (image, _dest_repos, _) in enumerate(tasks):
+            for _dest_repo in _dest_repos:
+                if self.journal_key(image, _dest_repo) in done:
+                    subprocess_result[(i, _dest_repo)] = done[self.journal_key(image, _dest_repo)]
+        # only dests not done yet are synced
+        tasks = [(image, [r for r in _dest_repos if (i, r) not in subprocess_result], planned)
+                 for i, (image, _dest_repos, planned) in enumerate(tasks)]
+
+        def _cost(image, _dest_repos, planned):
+            if not _dest_repos:
+                return None
+            if planned is not None:
+                return scheduler.estimate_cost(planned[4], [])
+            _costs = [c for c in (self.estimate_cost(image, r) for r in _dest_repos) if c is not None]
+            return sum(_costs) if _costs else None
+
+        adaptive.setup({image.split('/')[0] for image, _, _ in tasks} |
+                       {r.split('/')[0] for _, _dest_repos, _ in tasks for r in _dest_repos}, enabled=adaptive_concurrency)
+        if adaptive_concurrency:
+            # per host limits decide how many listings and copies run, pool and semaphore only bound them
+            thread_pool_size = max(thread_pool_size, min(config.ADAPTIVE_MAX, 4 * (os.cpu_count() or 1)))
+            copy_concurrency = max(copy_concurrency, config.ADAPTIVE_MAX)
+
+        costs = [_cost(*task) for task in tasks]
+        order = [i for i in scheduler.longest_first(costs) if tasks[i][1]]
+        logger.info(f'schedule {len(order)} images longest first, '
+                    f'{len([c for c in costs if c is not None])} of them have cached cost')
+
+        if engine == ENGINE_ASYNCIO:
+            logger.info(f'init asyncio engine, concurrency is [{concurrency}], copy concurrency is [{copy_concurrency}]')
+            results = aio.run(self, [tasks[i] for i in order], concurrency, copy_concurrency)
+            for i, task_results in zip(order, results):
+                subprocess_result.update({(i, r): result for r, result in zip(tasks[i][1], task_results)})
+        else:
+            logger.info(f'init multiprocessing pool, main pid is [{os.getpid()}]')
+            initializer, initargs = profiling.initializer(
+                _init_worker, (ratelimit.state(), adaptive.state(), self))
+            p = Pool(thread_pool_size, initializer=initializer, initargs=initargs)
+            # idle workers take the next image from the shared task queue
+            async_results = {i: p.apply_async(_sync_image_task, args=tasks[i]) for i in order}
+            for i, r in async_results.items():
+                task_results, task_metrics = r.get()
+                subprocess_result.update({(i, r): result for r, result in zip(tasks[i][1], task_results)})
+                metrics.merge(task_metrics)
+            p.close()
+            p.join()
+        logger.info('All subprocess done.')
+        if adaptive_concurrency:
+            logger.info(f'adaptive concurrency limits: {adaptive.summary()}')
+        summary = profiling.stop()
+        if summary:
+            logger.info(f'profile summary:\n{summary}')
+        metrics.export(metrics_textfile, metrics_json)
+
+        # images failed with exception have no result
+        result_images_list = [subprocess_result[(i, first_dest)] for i, first_dest in enumerate(first_dests)
+                              if subprocess_result.get((i, first_dest)) is not None]
+
+        if plan_file:
+            # a plan only has the tags to copy, README is not rendered from it
+            return result_images_list, None, None
+        if first_image is None:
+            logger.warning(f'no image found in {sources}')
+            return result_images_list, None, None
+        _target_info = first_image.split('/')
         src_org, src_repo = _target_info[0], _target_info[1]
         return result_images_list, src_org, src_repo
+
+    def do_plan(self, src_image_list_url: str, dest_repo: str, plan_file: str,
+                concurrency: int = config.CONCURRENCY,
+                docker_api_rate_limit: int = config.DOCKER_HUB_API_RATE_LIMIT) -> List[Dict]:
+        """ list source and dest of all images concurrently, write tags need to copy to plan_file, copy nothing
+
+        :param src_image_list_url: ref do_sync()
+        :param dest_repo: ref do_sync()
+        :param plan_file: ndjson file, or json file if it ends with .json, `-` is stdout and logs go to stderr,
+            ref cisctl.v1.plan
+        :param concurrency: max images listing in flight
+        :return: plan records
+        """
+        if plan_file == '-':
+            # plan is read back by `sync --plan-file`, keep logs out of it
+            log_to_stderr()
+        ratelimit.setup_docker_hub(docker_api_rate_limit, 0)
+        images = [_normalize_image(image)
+                  for image in imagelist.iter_images(imagelist.parse_sources(src_image_list_url))]
+
+        dest_repos = utils.parse_dest_repos(dest_repo)
+
+        def _plan_tags(image):
+            try:
+                # source is listed once for all dests
+                source = self.list_source(image)
+                return [record for _dest_repo in dest_repos for record in self.plan_tags(image, _dest_repo, source)]
+            except Exception:
+                logger.exception(f'plan image {image} error')
+                return []
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            records = [record for records in executor.map(_plan_tags, images) for record in records]
+        plan.write(plan_file, records)
+
+        reasons = collections.Counter(record['reason'] for record in records)
+        logger.info(f'plan {len(records)} tags of {len({r["dest"] for r in records})} of {len(images)} images '
+                    f'to copy, reasons: {dict(reasons)}')
+        return records
@@ -0,0 +1,74 @@
+# Copyright 2024 xiexianbin.cn
+# All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#        http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+
+"""compare source and dest manifest digest with HEAD requests, before copy.
+
+`skopeo copy` without `--all` pushes only one platform manifest of a manifest
+list, so the dest digest is the digest of that platform entry, not of the list,
+ref https://www.xiexianbin.cn/container/tools/skopeo/#fq
+"""
+
+import json
+
+import requests
+
+from cisctl import config
+from cisctl import exception
+from cisctl import registry
+from cisctl.logger import logger
+
+
+class DigestVerifier(object):
+
+    def __init__(self, all_platforms: bool = False, platform: str = config.COPY_PLATFORM):
+        """
+        :param all_platforms: dest is copied with every platform, only the manifest list digest matches
+        :param platform: os/architecture copied from a manifest list, e.g. linux/amd64
+        """
+        self.all_platforms = all_platforms
+        self.os, _, self.architecture = platform.partition('/')
+        self._registries = dict()
+
+    def registry(self, host: str) -> registry.Registry:
+        if host not in self._registries:
+            self._registries[host] = registry.Registry(host)
+        return self._registries[host]
+
+    def unchanged(self, src_image: str, dest_image: str, tag: str) -> bool:
+        """ whether dest_image:tag already has the manifest of src_image:tag
+
+        :param src_image: k8s.gcr.io/pause
+        :param dest_image: docker.io/gcmirrors/pause
+        :param tag: latest
+        :return: True if digests match, False if not or unknown
+        """
+        src_host, src_repository = registry.parse_image(src_image)
+        dest_host, dest_repository = registry.parse_image(dest_image)
+        src, dest = self.registry(src_host), self.registry(dest_host)
+        try:
+            dest_digest, _ = dest.head_manifest(dest_repository, tag)
+            if dest_digest is None:
+                return False
+            src_digest, src_media_type = src.head_manifest(src_repository, tag)
+            if src_digest is None or src_digest == dest_digest:
+                return src_digest is not None
+            if self.all_platforms or src_media_type not in registry.MANIFEST_LIST_MEDIA_TYPES:
+                return False
+
+            # dest keeps one platform of the source manifest list
+            _, body, _ = src.get_manifest(src_repository, src_digest)
+            descriptor = registry.select_platform(json.loads(body)['manifests'], self.os, self.architecture)
+            return descriptor['digest'] == dest_digest
+        except (exception.RegistryException, requests.exceptions.RequestException, KeyError, IndexError, ValueError):
+            logger.exception(f'verify digest of {src_image}:{tag} and {dest_image}:{tag} error')
+            return False
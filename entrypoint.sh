@@ -23,7 +23,8 @@ cisctl sync \
   --git-repo "${GIT_REPO}" \
   --thread-pool-size ${THREAD_POOL_NUM:-2} \
   --dest-repo "${DEST_REPO}" \
-  --job-batch-size ${JOB_BATCH_COUNT:-3} \
+  --docker-api-rate-limit ${DOCKER_HUB_API_RATE_LIMIT:-180} \
+  --docker-push-rate-limit ${DOCKER_HUB_PUSH_RATE_LIMIT:-0} \
   --src-image-list-url "${SRC_IMAGE_LIST_URL}" \
   --after-timeuploadedms "${AFTER_TIMEUPLOADEDMS:-0}" \
   --debug